@@ -0,0 +1,103 @@
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from scripts.data_analysis import compare_fees
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+
+def make_logs(dump_rows, seed=0):
+    """Генерирует синтетические own_trade_log и dump_log заданного размера."""
+    rng = np.random.default_rng(seed)
+    n_trades = max(dump_rows // 2, 1)
+
+    trace_ids = rng.choice(np.iinfo(np.int64).max, size=n_trades, replace=False)
+    price = rng.uniform(0.1, 200, n_trades).round(4)
+    base_amount = rng.uniform(0.01, 100, n_trades).round(2)
+    fee_amount = (price * base_amount * 0.002).round(8)
+    fee_asset = rng.choice(["USDT", "BTC", "GT"], n_trades)
+
+    own_trade_log = pd.DataFrame(
+        {
+            "trace_id": trace_ids,
+            "side": rng.choice(["Ask", "Bid"], n_trades),
+            "role": rng.choice(["Maker", "Taker"], n_trades),
+            "price": price,
+            "base_amount": base_amount,
+            "base_asset_name": "BTC",
+            "quote_asset_name": "USDT",
+            "fee_amount": fee_amount,
+            "fee_asset_name": fee_asset,
+            "is_fee_evaluated": rng.choice([True, False], n_trades),
+        }
+    )
+
+    # Половина строк dump_log — по одному входящему WsPayload с комиссией на сделку,
+    # остальные — шум по тем же сделкам (исходящие сообщения и пинги), который отсеивает фильтр
+    # Комиссия в GT передается в gt_fee, остальные — в fee с валютой сделки
+    fee_messages = [
+        json.dumps({"data": {"result": [{"fee": "0", "fee_currency": "", "gt_fee": f"{fee:.18f}"}]}})
+        if asset == "GT"
+        else json.dumps({"data": {"result": [{"fee": f"{fee:.18f}", "fee_currency": asset, "gt_fee": "0"}]}})
+        for fee, asset in zip(fee_amount, fee_asset)
+    ]
+    noise_rows = max(dump_rows - n_trades, 0)
+    noise_trades = rng.integers(0, n_trades, noise_rows)
+    is_ping = rng.random(noise_rows) < 0.5
+    dump_log = pd.DataFrame(
+        {
+            "trace_id": np.r_[trace_ids, trace_ids[noise_trades]],
+            "direction": np.r_[np.full(n_trades, "In"), np.where(is_ping, "In", "Out")],
+            "message_name": np.r_[np.full(n_trades, "WsPayload"), np.where(is_ping, "WsPing", "WsPayload")],
+            "message_kind": "Regular",
+            "message": np.r_[
+                np.array(fee_messages, dtype=object),
+                np.where(is_ping, '{"channel": "spot.ping"}', '{"channel": "spot.order", "event": "subscribe"}'),
+            ],
+        }
+    )
+    # Сообщения сделок и шум перемешаны, как в реальном логе
+    dump_log = dump_log.iloc[rng.permutation(len(dump_log))].reset_index(drop=True)
+
+    order_log = pd.DataFrame({"order_id": []})
+    return own_trade_log, dump_log, order_log
+
+
+def run(sizes):
+    """Замеряет время compare_fees для каждого размера dump_log."""
+    results = []
+    for size in sizes:
+        own_trade_log, dump_log, order_log = make_logs(size)
+        start = time.perf_counter()
+        comparison_df = compare_fees(own_trade_log, dump_log, order_log)
+        elapsed = time.perf_counter() - start
+        results.append(
+            {
+                "dump_rows": size,
+                "trades": len(own_trade_log),
+                "output_rows": len(comparison_df),
+                "seconds": round(elapsed, 3),
+                "dump_rows_per_second": round(size / elapsed) if elapsed else None,
+            }
+        )
+        logging.info(f"compare_fees: {size} dump rows in {elapsed:.3f}s")
+    return pd.DataFrame(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compare_fees on synthetic logs.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Dump log sizes (rows)")
+    args = parser.parse_args()
+    print(run(args.sizes).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
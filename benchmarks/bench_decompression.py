@@ -0,0 +1,155 @@
+import argparse
+import gzip
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic_logs import write_synthetic_logs
+from scripts.data_analysis import compare_fees, load_data
+from utils.compressed_input import COMPRESSION_SUFFIXES, DECOMPRESS_BLOCK_SIZE, open_decompressed, zstandard
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+INPUT_NAMES = ("own_trade_log", "dump_log", "order_log")
+VARIANTS = ("csv", "gzip", "zstd")
+COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+
+
+def compressed_path(path, compression):
+    suffix = next(suffix for suffix, name in COMPRESSION_SUFFIXES.items() if name == compression)
+    return Path(f"{path}{suffix}")
+
+
+def _writer(path, compression, level):
+    if compression == "gzip":
+        return gzip.open(path, "wb", compresslevel=level)
+    return zstandard.ZstdCompressor(level=level).stream_writer(open(path, "wb"))
+
+
+def compress_inputs(paths, compression, level=None):
+    """Пишет сжатые копии входных файлов рядом с исходными; уже сжатые копии используются повторно."""
+    level = COMPRESSION_LEVELS[compression] if level is None else level
+    compressed = {}
+    for name, path in paths.items():
+        target = compressed_path(path, compression)
+        if not target.exists():
+            temp_path = target.with_name(f".{target.name}.tmp")
+            with open(path, "rb") as source, _writer(temp_path, compression, level) as output:
+                shutil.copyfileobj(source, output, DECOMPRESS_BLOCK_SIZE)
+            os.replace(temp_path, target)
+        compressed[name] = target
+    return compressed
+
+
+def decompress_seconds(paths):
+    """Время одной распаковки всех файлов в основном потоке, без разбора."""
+    start = time.perf_counter()
+    for path in paths.values():
+        with open_decompressed(path) as source:
+            while source.read(DECOMPRESS_BLOCK_SIZE):
+                pass
+    return time.perf_counter() - start
+
+
+def end_to_end(paths, chunksize=None):
+    """Чтение, разбор CSV и комиссий из сообщений и сравнение: load_data и compare_fees."""
+    load_options = {"chunksize": chunksize} if chunksize else {}
+    start = time.perf_counter()
+    own_trade_log, dump_log, order_log = load_data(*(paths[name] for name in INPUT_NAMES), **load_options)
+    rows = len(compare_fees(own_trade_log, dump_log, order_log))
+    return time.perf_counter() - start, rows
+
+
+def run(paths, variants=VARIANTS, repeat=1, chunksize=None, levels=None):
+    """
+    Сравнивает сквозное время на несжатых и сжатых входных файлах (лучшее из repeat).
+    Для сжатых вариантов считаются также время распаковки без разбора, его доля,
+    скрытая за разбором (overlap_seconds: распаковка + несжатый прогон - сжатый прогон),
+    и пропускная способность диска, ниже которой сжатый вариант быстрее несжатого
+    (break_even_disk_mb_per_s: разница объемов чтения к разнице времени на процессоре).
+    """
+    levels = levels or {}
+    raw_mb = sum(os.path.getsize(path) for path in paths.values()) / 2**20
+    results = {}
+    for variant in variants:
+        if variant == "zstd" and zstandard is None:
+            logging.warning("zstandard is not installed, zstd variant skipped.")
+            continue
+        variant_paths = paths if variant == "csv" else compress_inputs(paths, variant, levels.get(variant))
+        seconds, rows = min(end_to_end(variant_paths, chunksize) for _ in range(max(repeat, 1)))
+        input_mb = sum(os.path.getsize(path) for path in variant_paths.values()) / 2**20
+        results[variant] = {
+            "input_mb": round(input_mb, 2),
+            "seconds": round(seconds, 3),
+            "mb_per_s": round(raw_mb / seconds, 1),
+            "rows": rows,
+        }
+        if variant != "csv":
+            unpack = decompress_seconds(variant_paths)
+            results[variant]["decompress_seconds"] = round(unpack, 3)
+            if "csv" in results:
+                plain = results["csv"]
+                results[variant]["overlap_seconds"] = round(max(unpack + plain["seconds"] - seconds, 0.0), 3)
+                extra_cpu = seconds - plain["seconds"]
+                saved_mb = plain["input_mb"] - input_mb
+                results[variant]["break_even_disk_mb_per_s"] = (
+                    round(saved_mb / extra_cpu, 1) if extra_cpu > 0 else None
+                )
+        logging.info(f"{variant}: {seconds:.3f}s, {raw_mb / seconds:.1f} MB/s of uncompressed input")
+    return results
+
+
+def format_report(results):
+    lines = [
+        f"{'input':<8}{'MB':>10}{'seconds':>10}{'MB/s':>9}{'unpack s':>10}{'overlap s':>11}{'break-even MB/s':>17}"
+    ]
+    for variant, measured in results.items():
+        break_even = measured.get("break_even_disk_mb_per_s")
+        lines.append(
+            f"{variant:<8}{measured['input_mb']:>10}{measured['seconds']:>10.3f}{measured['mb_per_s']:>9}"
+            f"{measured.get('decompress_seconds', '-'):>10}{measured.get('overlap_seconds', '-'):>11}"
+            f"{'-' if break_even is None else break_even:>17}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare load + compare throughput on plain and compressed logs.")
+    parser.add_argument("--trades", type=int, default=1_000_000, help="Number of synthetic trades")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator")
+    parser.add_argument("--data-dir", help="Keep generated and compressed logs here and reuse them on later runs")
+    parser.add_argument("--variants", nargs="+", choices=VARIANTS, default=list(VARIANTS), help="Inputs to compare")
+    parser.add_argument("--gzip-level", type=int, default=COMPRESSION_LEVELS["gzip"], help="gzip compression level")
+    parser.add_argument("--zstd-level", type=int, default=COMPRESSION_LEVELS["zstd"], help="zstd compression level")
+    parser.add_argument("--chunksize", type=int, help="dump_log chunk size for load_data")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per input; the best time is kept")
+    parser.add_argument("--output", help="Write the measurements to this JSON file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = Path(args.data_dir or temp_dir) / f"{args.trades}_{args.seed}"
+        paths = {name: data_dir / f"{name}.csv" for name in INPUT_NAMES}
+        if not all(path.exists() for path in paths.values()):
+            paths = write_synthetic_logs(data_dir, args.trades, args.seed)
+        results = run(
+            paths,
+            args.variants,
+            args.repeat,
+            args.chunksize,
+            {"gzip": args.gzip_level, "zstd": args.zstd_level},
+        )
+    print(format_report(results))
+    if args.output:
+        Path(args.output).write_text(json.dumps({"params": vars(args), "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
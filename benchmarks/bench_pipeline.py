@@ -0,0 +1,187 @@
+import argparse
+import json
+import logging
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.synthetic_logs import write_synthetic_logs
+from scripts.data_analysis import compare_fees, load_data
+from scripts.inconsistency_detection import FEATURES, MISMATCH_TYPES, build_summary_cube, detect_mismatches
+from utils.analyze_mismatch_influence import slice_mismatch_cube
+from utils.instrumentation import _peak_rss_bytes
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+BASELINE_PATH = "benchmarks/baseline.json"
+# Этап считается замедлившимся, если он дольше базового больше чем на эту долю
+REGRESSION_TOLERANCE = 0.25
+# Этапы короче этого времени не сравниваются: их разброс больше самого замера
+MIN_COMPARED_SECONDS = 0.05
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса и его завершившихся дочерних процессов; None без модуля resource (не Unix)."""
+    peak = _peak_rss_bytes()
+    return None if peak is None else round(peak / 2**20, 1)
+
+
+def timed(results, stage, function, *args, **kwargs):
+    """Выполняет этап, записывая время, пиковый RSS после него и число строк результата."""
+    start = time.perf_counter()
+    output = function(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    rows = output if isinstance(output, int) else len(output)
+    results[stage] = {"seconds": round(elapsed, 3), "peak_rss_mb": peak_rss_mb(), "rows": rows}
+    logging.info(f"{stage}: {elapsed:.3f}s, {rows} rows, peak RSS {results[stage]['peak_rss_mb']} MB")
+    return output
+
+
+def influence_analysis(mismatched_data):
+    """Анализ влияния признаков, как в inconsistency_detection: куб агрегатов и его срезы."""
+    cube = build_summary_cube(mismatched_data)
+    return sum(
+        len(slice_mismatch_cube(cube, mismatch_type, feature))
+        for mismatch_type in MISMATCH_TYPES
+        for feature in FEATURES
+    )
+
+
+def run(paths, chunksize=None, workers=1, plots=True, plot_workers=None):
+    """Прогоняет конвейер по файлам paths, замеряя каждый этап отдельно."""
+    results = {}
+    load_options = {"chunksize": chunksize} if chunksize else {}
+    own_trade_log, dump_log, order_log = timed(
+        results,
+        "load_data",
+        load_data,
+        paths["own_trade_log"],
+        paths["dump_log"],
+        paths["order_log"],
+        workers=workers,
+        **load_options,
+    )
+    results["load_data"]["rows"] = len(dump_log)
+    comparison_df = timed(results, "compare_fees", compare_fees, own_trade_log, dump_log, order_log)
+    mismatched_data = timed(results, "detect_mismatches", detect_mismatches, comparison_df)
+    timed(results, "influence_analysis", influence_analysis, mismatched_data)
+    if plots:
+        # Графическая библиотека загружается только при построении графиков
+        from utils.visualization import visualize_mismatches
+
+        mismatch_types = [column for column in MISMATCH_TYPES if column in mismatched_data.columns]
+        with tempfile.TemporaryDirectory() as chart_dir:
+            timed(
+                results,
+                "visualization",
+                visualize_mismatches,
+                mismatched_data,
+                mismatch_types,
+                FEATURES,
+                output_dir=chart_dir,
+                workers=plot_workers,
+            )
+    return results
+
+
+def best_of(runs):
+    """Объединяет повторные прогоны: лучшее время этапа и наибольший пиковый RSS."""
+    best = {}
+    for stages in runs:
+        for stage, measured in stages.items():
+            current = best.setdefault(stage, dict(measured))
+            current["seconds"] = min(current["seconds"], measured["seconds"])
+            if measured["peak_rss_mb"] is not None:
+                current["peak_rss_mb"] = max(current["peak_rss_mb"], measured["peak_rss_mb"])
+    return best
+
+
+def compare_with_baseline(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """
+    Сравнивает замеры с базовыми. Возвращает список замечаний: замедление этапа больше
+    чем на tolerance и любое изменение числа строк (данные детерминированы при том же seed).
+    """
+    problems = []
+    for stage, measured in results["stages"].items():
+        reference = baseline["stages"].get(stage)
+        if reference is None:
+            continue
+        if measured["rows"] != reference["rows"]:
+            problems.append(f"{stage}: {measured['rows']} rows, baseline {reference['rows']}")
+        if reference["seconds"] >= MIN_COMPARED_SECONDS and measured["seconds"] > reference["seconds"] * (1 + tolerance):
+            problems.append(
+                f"{stage}: {measured['seconds']:.3f}s, baseline {reference['seconds']:.3f}s "
+                f"(+{measured['seconds'] / reference['seconds'] - 1:.0%})"
+            )
+    return problems
+
+
+def format_report(results, baseline=None):
+    lines = [f"{'stage':<20}{'seconds':>10}{'baseline':>10}{'ratio':>8}{'peak RSS MB':>13}{'rows':>12}"]
+    for stage, measured in results["stages"].items():
+        reference = (baseline or {}).get("stages", {}).get(stage)
+        base_seconds = f"{reference['seconds']:.3f}" if reference else "-"
+        ratio = f"{measured['seconds'] / reference['seconds']:.2f}" if reference and reference["seconds"] else "-"
+        lines.append(
+            f"{stage:<20}{measured['seconds']:>10.3f}{base_seconds:>10}{ratio:>8}"
+            f"{measured['peak_rss_mb'] or '-':>13}{measured['rows']:>12}"
+        )
+    return "\n".join(lines)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic logs.")
+    parser.add_argument("--trades", type=int, default=100_000, help="Number of synthetic trades")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generator")
+    parser.add_argument("--data-dir", help="Keep generated logs here and reuse them on later runs")
+    parser.add_argument("--chunksize", type=int, help="dump_log chunk size for load_data")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for reading dump_log")
+    parser.add_argument("--plot-workers", type=int, help="Processes for rendering charts")
+    parser.add_argument("--no-plots", action="store_true", help="Skip the visualization stage")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the best time is kept")
+    parser.add_argument("--output", help="Write the measurements to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store this run as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=REGRESSION_TOLERANCE, help="Allowed slowdown per stage")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    params = {"trades": args.trades, "seed": args.seed, "workers": args.workers}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        data_dir = Path(args.data_dir or temp_dir) / f"{args.trades}_{args.seed}"
+        paths = {name: data_dir / f"{name}.csv" for name in ("own_trade_log", "dump_log", "order_log")}
+        if not all(path.exists() for path in paths.values()):
+            paths = write_synthetic_logs(data_dir, args.trades, args.seed)
+        stages = best_of(
+            run(paths, args.chunksize, args.workers, not args.no_plots, args.plot_workers)
+            for _ in range(max(args.repeat, 1))
+        )
+    results = {"params": params, "stages": stages}
+
+    baseline_path = Path(args.baseline)
+    baseline = json.loads(baseline_path.read_text()) if baseline_path.exists() else None
+    if baseline is not None and baseline.get("params") != params:
+        logging.warning(f"Baseline {baseline_path} was recorded with {baseline.get('params')}, not compared.")
+        baseline = None
+    print(format_report(results, baseline))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        baseline_path.write_text(json.dumps(results, indent=2))
+        logging.info(f"Baseline saved to {baseline_path}")
+    elif baseline is not None:
+        problems = compare_with_baseline(results, baseline, args.tolerance)
+        for problem in problems:
+            logging.warning(f"Regression: {problem}")
+        if problems and args.fail_on_regression:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
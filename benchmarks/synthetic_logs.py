@@ -0,0 +1,260 @@
+import argparse
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow не обязателен: без него файлы пишутся через to_csv pandas
+    pa = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Инструменты (база к USDT) и примерные цены базовых активов
+INSTRUMENTS = {
+    "ADA": 0.61,
+    "DOGE": 0.16,
+    "ETH": 3400.0,
+    "SOL": 175.0,
+    "XRP": 0.62,
+    "WAVES": 2.6,
+    "BTC": 64000.0,
+}
+GT_PRICE = 9.9
+ACCOUNTS = ["gt.sub1", "gt.sub2", "gt.main"]
+TAKER_FEE_RATE = 0.002
+MAKER_FEE_RATE = 0.001
+# Скидка на комиссию при оплате в GT
+GT_DISCOUNT = 0.85
+# Доли: комиссия в GT / в котируемой валюте (остальное — в базовой)
+FEE_ASSET_SHARES = (0.6, 0.25)
+# Доля сообщений, где result — объект, а не список, и доля сообщений с двумя частичными исполнениями
+DICT_RESULT_SHARE = 0.1
+SPLIT_FILL_SHARE = 0.05
+# Доля сделок, у которых комиссия биржи отличается от комиссии платформы
+MISMATCH_SHARE = 0.02
+# Число строк-шума dump_log (исходящие сообщения, пинги, чужие trace_id) на сделку
+NOISE_PER_TRADE = 1.0
+GENERATOR_CHUNK_SIZE = 250_000
+START_TIME = pd.Timestamp("2024-03-23")
+DAY_NS = 86_400 * 10**9
+# Нечетный множитель дает биекцию на uint64: trace_id уникальны и выглядят случайными
+TRACE_ID_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _decimal_text(values):
+    """Записывает суммы в 18-знаковом виде, как в логах платформы и биржи."""
+    return pd.Series(np.char.mod("%.18f", values), dtype=object)
+
+
+def _trace_ids(positions, seed):
+    with np.errstate(over="ignore"):
+        return (positions.astype(np.uint64) + np.uint64(seed) + np.uint64(1)) * TRACE_ID_MULTIPLIER
+
+
+def make_trades(start, size, seed=0, trades_total=None):
+    """
+    Генерирует часть own_trade_log: сделки с номерами [start, start + size).
+    Время сделок равномерно распределено по суткам и растет с номером сделки.
+    Ордера не выходят за пределы части, поэтому части можно генерировать независимо.
+    """
+    rng = np.random.default_rng([seed, start])
+    trades_total = trades_total or start + size
+    positions = np.arange(start, start + size, dtype=np.int64)
+    offsets = (positions * (DAY_NS // max(trades_total, 1))) + rng.integers(0, max(DAY_NS // max(trades_total, 1), 1), size)
+    platform_time = START_TIME + pd.to_timedelta(offsets)
+
+    bases = np.array(list(INSTRUMENTS))
+    base = bases[rng.integers(0, len(bases), size)]
+    price = np.array([INSTRUMENTS[asset] for asset in base]) * rng.uniform(0.98, 1.02, size)
+    base_amount = np.round(rng.uniform(1, 500, size) / price, 4) + 0.0001
+    quote_amount = price * base_amount
+    role = np.where(rng.random(size) < 0.5, "Maker", "Taker")
+
+    draw = rng.random(size)
+    fee_asset = np.where(
+        draw < FEE_ASSET_SHARES[0], "GT", np.where(draw < sum(FEE_ASSET_SHARES), "USDT", base)
+    ).astype(object)
+    rate = np.where(role == "Taker", TAKER_FEE_RATE, MAKER_FEE_RATE)
+    fee_quote = quote_amount * rate * np.where(fee_asset == "GT", GT_DISCOUNT, 1.0)
+    fee_price = np.where(fee_asset == "GT", GT_PRICE, np.where(fee_asset == "USDT", 1.0, price))
+    fee_amount = np.round(fee_quote / fee_price, 12)
+
+    # Ордер — несколько подряд идущих сделок (в среднем 1.5 исполнения)
+    new_order = np.r_[True, rng.random(size - 1) < 0.67] if size else np.zeros(0, dtype=bool)
+    order_number = start + np.cumsum(new_order) - 1
+
+    return pd.DataFrame(
+        {
+            "platform_time": platform_time,
+            "exchange_time": platform_time.floor("ms") - pd.to_timedelta(rng.integers(1, 10, size), unit="ms"),
+            "trace_id": _trace_ids(positions, seed),
+            "account_name": np.array(ACCOUNTS, dtype=object)[rng.integers(0, len(ACCOUNTS), size)],
+            "instrument_name": pd.Series(base, dtype=object) + "_USDT|GateioSpot",
+            "trade_id": (1_990_000_000_000 + positions).astype(np.uint64),
+            "exchange_trade_id": (800_000_000 + positions).astype(str),
+            "order_id": (305_720_000_000_000 + order_number).astype(np.uint64),
+            "exchange_order_id": (539_669_000_000 + order_number).astype(str),
+            "side": np.where(rng.random(size) < 0.5, "Ask", "Bid"),
+            "role": role,
+            "price": price,
+            "base_amount": base_amount,
+            "base_asset_name": base,
+            "quote_amount": quote_amount,
+            "quote_asset_name": "USDT",
+            "fee_amount": _decimal_text(fee_amount),
+            "fee_asset_name": fee_asset,
+            "is_fee_evaluated": rng.random(size) < 0.5,
+            "source": "OrderChange",
+        }
+    )
+
+
+def make_orders(trades):
+    """Генерирует order_log для сделок: запись New до первого исполнения и Filled на последнем."""
+    grouped = trades.groupby("order_id", sort=False)
+    orders = grouped.agg(
+        first_time=("platform_time", "min"),
+        last_time=("platform_time", "max"),
+        trace_id=("trace_id", "first"),
+        account_name=("account_name", "first"),
+        instrument_name=("instrument_name", "first"),
+        exchange_order_id=("exchange_order_id", "first"),
+        side=("side", "first"),
+    ).reset_index()
+    columns = ["platform_time", "trace_id", "account_name", "instrument_name", "order_id", "exchange_order_id", "status", "side"]
+    placed = orders.assign(platform_time=orders["first_time"] - pd.Timedelta("50ms"), status="New")
+    filled = orders.assign(platform_time=orders["last_time"], status="Filled")
+    return pd.concat([placed[columns], filled[columns]]).sort_values("platform_time", kind="stable")
+
+
+def _fill_json(fill_ids, fees, fee_currencies, gt_fees):
+    return (
+        '{"id": ' + fill_ids + ', "create_time": 1711152591, "fee": "' + fees + '", "fee_currency": "'
+        + fee_currencies + '", "point_fee": "0", "gt_fee": "' + gt_fees + '", "text": "t-bench"}'
+    )
+
+
+def make_dump_messages(trades, seed=0):
+    """
+    Генерирует dump_log для сделок: по одному входящему WsPayload Gate.io spot.usertrades
+    на сделку (result — список, иногда объект или два частичных исполнения) и строки-шум.
+    Комиссия в GT передается в gt_fee, остальные — в fee; часть комиссий искажена.
+    """
+    size = len(trades)
+    rng = np.random.default_rng([seed, int(trades["trade_id"].iloc[0]) if size else 0, 1])
+    fee = pd.to_numeric(trades["fee_amount"]).to_numpy()
+    fee = np.where(rng.random(size) < MISMATCH_SHARE, fee * 1.1, fee)
+    is_gt = (trades["fee_asset_name"] == "GT").to_numpy()
+    fee_currency = trades["fee_asset_name"].where(~is_gt, "").astype(object)
+    fill_ids = trades["exchange_trade_id"].astype(object)
+
+    split = rng.random(size) < SPLIT_FILL_SHARE
+    first_share = np.where(split, 0.4, 1.0)
+    first = _fill_json(
+        fill_ids,
+        _decimal_text(np.where(is_gt, 0.0, fee * first_share)),
+        fee_currency,
+        _decimal_text(np.where(is_gt, fee * first_share, 0.0)),
+    )
+    second = _fill_json(
+        fill_ids + "1",
+        _decimal_text(np.where(is_gt, 0.0, fee * (1 - first_share))),
+        fee_currency,
+        _decimal_text(np.where(is_gt, fee * (1 - first_share), 0.0)),
+    )
+    as_dict = ~split & (rng.random(size) < DICT_RESULT_SHARE)
+    result = pd.Series(np.where(as_dict, first, "[" + first + "]"), dtype=object)
+    result[split] = "[" + first[split] + ", " + second[split] + "]"
+    messages = '{"time": 1711152591, "channel": "spot.usertrades", "event": "update", "result": ' + result + "}"
+    messages = '{"data": ' + messages + "}"
+
+    trade_rows = pd.DataFrame(
+        {
+            "time": trades["platform_time"].to_numpy(),
+            "trace_id": trades["trace_id"].to_numpy(),
+            "direction": "In",
+            "message_name": "WsPayload",
+            "message_kind": "Regular",
+            "message": messages.to_numpy(),
+        }
+    )
+
+    noise_size = int(size * NOISE_PER_TRADE)
+    noise_kind = rng.integers(0, 3, noise_size)
+    noise_trades = rng.integers(0, max(size, 1), noise_size)
+    noise = pd.DataFrame(
+        {
+            "time": trades["platform_time"].to_numpy()[noise_trades] if size else np.array([], dtype="datetime64[ns]"),
+            # Исходящие сообщения по тем же сделкам, пинги и сообщения других клиентов
+            "trace_id": np.where(
+                noise_kind == 2,
+                _trace_ids(noise_trades + 10**12, seed),
+                trades["trace_id"].to_numpy()[noise_trades] if size else np.array([], dtype=np.uint64),
+            ).astype(np.uint64),
+            "direction": np.where(noise_kind == 0, "Out", "In"),
+            "message_name": np.where(noise_kind == 1, "WsPing", "WsPayload"),
+            "message_kind": "Regular",
+            "message": np.where(
+                noise_kind == 1, '{"channel": "spot.ping"}', messages.to_numpy()[noise_trades] if size else ""
+            ),
+        }
+    )
+    rows = pd.concat([trade_rows, noise], ignore_index=True).sort_values("time", kind="stable")
+    return rows.drop(columns="time")
+
+
+def _append_csv(frame, path, header):
+    """Дописывает часть в CSV; CSV-писатель pyarrow в несколько раз быстрее to_csv."""
+    if pa is None:
+        frame.to_csv(path, mode="w" if header else "a", header=header, index=False)
+        return
+    with open(path, "wb" if header else "ab") as file:
+        pa_csv.write_csv(
+            pa.Table.from_pandas(frame, preserve_index=False),
+            file,
+            pa_csv.WriteOptions(include_header=header, quoting_style="needed"),
+        )
+
+
+def write_synthetic_logs(output_dir, trades, seed=0, chunk_size=GENERATOR_CHUNK_SIZE):
+    """
+    Пишет own_trade_log.csv, order_log.csv и dump_log.csv с trades сделками в output_dir.
+    Данные генерируются и дописываются частями по chunk_size сделок, поэтому память
+    не зависит от размера. Возвращает пути файлов.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = {name: output_dir / f"{name}.csv" for name in ("own_trade_log", "dump_log", "order_log")}
+
+    start_time = time.perf_counter()
+    for start in range(0, max(trades, 1), chunk_size):
+        size = min(chunk_size, trades - start)
+        chunk = make_trades(start, size, seed, trades)
+        header = start == 0
+        _append_csv(chunk, paths["own_trade_log"], header)
+        _append_csv(make_orders(chunk), paths["order_log"], header)
+        _append_csv(make_dump_messages(chunk, seed), paths["dump_log"], header)
+        logging.info(f"Generated {start + size}/{trades} trades")
+
+    logging.info(f"Synthetic logs written to {output_dir} in {time.perf_counter() - start_time:.1f}s")
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic own_trade_log, order_log and dump_log files.")
+    parser.add_argument("--trades", type=int, default=100_000, help="Number of trades")
+    parser.add_argument("--output-dir", default="benchmarks/data", help="Directory for the generated logs")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--chunk-size", type=int, default=GENERATOR_CHUNK_SIZE, help="Trades generated at once")
+    args = parser.parse_args(argv)
+    write_synthetic_logs(args.output_dir, args.trades, args.seed, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
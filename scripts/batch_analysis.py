@@ -0,0 +1,535 @@
+import argparse
+import json
+import logging
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.data_analysis import (
+    DUMP_LOG_CHUNKSIZE,
+    DUMP_LOG_COLUMNS,
+    DUMP_LOG_DTYPES,
+    GROUPED_OUTPUTS,
+    aggregate_comparison_data,
+    compare_fees,
+    filter_dump_log,
+    finalize_grouped_data,
+    merge_partial_aggregates,
+    negate_partial_aggregates,
+    parse_dump_log,
+    read_order_summary,
+    read_own_trade_log,
+    save_grouped_data,
+    trade_venues,
+)
+from scripts.inconsistency_detection import (
+    ASSET_COLUMNS,
+    FEATURES,
+    MISMATCH_TYPES,
+    build_summary_cube,
+    detect_mismatches,
+    save_mismatches,
+    schedule_mismatch_types,
+    summarize_grouped_mismatches,
+    summarize_mismatches,
+)
+from utils.analyze_mismatch_influence import (
+    merge_mismatch_cubes,
+    negate_mismatch_cube,
+    save_analysis_results,
+    slice_mismatch_cube,
+)
+from utils.compressed_input import csv_input, resolve_input
+from utils.fee_schedule import load_fee_schedule
+from utils.order_enrichment import attach_order_info
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+BATCH_DATA_ROOT = "data"
+BATCH_OUTPUT_DIR = "output/batch"
+# Дата в имени каталога дня: data/2024-03-23/ или data/date=2024-03-23/
+DATE_PATTERN = re.compile(r"(\d{4}-\d{2}-\d{2})")
+INPUT_FILES = {
+    "own_trade_log": "own_trade_log.csv",
+    "dump_log": "dump_log.csv",
+    "order_log": "order_log.csv",
+}
+# Оценка пиковой памяти задания дня: байт в памяти на байт входного файла.
+# own_trade_log хранится целиком, из dump_log — только разобранные комиссии и
+# сообщения чужих сделок, из order_log — свертка по ордерам (только с --enrich-orders)
+MEMORY_PER_INPUT_BYTE = {"own_trade_log": 2.0, "dump_log": 0.5, "order_log": 1.0}
+# Память процесса-исполнителя без данных (интерпретатор, pandas)
+JOB_BASE_MEMORY_MB = 200
+MEMORY_BUDGET_MB = 4096
+# Источники частичных агрегатов дня: задание дня и перенос через полночь
+PARTIAL_SOURCES = ("day", "carried")
+CUBE_FILE = "mismatch_cube.csv"
+COUNTS_FILE = "counts.json"
+COUNT_KEYS = ["trades", "comparison_rows", "mismatched_rows", "unmatched_trades", "unmatched_dump_entries"]
+SUMMARY_OUTPUT = "batch_summary.csv"
+
+
+def discover_partitions(data_root=BATCH_DATA_ROOT, start=None, end=None):
+    """
+    Находит каталоги дней в data_root: имя каталога содержит дату (YYYY-MM-DD),
+    а внутри лежат все три лога INPUT_FILES (несжатые или .gz, .zst). Дни без одного из логов пропускаются
+    с предупреждением. start и end (включительно) ограничивают диапазон дат.
+    Возвращает словарь дата -> пути к логам, упорядоченный по дате.
+    """
+    partitions = {}
+    for directory in sorted(Path(data_root).iterdir()):
+        match = DATE_PATTERN.search(directory.name)
+        if not directory.is_dir() or not match:
+            continue
+        date = match.group(1)
+        if (start and date < start) or (end and date > end):
+            continue
+        paths = {name: resolve_input(directory / file_name) for name, file_name in INPUT_FILES.items()}
+        missing = [name for name, path in paths.items() if not path.exists()]
+        if missing:
+            logging.warning(f"Partition {directory} has no {missing}, skipping it.")
+            continue
+        if date in partitions:
+            raise ValueError(f"Two partitions for {date}: {partitions[date]['own_trade_log'].parent} and {directory}")
+        partitions[date] = paths
+    return dict(sorted(partitions.items()))
+
+
+def estimate_day_memory_mb(paths, enrich_orders=False):
+    """Оценивает пиковую память задания дня по размерам его входных файлов."""
+    total = JOB_BASE_MEMORY_MB * 2**20
+    for name, path in paths.items():
+        if name == "order_log" and not enrich_orders:
+            continue
+        total += os.path.getsize(path) * MEMORY_PER_INPUT_BYTE[name]
+    return total / 2**20
+
+
+def run_jobs(jobs, function, workers=None, memory_budget_mb=MEMORY_BUDGET_MB, executor_class=ProcessPoolExecutor):
+    """
+    Выполняет задания jobs (ключ -> (оценка памяти в МБ, аргументы function)) в пуле
+    из workers исполнителей. Задания запускаются в порядке jobs, пока сумма оценок
+    выполняющихся заданий не превышает memory_budget_mb; следующее ждет завершения
+    одного из них. Задание больше бюджета запускается только в одиночку.
+    Возвращает словарь ключ -> результат function.
+    """
+    queue = list(jobs.items())
+    results = {}
+    running = {}
+    workers = workers or os.cpu_count()
+    with executor_class(max_workers=workers) as pool:
+        while queue or running:
+            while queue and len(running) < workers:
+                key, (memory_mb, args) = queue[0]
+                used = sum(estimate for _, estimate in running.values())
+                if running and used + memory_mb > memory_budget_mb:
+                    break
+                if memory_mb > memory_budget_mb:
+                    logging.warning(f"Job {key} needs ~{memory_mb:.0f} MB, over the {memory_budget_mb} MB budget.")
+                queue.pop(0)
+                running[pool.submit(function, *args)] = (key, memory_mb)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, _ = running.pop(future)
+                try:
+                    results[key] = future.result()
+                except Exception as e:
+                    logging.error(f"Job {key} failed: {e}")
+                    raise
+    return results
+
+
+def split_dump_log(dump_log_path, trace_ids, chunksize=DUMP_LOG_CHUNKSIZE, all_fills=False, venues=None):
+    """
+    Читает dump_log дня частями и делит сообщения по trace_id сделок дня: сообщения сделок
+    сразу разбираются (parse_dump_log), остальные сохраняются неразобранными — это могут быть
+    исполнения сделок соседнего дня, а их биржа станет известна только при переносе.
+    Возвращает записи комиссий и несопоставленные сообщения (trace_id, message).
+    """
+    trace_index = pd.Index(trace_ids).unique()
+    entries, pending = [], []
+    with csv_input(dump_log_path) as source:
+        for chunk in pd.read_csv(source, usecols=DUMP_LOG_COLUMNS, dtype=DUMP_LOG_DTYPES, chunksize=chunksize):
+            chunk = filter_dump_log(chunk)
+            matched = trace_index.get_indexer(chunk["trace_id"]) != -1
+            entries.append(parse_dump_log(chunk[matched], all_fills, venues))
+            pending.append(chunk.loc[~matched, ["trace_id", "message"]])
+    if not entries:
+        return parse_dump_log(pd.DataFrame(columns=["trace_id", "message"]), all_fills), pd.DataFrame(
+            columns=["trace_id", "message"]
+        )
+    return pd.concat(entries, ignore_index=True), pd.concat(pending, ignore_index=True)
+
+
+def comparison_options(options):
+    """Параметры compare_fees из параметров пакетного запуска."""
+    return {
+        "include_amounts": options.get("include_amounts", False) or options.get("exact", False),
+        "fee_schedule": load_fee_schedule(options["fee_schedule"]) if options.get("fee_schedule") else None,
+        "enrich_orders": options.get("enrich_orders", False),
+        "aggregate_fills": options.get("aggregate_fills", False),
+    }
+
+
+def compare_and_detect(trades, dump_entries, options, compare_options):
+    """Сравнивает комиссии и отбирает расхождения с допусками из options."""
+    comparison = compare_fees(trades, dump_entries, None, **compare_options)
+    mismatched = detect_mismatches(
+        comparison, atol=options.get("atol", 0.0), rtol=options.get("rtol", 0.0), exact=options.get("exact", False)
+    )
+    return comparison, mismatched
+
+
+def empty_counts():
+    return dict.fromkeys(COUNT_KEYS, 0)
+
+
+def save_partials(directory, comparison, mismatched, counts, replaced=None):
+    """
+    Сохраняет частичные агрегаты сравнения: суммы по группам GROUPED_OUTPUTS, куб
+    расхождений (build_summary_cube), счетчики и сами строки с расхождениями.
+    Все агрегаты аддитивны, поэтому сводки за любой период собираются из них без исходных логов.
+    replaced — строки сравнения и расхождений, сохраненные ранее и замененные этими:
+    их агрегаты сохраняются с обратным знаком и вычитаются при сложении.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for output_file, group_by_columns in GROUPED_OUTPUTS.items():
+        partial = aggregate_comparison_data(comparison, group_by_columns)
+        if replaced is not None and not replaced[0].empty:
+            replaced_partial = aggregate_comparison_data(replaced[0], group_by_columns)
+            negated = negate_partial_aggregates(replaced_partial, group_by_columns)
+            partial = pd.concat(_non_empty([partial, negated]), ignore_index=True)
+        partial.to_csv(directory / f"{Path(output_file).stem}.csv", index=False)
+    cube = build_summary_cube(mismatched)
+    if replaced is not None and not replaced[1].empty:
+        cube = pd.concat(_non_empty([cube, negate_mismatch_cube(build_summary_cube(replaced[1]))]))
+    cube.reset_index().to_csv(directory / CUBE_FILE, index=False)
+    with open(directory / COUNTS_FILE, "w") as f:
+        json.dump(counts, f, indent=2)
+    save_mismatches(mismatched, directory / "_mismatched_data.csv")
+
+
+def load_partials(directory):
+    """Загружает частичные агрегаты, сохраненные save_partials."""
+    directory = Path(directory)
+    groups = {
+        output_file: pd.read_csv(directory / f"{Path(output_file).stem}.csv", float_precision="round_trip")
+        for output_file in GROUPED_OUTPUTS
+    }
+    cube = pd.read_csv(directory / CUBE_FILE, float_precision="round_trip").set_index(FEATURES + ASSET_COLUMNS)
+    with open(directory / COUNTS_FILE) as f:
+        counts = json.load(f)
+    return {"groups": groups, "cube": cube, "counts": counts}
+
+
+def _non_empty(frames):
+    return [frame for frame in frames if not frame.empty] or frames[:1]
+
+
+def merge_partials(partials):
+    """
+    Складывает частичные агрегаты нескольких дней или источников.
+    Пустые таблицы (день без переноса) не участвуют, чтобы не менять типы столбцов.
+    """
+    counts = empty_counts()
+    for partial in partials:
+        for key, value in partial["counts"].items():
+            counts[key] = counts.get(key, 0) + value
+    groups = {
+        output_file: merge_partial_aggregates(
+            _non_empty([partial["groups"][output_file] for partial in partials]), columns
+        )
+        for output_file, columns in GROUPED_OUTPUTS.items()
+    }
+    cube = merge_mismatch_cubes(_non_empty([partial["cube"] for partial in partials]))
+    return {"groups": groups, "cube": cube, "counts": counts}
+
+
+def process_day(date, paths, output_dir, options):
+    """
+    Задание одного дня (выполняется в процессе пула): сравнивает сделки дня с исполнениями
+    из dump_log того же дня и сохраняет частичные агрегаты в <output_dir>/days/<date>/day.
+    Для переноса через полночь сохраняются все сделки дня и их записи комиссий (у сделки
+    могут быть сообщения и в соседнем дне), а также неразобранные сообщения чужих сделок.
+    """
+    compare_options = comparison_options(options)
+    chunksize = options.get("chunksize", DUMP_LOG_CHUNKSIZE)
+    own_trade_log = read_own_trade_log(paths["own_trade_log"])
+    if compare_options["enrich_orders"]:
+        # Сделки обогащаются до деления на сопоставленные и отложенные: число исполнений
+        # ордера считается по всем сделкам дня, а отложенные сделки не требуют order_log при переносе
+        own_trade_log = attach_order_info(
+            own_trade_log, read_order_summary(paths["order_log"], own_trade_log, chunksize)
+        )
+    dump_entries, pending_dump = split_dump_log(
+        paths["dump_log"],
+        own_trade_log["trace_id"],
+        chunksize,
+        compare_options["aggregate_fills"],
+        trade_venues(own_trade_log),
+    )
+
+    matched = own_trade_log["trace_id"].isin(dump_entries["trace_id"])
+    comparison, mismatched = compare_and_detect(own_trade_log[matched], dump_entries, options, compare_options)
+
+    day_dir = Path(output_dir) / "days" / date
+    counts = {**empty_counts(), "trades": len(own_trade_log)}
+    counts.update(comparison_rows=len(comparison), mismatched_rows=len(mismatched))
+    save_partials(day_dir / "day", comparison, mismatched, counts)
+    own_trade_log.to_pickle(day_dir / "trades.pkl")
+    dump_entries.to_pickle(day_dir / "dump_entries.pkl")
+    pending_dump.to_pickle(day_dir / "pending_dump.pkl")
+    logging.info(
+        f"{date}: {len(comparison)} comparison rows, {len(mismatched)} mismatches, "
+        f"{(~matched).sum()} trades and {len(pending_dump)} messages carried over"
+    )
+    return counts
+
+
+def is_next_day(date, next_date):
+    return pd.Timestamp(next_date) - pd.Timestamp(date) == pd.Timedelta(days=1)
+
+
+def match_carried(trades, day_entries, messages, options, compare_options, messages_first=False):
+    """
+    Сопоставляет сделки дня (trades, их записи комиссий day_entries) с неразобранными
+    сообщениями соседнего дня; сообщения разбираются по бирже сделки. Без aggregate_fills
+    каждое сообщение дает свою строку сравнения, как при расчете по всем логам сразу.
+    С aggregate_fills исполнения из сообщений суммируются с исполнениями дня сделки
+    (sum_partial_fills), и строка сделки пересчитывается: прежняя строка задания дня
+    возвращается как замененная. messages_first — сообщения из предыдущего дня, их
+    исполнения идут раньше исполнений дня сделки, как в dump_log.
+    Возвращает строки сравнения и расхождений, замененные строки и разобранные записи сообщений.
+    """
+    messages = messages[messages["trace_id"].isin(trades["trace_id"])]
+    trades = trades[trades["trace_id"].isin(messages["trace_id"])]
+    entries = parse_dump_log(messages, compare_options["aggregate_fills"], trade_venues(trades))
+    if not compare_options["aggregate_fills"]:
+        comparison, mismatched = compare_and_detect(trades, entries, options, compare_options)
+        return comparison, mismatched, (comparison.iloc[:0], mismatched.iloc[:0]), entries
+    day_entries = day_entries[day_entries["trace_id"].isin(trades["trace_id"])]
+    parts = [entries, day_entries] if messages_first else [day_entries, entries]
+    comparison, mismatched = compare_and_detect(
+        trades, pd.concat(_non_empty(parts), ignore_index=True), options, compare_options
+    )
+    replaced = compare_and_detect(trades, day_entries, options, compare_options)
+    return comparison, mismatched, replaced, entries
+
+
+def carry_over(dates, output_dir, options):
+    """
+    Переносит сообщения через полночь: все сделки дня D сопоставляются с неразобранными
+    сообщениями дня D+1, а неразобранные сообщения дня D — со всеми сделками D+1. Так
+    находятся и сделки без пары в своем дне, и исполнения сделки, часть сообщений которой
+    пришла после полуночи (match_carried). Строки сравнения относятся к дню сделки и
+    сохраняются в <output_dir>/days/<дата>/carried вместе с вычитанием замененных строк
+    задания дня. Сообщения, разобранные при переносе из D-1, добавляются к записям дня D,
+    поэтому сделка с сообщениями в трех днях пересчитывается дважды без двойного учета.
+    _mismatched_data.csv задания дня может содержать строку, замененную при переносе.
+    То, что не нашло пары и в соседнем дне, считается несопоставленным (unmatched_trades,
+    unmatched_dump_entries) в своем дне. Перенос идет последовательно по дням,
+    в памяти — сделки, записи комиссий и отложенные сообщения двух дней.
+    """
+    compare_options = comparison_options(options)
+    days_dir = Path(output_dir) / "days"
+    carried = {}
+    carry_trades = carry_entries = carry_pending = carry_dump = None
+
+    def finish_day(date, trades, entries, unmatched_trades, unmatched_dump):
+        # День без переноса сохраняет пустые агрегаты и счетчики несопоставленных
+        parts = carried.pop(date) or [
+            match_carried(trades.iloc[:0], entries, unmatched_dump, options, compare_options)
+        ]
+        comparison = pd.concat([part[0] for part in parts], ignore_index=True)
+        mismatched = pd.concat([part[1] for part in parts], ignore_index=True)
+        replaced = tuple(pd.concat([part[2][k] for part in parts], ignore_index=True) for k in range(2))
+        counts = {
+            **empty_counts(),
+            "comparison_rows": len(comparison) - len(replaced[0]),
+            "mismatched_rows": len(mismatched) - len(replaced[1]),
+        }
+        counts.update(unmatched_trades=len(unmatched_trades), unmatched_dump_entries=len(unmatched_dump))
+        save_partials(days_dir / date / "carried", comparison, mismatched, counts, replaced)
+
+    previous = None
+    for date in dates:
+        trades = pd.read_pickle(days_dir / date / "trades.pkl")
+        entries = pd.read_pickle(days_dir / date / "dump_entries.pkl")
+        pending_dump = pd.read_pickle(days_dir / date / "pending_dump.pkl")
+        pending_trades = trades[~trades["trace_id"].isin(entries["trace_id"])]
+        carried[date] = []
+        if previous is not None and is_next_day(previous, date):
+            # Сделки прошлого дня с сообщениями после полуночи и сделки дня с сообщениями до нее
+            carried[previous].append(
+                match_carried(carry_trades, carry_entries, pending_dump, options, compare_options)
+            )
+            backward = match_carried(trades, entries, carry_dump, options, compare_options, messages_first=True)
+            carried[date].append(backward)
+            finish_day(
+                previous,
+                carry_trades,
+                carry_entries,
+                carry_pending[~carry_pending["trace_id"].isin(pending_dump["trace_id"])],
+                carry_dump[~carry_dump["trace_id"].isin(trades["trace_id"])],
+            )
+            pending_trades = pending_trades[~pending_trades["trace_id"].isin(carry_dump["trace_id"])]
+            pending_dump = pending_dump[~pending_dump["trace_id"].isin(carry_trades["trace_id"])]
+            entries = pd.concat(_non_empty([backward[3], entries]), ignore_index=True)
+        elif previous is not None:
+            finish_day(previous, carry_trades, carry_entries, carry_pending, carry_dump)
+        carry_trades, carry_entries, carry_pending, carry_dump = trades, entries, pending_trades, pending_dump
+        previous = date
+    if previous is not None:
+        finish_day(previous, carry_trades, carry_entries, carry_pending, carry_dump)
+
+
+def write_rollup(partials, output_dir):
+    """
+    Пишет сводки периода из объединенных частичных агрегатов: сгруппированные таблицы
+    сравнения (как GROUPED_OUTPUTS), сводки расхождений и анализ влияния признаков.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for output_file, group_by_columns in GROUPED_OUTPUTS.items():
+        grouped = finalize_grouped_data(partials["groups"][output_file], group_by_columns)
+        save_grouped_data(grouped, output_dir / Path(output_file).name)
+
+    cube = partials["cube"]
+    summarize_mismatches(cube, output_dir / "_mismatched_summary.csv", cube=cube)
+    summarize_grouped_mismatches(cube, output_dir / "_grouped_summary.csv", cube=cube)
+    analysis_results = {
+        f"{mismatch_type}_{feature}": slice_mismatch_cube(cube, mismatch_type, feature)
+        for mismatch_type in MISMATCH_TYPES + schedule_mismatch_types(cube)
+        for feature in FEATURES
+    }
+    save_analysis_results(analysis_results, output_dir)
+
+
+def rollup(output_dir=BATCH_OUTPUT_DIR, dates=None, start=None, end=None):
+    """
+    Собирает сводки по дням (<output_dir>/days/<дата>) и месяцам (<output_dir>/months/<YYYY-MM>)
+    только из сохраненных частичных агрегатов, без чтения исходных логов.
+    Счетчики дней и месяцев сохраняются в <output_dir>/batch_summary.csv.
+    dates (дни запуска run_batch) и start, end (включительно) ограничивают собираемые дни:
+    частичные агрегаты других дней, оставшиеся от прошлых запусков, не попадают в сводки месяцев.
+    """
+    output_dir = Path(output_dir)
+    days = {}
+    for day_dir in sorted((output_dir / "days").iterdir()):
+        date = day_dir.name
+        if (dates is not None and date not in dates) or (start and date < start) or (end and date > end):
+            continue
+        sources = [day_dir / source for source in PARTIAL_SOURCES if (day_dir / source / COUNTS_FILE).exists()]
+        if sources:
+            days[date] = merge_partials([load_partials(source) for source in sources])
+
+    rows = []
+    months = {}
+    for date, partials in days.items():
+        write_rollup(partials, output_dir / "days" / date)
+        months.setdefault(date[:7], []).append(partials)
+        rows.append({"period": "day", "key": date, **partials["counts"]})
+    for month, partials in months.items():
+        merged = merge_partials(partials)
+        write_rollup(merged, output_dir / "months" / month)
+        rows.append({"period": "month", "key": month, "days": len(partials), **merged["counts"]})
+
+    summary = pd.DataFrame(rows, columns=["period", "key", "days"] + COUNT_KEYS)
+    summary.to_csv(output_dir / SUMMARY_OUTPUT, index=False)
+    logging.info(f"Batch summary of {len(days)} days and {len(months)} months saved to {output_dir / SUMMARY_OUTPUT}")
+    return summary
+
+
+def run_batch(
+    data_root=BATCH_DATA_ROOT,
+    output_dir=BATCH_OUTPUT_DIR,
+    start=None,
+    end=None,
+    workers=None,
+    memory_budget_mb=MEMORY_BUDGET_MB,
+    executor_class=ProcessPoolExecutor,
+    **options,
+):
+    """
+    Пакетная сверка по дням: находит каталоги дней (discover_partitions), выполняет задания
+    дней (process_day) в пуле в пределах бюджета памяти, переносит несопоставленные сделки
+    и сообщения через полночь (carry_over) и собирает сводки по дням и месяцам (rollup)
+    только из дней этого запуска.
+    options — параметры сравнения: include_amounts, exact, atol, rtol, fee_schedule
+    (путь к таблице), enrich_orders, aggregate_fills, chunksize.
+    """
+    partitions = discover_partitions(data_root, start, end)
+    if not partitions:
+        logging.error(f"No date partitions with {list(INPUT_FILES.values())} found in {data_root}")
+        raise FileNotFoundError(f"No date partitions found in {data_root}")
+    logging.info(f"{len(partitions)} days from {next(iter(partitions))} to {list(partitions)[-1]}")
+
+    jobs = {
+        date: (
+            estimate_day_memory_mb(paths, options.get("enrich_orders", False)),
+            (date, paths, output_dir, options),
+        )
+        for date, paths in partitions.items()
+    }
+    run_jobs(jobs, process_day, workers, memory_budget_mb, executor_class)
+    carry_over(list(partitions), output_dir, options)
+    return rollup(output_dir, dates=list(partitions))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Reconcile fees for date-partitioned daily logs and roll them up.")
+    parser.add_argument(
+        "--data-root", default=BATCH_DATA_ROOT, help="Directory of day partitions (e.g. data/2024-03-23/)"
+    )
+    parser.add_argument("--from", dest="start", default=None, help="First day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", default=None, help="Last day, YYYY-MM-DD")
+    parser.add_argument("--output-dir", default=BATCH_OUTPUT_DIR, help="Directory for partials and rollups")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel day jobs (default: CPU count)")
+    parser.add_argument(
+        "--memory-budget-mb", type=int, default=MEMORY_BUDGET_MB, help="Estimated memory of concurrent day jobs"
+    )
+    parser.add_argument("--chunksize", type=int, default=DUMP_LOG_CHUNKSIZE, help="dump_log rows read at once")
+    parser.add_argument("--atol", type=float, default=0.0, help="Absolute tolerance for fee rate comparison")
+    parser.add_argument("--rtol", type=float, default=0.0, help="Relative tolerance for fee rate comparison")
+    parser.add_argument("--exact", action="store_true", help="Compare fee amounts exactly in fixed point")
+    parser.add_argument("--fee-schedule", default=None, help="Fee schedule (CSV or JSON) for expected rates")
+    parser.add_argument("--enrich-orders", action="store_true", help="Attach order status and timing to trades")
+    parser.add_argument("--aggregate-fills", action="store_true", help="Sum all partial fills of a trade")
+    parser.add_argument(
+        "--rollup-only",
+        action="store_true",
+        help="Only rebuild day and month rollups from saved partials (of days in --from/--to, if given)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.rollup_only:
+        summary = rollup(args.output_dir, start=args.start, end=args.end)
+    else:
+        summary = run_batch(
+            args.data_root,
+            args.output_dir,
+            start=args.start,
+            end=args.end,
+            workers=args.workers,
+            memory_budget_mb=args.memory_budget_mb,
+            chunksize=args.chunksize,
+            atol=args.atol,
+            rtol=args.rtol,
+            exact=args.exact,
+            fee_schedule=args.fee_schedule,
+            enrich_orders=args.enrich_orders,
+            aggregate_fills=args.aggregate_fills,
+        )
+    print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
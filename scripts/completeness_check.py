@@ -0,0 +1,240 @@
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scripts.data_analysis import (
+    DUMP_LOG_CHUNKSIZE,
+    DUMP_LOG_COLUMNS,
+    DUMP_LOG_DTYPES,
+    OWN_TRADE_COLUMNS,
+    filter_dump_log,
+    read_own_trade_log,
+    trade_venues,
+)
+from utils.compressed_input import csv_input
+from utils.instrumentation import stage, staged
+from utils.key_sets import BloomFilter, KeyCounter, id_keys, key_label
+from utils.message_parsing import as_decimal_text, message_venues, parse_fill_records
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+COMPLETENESS_OUTPUT = "output/_completeness_summary.csv"
+ORPHAN_TRADES_OUTPUT = "output/_orphan_trades.csv"
+ORPHAN_FILLS_OUTPUT = "output/_orphan_fills.csv"
+DUPLICATE_METHODS = ("exact", "bloom")
+# Ключей id сделок биржи в памяти до перехода на файлы разделов
+MAX_MEMORY_KEYS = 50_000_000
+BLOOM_CAPACITY = 100_000_000
+BLOOM_ERROR_RATE = 0.001
+# Число примеров ключей в отчете для каждой проверки
+EXAMPLE_COUNT = 10
+ORPHAN_TRADE_COLUMNS = ["trace_id", "trade_id", "exchange_trade_id", "instrument_name", "side", "role"]
+ORPHAN_FILL_COLUMNS = ["trace_id", "fill_id", "fee", "fee_currency", "gt_fee"]
+SUMMARY_COLUMNS = ["check", "count", "distinct_keys", "method", "examples"]
+# Идентификаторы сделок, нужные для поиска повторов в own_trade_log
+TRADE_ID_COLUMNS = ["trade_id", "exchange_trade_id"]
+
+
+def _check(name, count, distinct_keys=None, method="exact", examples=()):
+    return {
+        "check": name,
+        "count": int(count),
+        "distinct_keys": None if distinct_keys is None else int(distinct_keys),
+        "method": method,
+        "examples": " ".join(str(example) for example in list(examples)[:EXAMPLE_COUNT]),
+    }
+
+
+def trade_log_duplicates(own_trade_log):
+    """
+    Повторы в own_trade_log: trace_id и exchange_trade_id, встречающиеся в нескольких сделках.
+    count — лишние строки (сверх первой), distinct_keys — число повторяющихся значений.
+    """
+    checks = []
+    for column in ["trace_id", "exchange_trade_id"]:
+        if column not in own_trade_log.columns:
+            continue
+        values = own_trade_log[column].dropna()
+        repeated = values[values.duplicated()]
+        checks.append(
+            _check(f"duplicate_trade_{column}", len(repeated), repeated.nunique(), examples=pd.unique(repeated))
+        )
+    return checks
+
+
+def stream_fill_records(dump_log_path, chunksize=DUMP_LOG_CHUNKSIZE, venues=None):
+    """
+    Читает dump_log частями и отдает записи исполнений (по одной на сделку result) каждой части.
+    venues (trade_venues) выбирает разборщик сообщений по бирже сделки.
+    Сжатый dump_log распаковывается в отдельном потоке.
+    """
+    with csv_input(dump_log_path) as source:
+        for chunk in pd.read_csv(source, usecols=DUMP_LOG_COLUMNS, dtype=DUMP_LOG_DTYPES, chunksize=chunksize):
+            chunk = filter_dump_log(chunk)
+            with stage("parse", rows_in=len(chunk)) as parse:
+                positions, fill_ids, fees, fee_currencies, gt_fees = parse_fill_records(
+                    chunk["message"], message_venues(venues, chunk["trace_id"].to_numpy())
+                )
+                fills = pd.DataFrame(
+                    {
+                        "trace_id": chunk["trace_id"].to_numpy()[positions],
+                        "fill_id": fill_ids,
+                        "fee": as_decimal_text(fees),
+                        "fee_currency": fee_currencies,
+                        "gt_fee": as_decimal_text(gt_fees),
+                    }
+                )
+                # Сообщения без сделок result (не исполнения) не учитываются
+                fills = fills[fills["fill_id"].notna() | fills["fee"].notna() | fills["gt_fee"].notna()]
+                parse.rows_out = len(fills)
+            yield fills
+
+
+@staged("completeness")
+def check_completeness(
+    own_trade_log,
+    dump_log_path,
+    chunksize=DUMP_LOG_CHUNKSIZE,
+    method="exact",
+    max_memory_keys=MAX_MEMORY_KEYS,
+    spill_dir=None,
+    bloom_capacity=BLOOM_CAPACITY,
+    bloom_error_rate=BLOOM_ERROR_RATE,
+    orphan_fills_output=None,
+):
+    """
+    Проверяет полноту данных за один потоковый проход по dump_log.
+    Сделки без исполнений на бирже и исполнения без сделок платформы находятся
+    anti-join по trace_id: trace_id сделок хранятся в хеш-индексе, а для каждого
+    trace_id отмечается, встречалось ли исполнение. Повторы id исполнений в dump_log
+    считаются точно (method="exact", в памяти или с файлами разделов при превышении
+    max_memory_keys) или фильтром Блума фиксированного размера (method="bloom",
+    с долей ложных срабатываний около bloom_error_rate).
+    Исполнения без сделок пишутся в orphan_fills_output по мере чтения, если он задан.
+    Возвращает сводку проверок и строки сделок без исполнений.
+    """
+    if method not in DUPLICATE_METHODS:
+        raise ValueError(f"Unknown duplicate detection method {method!r}, expected one of {DUPLICATE_METHODS}")
+
+    trade_index = pd.Index(own_trade_log["trace_id"]).unique()
+    seen = np.zeros(len(trade_index), dtype=bool)
+    orphan_fill_count, orphan_fill_examples, fill_count = 0, [], 0
+    if method == "bloom":
+        seen_fills = BloomFilter(bloom_capacity, bloom_error_rate)
+        bloom_duplicates, bloom_examples = 0, []
+    else:
+        seen_fills = KeyCounter(max_memory_keys, spill_dir)
+    if orphan_fills_output:
+        Path(orphan_fills_output).parent.mkdir(parents=True, exist_ok=True)
+        pd.DataFrame(columns=ORPHAN_FILL_COLUMNS).to_csv(orphan_fills_output, index=False)
+
+    try:
+        for fills in stream_fill_records(dump_log_path, chunksize, trade_venues(own_trade_log)):
+            fill_count += len(fills)
+            codes = trade_index.get_indexer(fills["trace_id"])
+            matched = codes >= 0
+            seen[codes[matched]] = True
+
+            orphans = fills[~matched]
+            orphan_fill_count += len(orphans)
+            if len(orphan_fill_examples) < EXAMPLE_COUNT:
+                orphan_fill_examples += orphans["trace_id"].head(EXAMPLE_COUNT).tolist()
+            if orphan_fills_output and len(orphans):
+                orphans.to_csv(orphan_fills_output, mode="a", header=False, index=False)
+
+            keys, valid = id_keys(fills["fill_id"])
+            keys = keys[valid]
+            if method == "bloom":
+                repeated = seen_fills.add(keys)
+                bloom_duplicates += int(repeated.sum())
+                if len(bloom_examples) < EXAMPLE_COUNT:
+                    bloom_examples += [key_label(key) for key in keys[repeated][:EXAMPLE_COUNT]]
+            else:
+                seen_fills.add(keys)
+
+        if method == "bloom":
+            duplicates = _check(
+                "duplicate_fill_id",
+                bloom_duplicates,
+                method=f"bloom (false positive rate {seen_fills.false_positive_rate():.2g})",
+                examples=bloom_examples,
+            )
+        else:
+            repeated_keys, counts = seen_fills.duplicates()
+            duplicates = _check(
+                "duplicate_fill_id",
+                (counts - 1).sum(),
+                len(repeated_keys),
+                method="exact (spilled to disk)" if seen_fills.spilled else "exact",
+                examples=[key_label(key) for key in repeated_keys[:EXAMPLE_COUNT]],
+            )
+    finally:
+        if method != "bloom":
+            seen_fills.close()
+
+    orphan_trades = own_trade_log[~seen[trade_index.get_indexer(own_trade_log["trace_id"])]]
+    orphan_trades = orphan_trades[[column for column in ORPHAN_TRADE_COLUMNS if column in orphan_trades.columns]]
+    checks = [
+        _check("trades", len(own_trade_log)),
+        _check("exchange_fills", fill_count),
+        _check("orphan_trades", len(orphan_trades), examples=orphan_trades["trace_id"]),
+        _check("orphan_fills", orphan_fill_count, examples=orphan_fill_examples),
+        *trade_log_duplicates(own_trade_log),
+        duplicates,
+    ]
+    summary = pd.DataFrame(checks, columns=SUMMARY_COLUMNS).astype({"distinct_keys": "Int64"})
+    for row in checks[2:]:
+        if row["count"]:
+            logging.warning(f"Completeness: {row['count']} {row['check']} ({row['method']})")
+    return summary, orphan_trades.reset_index(drop=True)
+
+
+def save_completeness(summary, orphan_trades, output_file=COMPLETENESS_OUTPUT, orphan_trades_file=ORPHAN_TRADES_OUTPUT):
+    """Сохраняет сводку проверок полноты и сделки без исполнений в CSV."""
+    Path(output_file).parent.mkdir(parents=True, exist_ok=True)
+    summary.to_csv(output_file, index=False)
+    orphan_trades.to_csv(orphan_trades_file, index=False)
+    logging.info(f"Completeness summary saved to {output_file}, {len(orphan_trades)} orphan trades to {orphan_trades_file}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find orphan trades, orphan exchange fills and duplicates.")
+    parser.add_argument("--own-trade-log", default="data/own_trade_log.csv", help="Platform trades")
+    parser.add_argument("--dump-log", default="data/dump_log.csv", help="Exchange messages")
+    parser.add_argument("--chunksize", type=int, default=DUMP_LOG_CHUNKSIZE, help="dump_log rows read at once")
+    parser.add_argument(
+        "--method", choices=DUPLICATE_METHODS, default="exact", help="Duplicate fill detection: exact or Bloom filter"
+    )
+    parser.add_argument(
+        "--max-memory-keys", type=int, default=MAX_MEMORY_KEYS, help="Fill ids kept in memory before spilling to disk"
+    )
+    parser.add_argument("--spill-dir", default=None, help="Directory for spill files (default: system temp)")
+    parser.add_argument("--bloom-capacity", type=int, default=BLOOM_CAPACITY, help="Expected fills for the Bloom filter")
+    parser.add_argument("--bloom-error-rate", type=float, default=BLOOM_ERROR_RATE, help="Bloom filter false positives")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    own_trade_log = read_own_trade_log(args.own_trade_log, OWN_TRADE_COLUMNS + TRADE_ID_COLUMNS)
+    summary, orphan_trades = check_completeness(
+        own_trade_log,
+        args.dump_log,
+        chunksize=args.chunksize,
+        method=args.method,
+        max_memory_keys=args.max_memory_keys,
+        spill_dir=args.spill_dir,
+        bloom_capacity=args.bloom_capacity,
+        bloom_error_rate=args.bloom_error_rate,
+        orphan_fills_output=ORPHAN_FILLS_OUTPUT,
+    )
+    print(summary.to_string(index=False))
+    save_completeness(summary, orphan_trades)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,510 @@
+import argparse
 import pandas as pd
-import json
+import numpy as np
 import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from utils.compressed_input import csv_source, is_compressed, resolve_input
+from utils.csv_schema import memory_per_row, read_typed_csv, read_typed_csv_chunks
+from utils.file_shards import open_byte_range, split_into_shards
+from utils.fee_cost import COST_CURRENCY, combine_prices, convert_to_currency, load_price_table, trade_prices
+from utils.fee_schedule import load_fee_schedule
+from utils.fixed_point import sum_fixed_point
+from utils.instrumentation import (
+    add_instrumentation_arguments,
+    collect_stages,
+    configure_from_args,
+    merge_stages,
+    stage,
+    staged,
+    write_reports_from_args,
+)
+from utils.dump_cache import cache_available, load_cached_dump, source_fingerprint, write_dump_cache
+from utils.message_parsing import (
+    DEFAULT_VENUE,
+    as_decimal_text,
+    extract_fees,
+    gt_fee_currencies,
+    is_gt_asset,
+    message_venues,
+    parse_fee_fields,
+    parse_fill_records,
+    select_fees,
+    trace_venues,
+)
+from utils.order_enrichment import ORDER_COLUMNS, attach_order_info, load_order_summary
+from utils.trace_index import (
+    TRACE_INDEX_DIR,
+    TraceIndexBuilder,
+    build_trace_index,
+    index_is_current,
+    write_trace_index,
+)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Столбцы dump_log, которые читаются с диска, и фильтр входящих сообщений
+DUMP_LOG_COLUMNS = ["trace_id", "direction", "message_name", "message_kind", "message"]
+DUMP_LOG_FILTERS = {"direction": "In", "message_name": "WsPayload", "message_kind": "Regular"}
+DUMP_LOG_CHUNKSIZE = 100_000
+DUMP_CACHE_DIR = "output/.cache"
+# Входные файлы: own_trade_log, dump_log и order_log
+INPUT_PATHS = ["data/own_trade_log.csv", "data/dump_log.csv", "data/order_log.csv"]
+# На каждый процесс приходится несколько шардов, чтобы выровнять нагрузку
+SHARDS_PER_WORKER = 4
+
+# Разобранные записи dump_log: комиссии уже извлечены из сообщений
+PARSED_DUMP_COLUMNS = ["trace_id", "fee", "fee_currency", "gt_fee", "gt_fee_currency"]
+# Записи по каждой сделке массива result (режим all_fills): добавляется id сделки биржи
+FILL_DUMP_COLUMNS = PARSED_DUMP_COLUMNS + ["fill_id"]
+
+# Сгруппированные выходные таблицы и столбцы группировки
+GROUPED_OUTPUTS = {
+    "output/_fee_comparison_grouped_by_side_and_role.csv": ["side", "role"],
+    "output/_fee_comparison_grouped_by_fee_evaluated.csv": ["is_fee_evaluated"],
+}
+
+# Комиссии в исходном 18-знаковом текстовом виде для точного сравнения
+AMOUNT_COLUMNS = ["platform_fee_amount", "exchange_fee_amount"]
+
+# Ставка по таблице комиссий (см. utils.fee_schedule)
+EXPECTED_RATE_COLUMN = "expected_fee_rate"
+
+# Схемы входных логов. Суммы комиссий читаются текстом, чтобы не терять знаки при разборе в float
+OWN_TRADE_SCHEMA = {
+    "platform_time": "datetime",
+    "exchange_time": "datetime",
+    "trace_id": "uint64",
+    "account_name": "category",
+    "instrument_name": "category",
+    "trade_id": "uint64",
+    "exchange_trade_id": "string",
+    "order_id": "uint64",
+    "exchange_order_id": "string",
+    "side": "category",
+    "role": "category",
+    "price": "float64",
+    "base_amount": "float64",
+    "base_asset_name": "category",
+    "quote_amount": "float64",
+    "quote_asset_name": "category",
+    "fee_amount": "string",
+    "fee_asset_name": "category",
+    "is_fee_evaluated": "bool",
+    "source": "category",
+}
+# Столбцы own_trade_log, которые нужны для сравнения; остальные не читаются
+OWN_TRADE_COLUMNS = [
+    "platform_time",
+    "exchange_time",
+    "trace_id",
+    "account_name",
+    "instrument_name",
+    "order_id",
+    "exchange_order_id",
+    "side",
+    "role",
+    "price",
+    "base_amount",
+    "base_asset_name",
+    "quote_asset_name",
+    "fee_amount",
+    "fee_asset_name",
+    "is_fee_evaluated",
+]
+ORDER_LOG_SCHEMA = {
+    "platform_time": "datetime",
+    "trace_id": "uint64",
+    "account_name": "category",
+    "instrument_name": "category",
+    "order_id": "uint64",
+    "exchange_order_id": "string",
+    "status": "category",
+    "side": "category",
+}
+# trace_id читается с пропусками (служебные сообщения без trace_id), строки без него
+# отбрасываются в filter_dump_log
+DUMP_LOG_DTYPES = {
+    "trace_id": "UInt64",
+    "direction": "category",
+    "message_name": "category",
+    "message_kind": "category",
+}
+
+# Время, инструмент и объем сделки — для анализа во времени (scripts.fee_drift)
+TRADE_CONTEXT_COLUMNS = ["platform_time", "exchange_time", "instrument_name", "account_name", "trade_volume"]
+
+# Комиссии сторон в COST_CURRENCY и их разница (с таблицей цен, см. utils.fee_cost)
+COST_COLUMNS = ["platform_fee_cost", "exchange_fee_cost", "fee_cost_difference"]
+COST_GROUP_COLUMNS = ["account_name", "instrument_name", "side", "role"]
+COST_IMPACT_OUTPUT = "output/_fee_cost_impact.csv"
+
+COMPARISON_COLUMNS = [
+    "trace_id",
+    "side",
+    "role",
+    "is_fee_evaluated",
+    "platform_fee_rate",
+    "platform_fee_asset",
+    "exchange_fee_rate",
+    "exchange_fee_asset",
+]
+
+
+def comparison_columns(
+    include_amounts=False, with_expected_rate=False, with_orders=False, with_context=False, with_costs=False
+):
+    """Столбцы результата compare_fees при заданных опциях."""
+    columns = list(COMPARISON_COLUMNS)
+    if with_context:
+        columns += TRADE_CONTEXT_COLUMNS
+    if with_expected_rate:
+        columns.append(EXPECTED_RATE_COLUMN)
+    if with_orders:
+        columns += ORDER_COLUMNS
+    if with_costs:
+        columns += COST_COLUMNS
+    if include_amounts:
+        columns += AMOUNT_COLUMNS
+    return columns
+
+
+def trade_venues(own_trade_log):
+    """Биржа каждой сделки по trace_id (см. utils.message_parsing.trace_venues) или None."""
+    return trace_venues(own_trade_log["trace_id"], own_trade_log.get("instrument_name"))
+
+
+@staged("parse")
+def parse_dump_log(dump_log, all_fills=False, venues=None):
+    """
+    Извлекает поля комиссии из сообщений dump_log, отбрасывая сами сообщения.
+    Комиссии хранятся текстом, чтобы сохранить все 18 знаков для точного сравнения.
+    По умолчанию берется первая сделка result; с all_fills=True — каждая сделка
+    массива result отдельной строкой с ее id (fill_id), для последующего sum_partial_fills.
+    venues (trade_venues) выбирает разборщик сообщений по бирже сделки; по умолчанию — Gate.io.
+    """
+    trace_ids = dump_log["trace_id"].to_numpy()
+    row_venues = message_venues(venues, trace_ids)
+    if all_fills:
+        positions, fill_ids, fees, fee_currencies, gt_fees = parse_fill_records(dump_log["message"], row_venues)
+        trace_ids = trace_ids[positions]
+    else:
+        fees, fee_currencies, gt_fees = parse_fee_fields(dump_log["message"], row_venues)
+    entries = pd.DataFrame(
+        {
+            "trace_id": trace_ids,
+            "fee": as_decimal_text(fees),
+            "fee_currency": fee_currencies,
+            "gt_fee": as_decimal_text(gt_fees),
+            "gt_fee_currency": gt_fee_currencies(gt_fees),
+        }
+    )
+    if all_fills:
+        entries["fill_id"] = fill_ids
+    return entries
+
+
+def sum_partial_fills(dump_entries):
+    """
+    Сворачивает записи dump_log до одной строки на trace_id, точно суммируя fee и gt_fee
+    всех частичных исполнений. Сделка, пришедшая в нескольких сообщениях (тот же
+    fill_id), учитывается один раз. Валюты берутся из первой записи, где они указаны.
+    Порядок trace_id — по первому появлению, как в dump_log.
+    """
+    if "fill_id" in dump_entries.columns:
+        repeated = dump_entries["fill_id"].notna() & dump_entries.duplicated(["trace_id", "fill_id"])
+        dump_entries = dump_entries[~repeated]
+    trace_index = pd.Index(dump_entries["trace_id"])
+    # Одиночные записи сохраняют исходный текст суммы, суммируются только повторяющиеся trace_id
+    multiple = trace_index.duplicated(keep=False)
+    aggregated = dump_entries.loc[~trace_index.duplicated(), PARSED_DUMP_COLUMNS].reset_index(drop=True)
+    if not multiple.any():
+        return aggregated
+
+    parts = dump_entries[multiple]
+    sums = parts.groupby("trace_id", sort=False)[["fee_currency", "gt_fee_currency"]].first()
+    sums["fee"] = sum_fixed_point(parts["fee"], parts["trace_id"])
+    sums["gt_fee"] = sum_fixed_point(parts["gt_fee"], parts["trace_id"])
+    rows = pd.Index(aggregated["trace_id"]).get_indexer(sums.index)
+    for column in ["fee", "fee_currency", "gt_fee", "gt_fee_currency"]:
+        aggregated[column] = aggregated[column].astype(object)
+        aggregated.loc[rows, column] = sums[column].to_numpy()
+    return aggregated
+
+
+def load_dump_log(
+    dump_log_path,
+    trace_ids=None,
+    chunksize=DUMP_LOG_CHUNKSIZE,
+    parse=False,
+    byte_range=None,
+    all_fills=False,
+    venues=None,
+    index_builder=None,
+):
+    """
+    Потоково читает dump_log частями по chunksize строк.
+    Ненужные столбцы не читаются, а фильтр сообщений и semi-join по trace_id
+    применяются к каждой части, поэтому лишние строки не попадают в память.
+    С parse=True сообщения сразу разбираются и в памяти остаются только комиссии.
+    byte_range=(start, end) ограничивает чтение одним шардом файла.
+    all_fills и venues передаются в parse_dump_log.
+    index_builder (utils.trace_index.TraceIndexBuilder) получает trace_id и смещения
+    всех прочитанных строк до фильтрации — индекс строится за тот же проход.
+    Сжатый dump_log (.gz, .zst) распаковывается в отдельном потоке, пока основной
+    разбирает прочитанные части; шарды и индекс смещений для него недоступны.
+    """
+    trace_index = pd.Index(trace_ids).unique() if trace_ids is not None else None
+    columns = (FILL_DUMP_COLUMNS if all_fills else PARSED_DUMP_COLUMNS) if parse else ["trace_id", "message"]
+    if is_compressed(dump_log_path) and (byte_range or index_builder is not None):
+        logging.error(f"{dump_log_path} is compressed: byte ranges and offset index are not available.")
+        raise ValueError(f"Cannot read byte ranges of compressed file {dump_log_path}")
+    if index_builder is not None:
+        source = index_builder.open(dump_log_path, byte_range)
+    else:
+        source = open_byte_range(dump_log_path, *byte_range) if byte_range else csv_source(dump_log_path)
 
-def load_data(own_trade_path, dump_log_path, order_log_path):
-    """Загружает входные данные из заданных файлов."""
+    chunks = []
     try:
-        own_trade_log = pd.read_csv(own_trade_path)
-        dump_log = pd.read_csv(dump_log_path)
-        order_log = pd.read_csv(order_log_path)
+        for chunk in pd.read_csv(source, usecols=DUMP_LOG_COLUMNS, dtype=DUMP_LOG_DTYPES, chunksize=chunksize):
+            if index_builder is not None:
+                # Строки без trace_id остаются в индексе под нулевым ключом, чтобы смещения не сдвинулись
+                index_builder.add(chunk["trace_id"].fillna(0))
+            chunk = filter_dump_log(chunk)
+            if trace_index is not None:
+                chunk = chunk[trace_index.get_indexer(chunk["trace_id"]) != -1]
+            chunks.append(parse_dump_log(chunk, all_fills, venues) if parse else chunk[columns])
+    finally:
+        if source is not dump_log_path:
+            source.close()
+
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(chunks, ignore_index=True)
+
+
+# trace_id сделок и их биржи, переданные каждому процессу один раз при его запуске
+_shard_trace_ids = None
+_shard_venues = None
+
+
+def _init_shard_worker(trace_ids, venues=None):
+    global _shard_trace_ids, _shard_venues
+    _shard_trace_ids = trace_ids
+    _shard_venues = venues
+
+
+def _load_dump_shard(dump_log_path, byte_range, chunksize, all_fills=False, build_index=False):
+    """
+    Читает, фильтрует и разбирает один шард dump_log в процессе пула. Возвращает записи,
+    trace_id и смещения строк шарда (с build_index=True, иначе None) и записи этапов воркера.
+    """
+    index_builder = TraceIndexBuilder() if build_index else None
+    entries, records = collect_stages(
+        load_dump_log,
+        dump_log_path,
+        _shard_trace_ids,
+        chunksize,
+        parse=True,
+        byte_range=byte_range,
+        all_fills=all_fills,
+        venues=_shard_venues,
+        index_builder=index_builder,
+    )
+    return entries, index_builder.entries() if build_index else None, records
+
+
+def load_dump_log_parallel(
+    dump_log_path,
+    trace_ids=None,
+    chunksize=DUMP_LOG_CHUNKSIZE,
+    workers=2,
+    all_fills=False,
+    venues=None,
+    build_index=False,
+):
+    """
+    Параллельно разбирает dump_log: файл делится на шарды по границам строк,
+    каждый шард фильтруется и разбирается в пуле процессов.
+    Части склеиваются в порядке шардов, поэтому результат совпадает с load_dump_log(parse=True).
+    С build_index=True возвращает пару (записи, trace_id и смещения строк всего файла или None).
+    """
+    shards = split_into_shards(dump_log_path, workers * SHARDS_PER_WORKER)
+    trace_ids = pd.unique(trace_ids) if trace_ids is not None else None
+
+    with ProcessPoolExecutor(workers, initializer=_init_shard_worker, initargs=(trace_ids, venues)) as pool:
+        futures = [
+            pool.submit(_load_dump_shard, dump_log_path, shard, chunksize, all_fills, build_index) for shard in shards
+        ]
+        results = [future.result() for future in futures]
+
+    logging.info(f"Parsed dump_log in {len(shards)} shards with {workers} workers")
+    # Этапы filter и parse шардов попадают в отчет под текущим этапом (load)
+    for _, _, records in results:
+        merge_stages(records)
+    parts, index_parts = [result[0] for result in results], [result[1] for result in results]
+    index_entries = None
+    if build_index:
+        if all(index_part is not None for index_part in index_parts):
+            index_entries = tuple(
+                np.concatenate([np.empty(0, dtype=np.uint64)] + [index_part[k] for index_part in index_parts])
+                for k in range(2)
+            )
+    if not parts:
+        entries = pd.DataFrame(columns=FILL_DUMP_COLUMNS if all_fills else PARSED_DUMP_COLUMNS)
+    else:
+        entries = pd.concat(parts, ignore_index=True)
+    return (entries, index_entries) if build_index else entries
+
+
+def _read_dump_log(dump_log_path, trace_ids, chunksize, workers, all_fills, venues, parse, index_dir):
+    """
+    Читает dump_log последовательно или по шардам; если index_dir задан, а индекс trace_id
+    отсутствует или устарел, строит его за этот же проход.
+    """
+    build_index = index_dir is not None and not index_is_current(dump_log_path, index_dir)
+    # Отпечаток снимается до чтения, чтобы изменения во время чтения делали индекс устаревшим
+    fingerprint = source_fingerprint(dump_log_path, with_hash=False) if build_index else None
+    index_entries = None
+    if workers > 1:
+        result = load_dump_log_parallel(dump_log_path, trace_ids, chunksize, workers, all_fills, venues, build_index)
+        dump_entries, index_entries = result if build_index else (result, None)
+    else:
+        index_builder = TraceIndexBuilder() if build_index else None
+        dump_entries = load_dump_log(
+            dump_log_path,
+            trace_ids,
+            chunksize,
+            parse=parse,
+            all_fills=all_fills,
+            venues=venues,
+            index_builder=index_builder,
+        )
+        index_entries = index_builder.entries() if build_index else None
+    if index_entries is not None:
+        write_trace_index(index_entries, dump_log_path, index_dir, fingerprint)
+    return dump_entries
+
+
+def load_dump_entries(
+    dump_log_path,
+    trace_ids,
+    chunksize=DUMP_LOG_CHUNKSIZE,
+    cache_dir=None,
+    workers=1,
+    all_fills=False,
+    venues=None,
+    index_dir=None,
+):
+    """
+    Загружает записи dump_log для заданных trace_id.
+    Если указан cache_dir, разобранные записи читаются из Parquet-кэша,
+    а при его отсутствии или устаревании кэш строится заново.
+    При workers > 1 сообщения разбираются параллельно по шардам файла.
+    С all_fills=True записи разбираются по каждой сделке result; их кэш хранится отдельно.
+    venues (trade_venues) выбирает разборщик сообщений по бирже сделки. Кэш хранится
+    отдельно для каждой биржи сделок (venues/<биржа>) и содержит все сообщения файла,
+    разобранные ее разборщиком, поэтому новые сделки не делают его устаревшим.
+    Если задан index_dir, при чтении файла строится индекс trace_id -> смещения строк
+    (utils.trace_index); при чтении из кэша устаревший индекс строится отдельным проходом.
+    Сжатый dump_log читается одним потоком без индекса: делить на шарды и адресовать
+    по смещениям можно только несжатый файл.
+    """
+    if is_compressed(dump_log_path):
+        if workers > 1:
+            logging.info(f"{dump_log_path} is compressed, reading it sequentially instead of {workers} shards")
+            workers = 1
+        if index_dir is not None:
+            logging.warning(f"{dump_log_path} is compressed, trace_id index is not built.")
+            index_dir = None
+    if cache_dir is None or not cache_available():
+        # Последовательно читаются сырые сообщения (их разбирает compare_fees), по шардам — сразу записи
+        parse = workers > 1
+        return _read_dump_log(dump_log_path, trace_ids, chunksize, workers, all_fills, venues, parse, index_dir)
+
+    if all_fills:
+        cache_dir = f"{cache_dir}/all_fills"
+    # Кэш по бирже: все сообщения, разобранные ее разборщиком, не зависят от набора сделок
+    venue_trace_ids = (venues is not None and venue_groups(venues, trace_ids)) or [(DEFAULT_VENUE, trace_ids)]
+    parts = []
+    for venue, venue_ids in venue_trace_ids:
+        venue_dir = cache_dir if venue == DEFAULT_VENUE else f"{cache_dir}/venues/{venue}"
+        dump_entries = load_cached_dump(dump_log_path, venue_dir, venue_ids)
+        if dump_entries is None:
+            # Снимаем отпечаток до чтения, чтобы изменения во время чтения инвалидировали кэш
+            fingerprint = source_fingerprint(dump_log_path)
+            dump_entries = _read_dump_log(dump_log_path, None, chunksize, workers, all_fills, venue, True, index_dir)
+            write_dump_cache(dump_entries, dump_log_path, venue_dir, fingerprint)
+            dump_entries = dump_entries[dump_entries["trace_id"].isin(venue_ids)]
+            # Индекс строится за первый проход по файлу
+            index_dir = None
+        parts.append(dump_entries)
+    if index_dir is not None and not index_is_current(dump_log_path, index_dir):
+        build_trace_index(dump_log_path, index_dir)
+    if len(parts) == 1:
+        return parts[0]
+    # Записи в порядке trace_id, как в кэше одной биржи
+    return pd.concat(parts, ignore_index=True).sort_values("trace_id", kind="stable", ignore_index=True)
+
+
+def venue_groups(venues, trace_ids):
+    """trace_id сделок по биржам (см. trade_venues): [(биржа, trace_id)], неизвестные — DEFAULT_VENUE."""
+    trace_ids = pd.Series(pd.unique(np.asarray(trace_ids)))
+    row_venues = pd.Series(message_venues(venues, trace_ids.to_numpy()), dtype=object)
+    return [(venue, trace_ids[row_venues == venue].to_numpy()) for venue in row_venues.unique()]
+
+
+def read_own_trade_log(own_trade_path, columns=OWN_TRADE_COLUMNS):
+    """Читает own_trade_log по схеме OWN_TRADE_SCHEMA, только нужные столбцы."""
+    return read_typed_csv(own_trade_path, OWN_TRADE_SCHEMA, columns)
+
+
+def read_order_log(order_log_path):
+    """Читает order_log по схеме ORDER_LOG_SCHEMA."""
+    return read_typed_csv(order_log_path, ORDER_LOG_SCHEMA)
+
+
+def read_order_summary(order_log_path, own_trade_log, chunksize=DUMP_LOG_CHUNKSIZE):
+    """
+    Читает order_log частями и сворачивает его до одной строки на ордер,
+    оставляя только ордера, по которым в own_trade_log есть сделки.
+    """
+    return load_order_summary(
+        read_typed_csv_chunks(order_log_path, ORDER_LOG_SCHEMA, chunksize=chunksize),
+        order_ids=own_trade_log.get("order_id"),
+        exchange_order_ids=own_trade_log.get("exchange_order_id"),
+    )
+
+
+@staged("load")
+def load_data(
+    own_trade_path,
+    dump_log_path,
+    order_log_path,
+    chunksize=DUMP_LOG_CHUNKSIZE,
+    cache_dir=None,
+    workers=1,
+    order_summary=False,
+    all_fills=False,
+    index_dir=None,
+):
+    """
+    Загружает входные данные из заданных файлов.
+    С order_summary=True order_log читается потоково и возвращается свернутым по ордерам.
+    С all_fills=True разобранные записи dump_log содержат каждую сделку массива result.
+    Если задан index_dir, там поддерживается индекс trace_id -> смещения строк dump_log.
+    """
+    try:
+        start = time.perf_counter()
+        own_trade_log = read_own_trade_log(own_trade_path)
+        venues = trade_venues(own_trade_log)
+        dump_log = load_dump_entries(
+            dump_log_path, own_trade_log["trace_id"], chunksize, cache_dir, workers, all_fills, venues, index_dir
+        )
+        if order_summary:
+            order_log = read_order_summary(order_log_path, own_trade_log, chunksize)
+        else:
+            order_log = read_order_log(order_log_path)
 
         if own_trade_log.empty:
             logging.warning("own_trade_log is empty.")
@@ -18,7 +512,14 @@ def load_data(own_trade_path, dump_log_path, order_log_path):
             logging.warning("dump_log is empty.")
         if order_log.empty:
             logging.warning("order_log is empty.")
-        
+
+        logging.info(
+            f"load_data took {time.perf_counter() - start:.2f}s: "
+            + ", ".join(
+                f"{name} {len(df)} rows, {memory_per_row(df):.0f} B/row"
+                for name, df in (("own_trade_log", own_trade_log), ("dump_log", dump_log), ("order_log", order_log))
+            )
+        )
         return own_trade_log, dump_log, order_log
 
     except FileNotFoundError as e:
@@ -44,127 +545,184 @@ def classify_asset(asset, base_asset, quote_asset):
         return "aux"
 
 
-def extract_fee_from_message(message, fee_asset_name):
+def extract_fee_from_message(message, fee_asset_name, venue=DEFAULT_VENUE):
     """
-    Извлекает комиссию из сообщения биржевого трафика.
+    Извлекает комиссию из сообщения биржевого трафика биржи venue.
     Если asset равен GT, возвращает gt_fee вместо fee.
     """
-    try:
-        data = json.loads(message)
-
-        # Проверяем, является ли 'result' списком или словарем
-        if isinstance(data["data"]["result"], list):
-            first_result = data["data"]["result"][0]
-        else:
-            first_result = data["data"]["result"]
-
-        # Используем gt_fee для GT-актива
-        if fee_asset_name.upper() == "GT":
-            fee = first_result.get("gt_fee", None)
-            # Для GT используем 'GT' как ассет
-            fee_currency = "GT" if fee else None
-        else:
-            fee = first_result.get("fee", None)
-            fee_currency = first_result.get("fee_currency", None)
-
-        return fee, fee_currency
-    except (KeyError, json.JSONDecodeError, IndexError) as e:
-        logging.error(f"Error extracting fee from message: {e}")
-        return None, None
-
-
-def compare_fees(own_trade_log, dump_log, order_log):
-    """Сравнивает комиссии платформы и биржи, вычисляя ставку как отношение комиссии к объему сделки."""
-    # Фильтруем dump_log по ключевым параметрам
-    filtered_dump_log = dump_log[
-        (dump_log["direction"] == "In")
-        & (dump_log["message_name"] == "WsPayload")
-        & (dump_log["message_kind"] == "Regular")
-    ]
-
-    comparison_data = []
-
-    # Пройдем по всем записям в own_trade_log
-    for _, row in own_trade_log.iterrows():
-        trace_id = row["trace_id"]
-
-        # Преобразуем значения к числовому типу
-        fee_amount = pd.to_numeric(row["fee_amount"], errors="coerce")
-        price = pd.to_numeric(row["price"], errors="coerce")
-        base_amount = pd.to_numeric(row["base_amount"], errors="coerce")
-
-        fee_asset_name = row["fee_asset_name"]
-        base_asset = row["base_asset_name"]
-        quote_asset = row["quote_asset_name"]
-        side = row["side"]
-        role = row["role"]
-        is_fee_evaluated = row["is_fee_evaluated"]
-
-        # Проверка на корректность значений перед расчетом
-        if pd.notna(price) and pd.notna(base_amount) and price > 0 and base_amount > 0:
-            trade_volume = price * base_amount
-        else:
-            trade_volume = 0
+    fees, fee_currencies = extract_fees([message], [fee_asset_name], [venue])
+    return fees[0], fee_currencies[0]
 
-        # Вычисляем ставку комиссии платформы
-        if trade_volume != 0 and pd.notna(fee_amount):
-            # platform_fee_rate = round(fee_amount / trade_volume, 3)
-            platform_fee_rate = round((fee_amount / trade_volume) * 100, 5)
-        else:
-            platform_fee_rate = 0
 
-        # Найдем соответствующие сообщения в dump_log по trace_id
-        related_dump_entries = filtered_dump_log[
-            filtered_dump_log["trace_id"] == trace_id
-        ]
+def classify_assets(assets, base_assets, quote_assets):
+    """
+    Векторная версия classify_asset: классифицирует столбец валют как base, quote или aux.
+    """
+    return np.select(
+        [assets.to_numpy() == base_assets.to_numpy(), assets.to_numpy() == quote_assets.to_numpy()],
+        ["base", "quote"],
+        default="aux",
+    ).astype(object)
 
-        for _, dump_row in related_dump_entries.iterrows():
-            message = dump_row["message"]
 
-            # Извлекаем комиссию из сообщения
-            exchange_fee_amount, exchange_fee_asset = extract_fee_from_message(
-                message, fee_asset_name
-            )
+def calculate_fee_rate(fee_amount, trade_volume):
+    """
+    Вычисляет ставку комиссии в процентах от объема сделки.
+    Для нулевого объема или некорректной комиссии ставка равна 0.
+    """
+    fee_amount = pd.to_numeric(fee_amount, errors="coerce")
+    valid = (trade_volume != 0) & fee_amount.notna()
+    return ((fee_amount / trade_volume) * 100).round(5).where(valid, 0.0)
 
-            # Проверка на корректность значений перед расчетом ставки комиссии биржи
-            if trade_volume != 0 and pd.notna(exchange_fee_amount):
-                # Преобразуем exchange_fee_amount к числовому типу
-                exchange_fee_amount = pd.to_numeric(exchange_fee_amount, errors="coerce")
-                
-                if pd.notna(exchange_fee_amount):
-                    # exchange_fee_rate = round(exchange_fee_amount / trade_volume, 3)
-                    exchange_fee_rate = round((exchange_fee_amount / trade_volume) * 100, 5)
-                else:
-                    exchange_fee_rate = 0
-            else:
-                exchange_fee_rate = 0
-
-            # Классифицируем asset для платформы и биржи
-            platform_asset_type = classify_asset(
-                fee_asset_name, base_asset, quote_asset
-            )
-            exchange_asset_type = (
-                classify_asset(exchange_fee_asset, base_asset, quote_asset)
-                if exchange_fee_asset
-                else None
-            )
 
-            # Составляем запись для сравнения
-            comparison_data.append(
-                {
-                    "trace_id": trace_id,
-                    "side": side,
-                    "role": role,
-                    "is_fee_evaluated": is_fee_evaluated,
-                    "platform_fee_rate": platform_fee_rate,
-                    "platform_fee_asset": platform_asset_type,
-                    "exchange_fee_rate": exchange_fee_rate,
-                    "exchange_fee_asset": exchange_asset_type,
-                }
-            )
+@staged("filter")
+def filter_dump_log(dump_log):
+    """
+    Оставляет в dump_log только входящие WsPayload сообщения типа Regular с trace_id.
+    Столбцы фильтра, отброшенные при потоковой загрузке, пропускаются.
+    trace_id, прочитанный с пропусками (UInt64), приводится к uint64.
+    """
+    mask = dump_log["trace_id"].notna().to_numpy()
+    for column, value in DUMP_LOG_FILTERS.items():
+        if column in dump_log.columns:
+            mask &= (dump_log[column] == value).to_numpy()
+    dump_log = dump_log[mask]
+    if isinstance(dump_log["trace_id"].dtype, pd.UInt64Dtype):
+        dump_log = dump_log.astype({"trace_id": "uint64"})
+    return dump_log
+
+
+@staged("compare")
+def compare_fees(
+    own_trade_log,
+    dump_log,
+    order_log,
+    include_amounts=False,
+    fee_schedule=None,
+    enrich_orders=False,
+    aggregate_fills=False,
+    with_context=False,
+    price_table=None,
+):
+    """
+    Сравнивает комиссии платформы и биржи, вычисляя ставку как отношение комиссии к объему сделки.
+    С include_amounts=True в результат добавляются сами суммы комиссий в текстовом виде.
+    Если передана таблица комиссий (FeeSchedule), добавляется ожидаемая ставка expected_fee_rate.
+    С enrich_orders=True к сделкам присоединяются данные ордеров из order_log (сырого
+    или свернутого read_order_summary): статус, время размещения, время до исполнения
+    и число частичных исполнений.
+    С aggregate_fills=True комиссии всех исполнений из всех сообщений с одним trace_id
+    суммируются (sum_partial_fills), и на сделку приходится одна строка сравнения.
+    С with_context=True добавляются время, инструмент, аккаунт и объем сделки (TRADE_CONTEXT_COLUMNS).
+    Если передана таблица цен (utils.fee_cost), комиссии обеих сторон пересчитываются в
+    COST_CURRENCY по цене на момент сделки (COST_COLUMNS); цены из сделок по парам к
+    COST_CURRENCY дополняют таблицу.
+    """
+    if "message" in dump_log.columns:
+        # Сырой dump_log: фильтруем по ключевым параметрам и разбираем только нужные сообщения
+        filtered_dump_log = filter_dump_log(dump_log)
+        filtered_dump_log = filtered_dump_log[filtered_dump_log["trace_id"].isin(own_trade_log["trace_id"])]
+        dump_entries = parse_dump_log(filtered_dump_log, aggregate_fills, trade_venues(own_trade_log))
+    else:
+        # Записи уже разобраны при загрузке (например, из кэша)
+        dump_entries = dump_log
+    if aggregate_fills:
+        dump_entries = sum_partial_fills(dump_entries)
+
+    # Преобразуем значения к числовому типу
+    price = pd.to_numeric(own_trade_log["price"], errors="coerce")
+    base_amount = pd.to_numeric(own_trade_log["base_amount"], errors="coerce")
+
+    # Проверка на корректность значений перед расчетом (NaN не проходит сравнение)
+    trade_volume = (price * base_amount).where((price > 0) & (base_amount > 0), 0.0)
+
+    trades = pd.DataFrame(
+        {
+            "trace_id": own_trade_log["trace_id"],
+            "side": own_trade_log["side"],
+            "role": own_trade_log["role"],
+            "is_fee_evaluated": own_trade_log["is_fee_evaluated"],
+            "platform_fee_rate": calculate_fee_rate(own_trade_log["fee_amount"], trade_volume),
+            "platform_fee_asset": classify_assets(
+                own_trade_log["fee_asset_name"],
+                own_trade_log["base_asset_name"],
+                own_trade_log["quote_asset_name"],
+            ),
+            "fee_amount": own_trade_log["fee_amount"],
+            "fee_asset_name": own_trade_log["fee_asset_name"],
+            "base_asset_name": own_trade_log["base_asset_name"],
+            "quote_asset_name": own_trade_log["quote_asset_name"],
+            "trade_volume": trade_volume,
+        }
+    )
+    if with_context or price_table is not None:
+        for column in TRADE_CONTEXT_COLUMNS[:-1]:
+            trades[column] = own_trade_log[column] if column in own_trade_log.columns else None
+
+    if fee_schedule is not None:
+        trades[EXPECTED_RATE_COLUMN] = fee_schedule.expected_rates(
+            own_trade_log.get("instrument_name"),
+            own_trade_log["role"],
+            own_trade_log.get("account_name"),
+            is_gt_asset(own_trade_log["fee_asset_name"]),
+        )
 
-    # Преобразуем результат в DataFrame
-    return pd.DataFrame(comparison_data)
+    if enrich_orders:
+        # Обогащаем до join с dump_log, чтобы число исполнений считалось по всем сделкам ордера;
+        # сделки, уже обогащенные вызывающим кодом (инкрементальный режим), используются как есть
+        if all(column in own_trade_log.columns for column in ORDER_COLUMNS):
+            enriched = own_trade_log
+        else:
+            enriched = attach_order_info(own_trade_log, order_log)
+        for column in ORDER_COLUMNS:
+            trades[column] = enriched[column].to_numpy()
+
+    # Hash join по trace_id вместо поиска в dump_log для каждой сделки.
+    # Порядок строк сохраняется: сделки в порядке own_trade_log, сообщения в порядке dump_log.
+    with stage("join", rows_in=len(trades)) as join:
+        merged = trades.merge(dump_entries[PARSED_DUMP_COLUMNS], on="trace_id", how="inner", sort=False)
+        join.rows_out = len(merged)
+
+    # Выбираем комиссию биржи (gt_fee для GT-актива)
+    fees, fee_currencies = select_fees(
+        merged["fee"], merged["fee_currency"], merged["gt_fee"], merged["gt_fee_currency"], merged["fee_asset_name"]
+    )
+    exchange_fee_amount = pd.Series(fees, index=merged.index)
+    exchange_fee_asset = pd.Series(fee_currencies, index=merged.index, dtype=object)
+
+    merged["exchange_fee_rate"] = calculate_fee_rate(exchange_fee_amount, merged["trade_volume"])
+
+    # Классифицируем asset биржи, если он указан в сообщении
+    has_exchange_asset = exchange_fee_asset.notna() & (exchange_fee_asset != "")
+    merged["exchange_fee_asset"] = pd.Series(
+        classify_assets(exchange_fee_asset, merged["base_asset_name"], merged["quote_asset_name"]),
+        index=merged.index,
+    ).where(has_exchange_asset, None)
+
+    if include_amounts:
+        merged["platform_fee_amount"] = merged["fee_amount"]
+        merged["exchange_fee_amount"] = exchange_fee_amount
+
+    if price_table is not None:
+        prices = combine_prices(price_table, trade_prices(own_trade_log))
+        # Если биржа не указала валюту, считаем, что комиссия списана в валюте платформы
+        exchange_currency = exchange_fee_asset.where(has_exchange_asset, merged["fee_asset_name"].astype(object))
+        merged["platform_fee_cost"] = convert_to_currency(
+            merged["fee_amount"], merged["fee_asset_name"].astype(object), merged["platform_time"], prices
+        )
+        merged["exchange_fee_cost"] = convert_to_currency(
+            exchange_fee_amount, exchange_currency, merged["platform_time"], prices
+        )
+        merged["fee_cost_difference"] = merged["platform_fee_cost"] - merged["exchange_fee_cost"]
+
+    columns = comparison_columns(
+        include_amounts,
+        with_expected_rate=fee_schedule is not None,
+        with_orders=enrich_orders,
+        with_context=with_context,
+        with_costs=price_table is not None,
+    )
+    return merged[columns].reset_index(drop=True)
 
 
 def save_results(comparison_df, output_file="output/_fee_comparison.csv"):
@@ -177,52 +735,248 @@ def save_results(comparison_df, output_file="output/_fee_comparison.csv"):
         raise
 
 
-def group_comparison_data(comparison_df, group_by_columns, output_file):
-    """Создаёт сгруппированную таблицу по заданным столбцам, вычисляя средние значения.."""
-    # Группируем по указанным столбцам
-    grouped = (
-        comparison_df.groupby(group_by_columns)
+@staged("aggregate")
+def aggregate_comparison_data(comparison_df, group_by_columns):
+    """
+    Считает частичные агрегаты (количество и суммы ставок) по заданным столбцам.
+    Частичные агрегаты можно складывать между запусками, не пересчитывая всё с нуля.
+    """
+    return (
+        comparison_df.groupby(group_by_columns, observed=True)
         .agg(
             total_count=("trace_id", "count"),
-            avg_platform_fee=("platform_fee_rate", "mean"),
             sum_platform_fee=("platform_fee_rate", "sum"),
-            avg_exchange_fee=("exchange_fee_rate", "mean"),
             sum_exchange_fee=("exchange_fee_rate", "sum"),
         )
         .reset_index()
     )
 
-    # Округляем числовые столбцы до 3 знаков после запятой
+
+def merge_partial_aggregates(partials, group_by_columns):
+    """
+    Складывает несколько таблиц частичных агрегатов по одинаковым группам.
+    Группы, у которых после вычитания (negate_partial_aggregates) не осталось строк, отбрасываются.
+    """
+    merged = pd.concat(partials, ignore_index=True).groupby(group_by_columns, observed=True).sum().reset_index()
+    return merged[merged["total_count"] != 0].reset_index(drop=True)
+
+
+def negate_partial_aggregates(partial, group_by_columns):
+    """Частичные агрегаты с обратным знаком: при сложении они вычитают строки, по которым посчитаны."""
+    negated = partial.copy()
+    value_columns = negated.columns.difference(group_by_columns)
+    negated[value_columns] = -negated[value_columns]
+    return negated
+
+
+def finalize_grouped_data(partial, group_by_columns):
+    """Вычисляет средние значения из частичных агрегатов и округляет результат."""
+    grouped = partial[group_by_columns + ["total_count"]].copy()
+    grouped["avg_platform_fee"] = partial["sum_platform_fee"] / partial["total_count"]
+    grouped["sum_platform_fee"] = partial["sum_platform_fee"]
+    grouped["avg_exchange_fee"] = partial["sum_exchange_fee"] / partial["total_count"]
+    grouped["sum_exchange_fee"] = partial["sum_exchange_fee"]
+
+    # Округляем числовые столбцы до 5 знаков после запятой
     grouped[["avg_platform_fee", "sum_platform_fee", "avg_exchange_fee", "sum_exchange_fee"]] = grouped[
         ["avg_platform_fee", "sum_platform_fee", "avg_exchange_fee", "sum_exchange_fee"]
     ].round(5)
+    return grouped
+
 
-    # Сохраняем результаты в CSV файл
+def save_grouped_data(grouped, output_file):
+    """Сохраняет сгруппированную таблицу в CSV."""
     grouped.to_csv(output_file, index=False)
     logging.info(f"Grouped results saved to {output_file}")
 
 
-def main():
+def group_comparison_data(comparison_df, group_by_columns, output_file):
+    """Создаёт сгруппированную таблицу по заданным столбцам, вычисляя средние значения.."""
+    partial = aggregate_comparison_data(comparison_df, group_by_columns)
+    save_grouped_data(finalize_grouped_data(partial, group_by_columns), output_file)
+
+
+def aggregate_cost_impact(comparison_df, group_by_columns=COST_GROUP_COLUMNS):
+    """
+    Суммирует денежный эффект расхождений в COST_CURRENCY по группам: комиссии сторон,
+    их чистую разницу и сумму абсолютных расхождений (расхождения разного знака
+    не компенсируют друг друга). Группы отсортированы по абсолютному расхождению.
+    """
+    missing = [column for column in [*group_by_columns, *COST_COLUMNS] if column not in comparison_df.columns]
+    if missing:
+        raise ValueError(f"Cost impact requires columns {missing}; run compare_fees with context and a price table")
+    difference = comparison_df["fee_cost_difference"]
+    impact = (
+        comparison_df.assign(
+            abs_cost_difference=difference.abs(),
+            mismatched=difference.ne(0) & difference.notna(),
+            unpriced=difference.isna(),
+        )
+        .groupby(group_by_columns, observed=True, dropna=False)
+        .agg(
+            total_count=("fee_cost_difference", "size"),
+            mismatched_count=("mismatched", "sum"),
+            unpriced_count=("unpriced", "sum"),
+            platform_fee_cost=("platform_fee_cost", "sum"),
+            exchange_fee_cost=("exchange_fee_cost", "sum"),
+            net_cost_difference=("fee_cost_difference", "sum"),
+            abs_cost_difference=("abs_cost_difference", "sum"),
+        )
+        .reset_index()
+    )
+    return impact.sort_values("abs_cost_difference", ascending=False, kind="stable").reset_index(drop=True)
+
+
+def save_cost_impact(comparison_df, output_file=COST_IMPACT_OUTPUT):
+    """Сохраняет отчет о стоимости расхождений в CSV."""
+    impact = aggregate_cost_impact(comparison_df)
+    impact.to_csv(output_file, index=False)
+    logging.info(
+        f"Cost impact saved to {output_file}: {impact['abs_cost_difference'].sum():.6f} {COST_CURRENCY} "
+        f"in absolute discrepancies"
+    )
+    return impact
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare platform and exchange fees.")
+    parser.add_argument(
+        "--chunksize",
+        type=int,
+        default=DUMP_LOG_CHUNKSIZE,
+        help="Number of dump_log rows read into memory at once",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DUMP_CACHE_DIR,
+        help="Directory for the Parquet cache of parsed dump_log entries",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the dump_log cache")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes parsing dump_log shards in parallel",
+    )
+    parser.add_argument(
+        "--include-amounts",
+        action="store_true",
+        help="Add raw platform and exchange fee amounts (needed for exact mismatch detection)",
+    )
+    parser.add_argument(
+        "--fee-schedule",
+        default=None,
+        help="CSV fee schedule; adds the expected fee rate to every comparison row",
+    )
+    parser.add_argument(
+        "--aggregate-fills",
+        action="store_true",
+        help="Sum exchange fees of all fills and messages of a trace_id into one comparison row",
+    )
+    parser.add_argument(
+        "--price-table",
+        default=None,
+        help=f"CSV of asset prices in {COST_CURRENCY} over time; adds fee costs and writes {COST_IMPACT_OUTPUT}",
+    )
+    parser.add_argument(
+        "--trade-context",
+        action="store_true",
+        help="Add trade time, instrument, account and volume (needed by scripts.fee_drift)",
+    )
+    parser.add_argument(
+        "--enrich-orders",
+        action="store_true",
+        help="Join order_log by order_id/exchange_order_id and add order status, placement time and fill counts",
+    )
+    parser.add_argument(
+        "--trace-index",
+        action="store_true",
+        help="Keep the trace_id -> dump_log row offset index in --index-dir up to date while loading",
+    )
+    parser.add_argument("--index-dir", default=TRACE_INDEX_DIR, help="Directory of the trace_id index")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Process only data appended since the previous incremental run",
+    )
+    parser.add_argument(
+        "--state-dir",
+        default="output/.incremental",
+        help="Directory with the watermark of the incremental mode",
+    )
+    parser.add_argument(
+        "--pending-horizon",
+        default="1D",
+        help="Drop dump_log messages still without a trade once trades move this far past them (incremental mode)",
+    )
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def run_analysis(args):
+    """Сравнение комиссий по параметрам командной строки."""
+    # Вместо отсутствующего файла читается его сжатая копия (.gz, .zst)
+    input_paths = [resolve_input(path) for path in INPUT_PATHS]
+    fee_schedule = load_fee_schedule(args.fee_schedule) if args.fee_schedule else None
+    price_table = load_price_table(args.price_table) if args.price_table else None
+    # Отчет о стоимости группируется по аккаунту и инструменту, поэтому нужен контекст сделки
+    with_context = args.trade_context or price_table is not None
+    if args.incremental:
+        # Импорт внутри функции: incremental_analysis сам импортирует этот модуль
+        from scripts.incremental_analysis import run_incremental
+
+        run_incremental(
+            *input_paths,
+            state_dir=args.state_dir,
+            chunksize=args.chunksize,
+            include_amounts=args.include_amounts,
+            fee_schedule=fee_schedule,
+            enrich_orders=args.enrich_orders,
+            aggregate_fills=args.aggregate_fills,
+            with_context=with_context,
+            price_table=price_table,
+            pending_horizon=args.pending_horizon,
+        )
+        return
+
     own_trade_log, dump_log, order_log = load_data(
-        "data/own_trade_log.csv", "data/dump_log.csv", "data/order_log.csv"
+        *input_paths,
+        chunksize=args.chunksize,
+        cache_dir=None if args.no_cache else args.cache_dir,
+        workers=args.workers,
+        order_summary=args.enrich_orders,
+        all_fills=args.aggregate_fills,
+        index_dir=args.index_dir if args.trace_index else None,
     )
     
-    comparison_df = compare_fees(own_trade_log, dump_log, order_log)
+    comparison_df = compare_fees(
+        own_trade_log,
+        dump_log,
+        order_log,
+        include_amounts=args.include_amounts,
+        fee_schedule=fee_schedule,
+        enrich_orders=args.enrich_orders,
+        aggregate_fills=args.aggregate_fills,
+        with_context=with_context,
+        price_table=price_table,
+    )
     save_results(comparison_df)
+    if price_table is not None:
+        save_cost_impact(comparison_df)
 
-    # Группировка итоговой таблицы по Side и Role
-    group_comparison_data(
-        comparison_df,
-        ["side", "role"],
-        "output/_fee_comparison_grouped_by_side_and_role.csv",
-    )
+    # Группировка итоговой таблицы по Side и Role и по is_fee_evaluated
+    for output_file, group_by_columns in GROUPED_OUTPUTS.items():
+        group_comparison_data(comparison_df, group_by_columns, output_file)
 
-    # Группировка итоговой таблицы по is_fee_evaluated
-    group_comparison_data(
-        comparison_df,
-        ["is_fee_evaluated"],
-        "output/_fee_comparison_grouped_by_fee_evaluated.csv",
-    )
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_from_args(args)
+    try:
+        run_analysis(args)
+    finally:
+        # Отчет пишется и при ошибке: упавший этап в нем тоже есть
+        write_reports_from_args(args, "data_analysis")
 
 
 if __name__ == "__main__":
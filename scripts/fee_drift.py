@@ -0,0 +1,222 @@
+import argparse
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from scripts.data_analysis import TRADE_CONTEXT_COLUMNS
+from scripts.inconsistency_detection import rates_differ
+from utils.csv_schema import csv_columns
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:  # pyarrow не обязателен: без него результат пишется в сжатый CSV
+    pyarrow = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+DRIFT_KEYS = ["instrument_name", "role"]
+DRIFT_WINDOW = "15min"
+DRIFT_BUCKET = "1min"
+DRIFT_QUANTILES = (0.5, 0.95)
+# Порог z-оценки сдвига среднего fee_difference между соседними окнами
+CHANGE_POINT_Z = 4.0
+# Порог изменения доли расхождений между соседними окнами
+CHANGE_POINT_RATE = 0.25
+# Минимальное число сделок в каждом из сравниваемых окон
+CHANGE_POINT_MIN_TRADES = 20
+# Статистики хранятся в float32: для ставок в процентах этого достаточно, а файл вдвое меньше
+DRIFT_FLOAT_DTYPE = "float32"
+
+
+def drift_frame(data, time_column="platform_time", atol=0.0, rtol=0.0):
+    """
+    Готовит построчные величины для скользящих статистик: fee_difference, признак
+    расхождения и произведения объема на ставки для средневзвешенных ставок.
+    Строки без времени или ключей группировки отбрасываются; результат отсортирован
+    по ключам и времени.
+    """
+    missing = [column for column in [time_column, *DRIFT_KEYS, "trade_volume"] if column not in data.columns]
+    if missing:
+        raise ValueError(f"Drift monitoring requires columns {missing}; run data_analysis with --trade-context")
+
+    platform_rate = pd.to_numeric(data["platform_fee_rate"], errors="coerce").to_numpy(dtype=float)
+    exchange_rate = pd.to_numeric(data["exchange_fee_rate"], errors="coerce").to_numpy(dtype=float)
+    volume = pd.to_numeric(data["trade_volume"], errors="coerce").fillna(0.0).to_numpy(dtype=float)
+    mismatch = rates_differ(platform_rate, exchange_rate, atol, rtol)
+    mismatch |= data["platform_fee_asset"].ne(data["exchange_fee_asset"]).to_numpy()
+
+    frame = pd.DataFrame(
+        {
+            "time": pd.to_datetime(data[time_column]),
+            **{key: data[key] for key in DRIFT_KEYS},
+            "fee_difference": platform_rate - exchange_rate,
+            "mismatch": mismatch.astype(float),
+            "volume": volume,
+            "platform_volume": np.nan_to_num(platform_rate) * volume,
+            "exchange_volume": np.nan_to_num(exchange_rate) * volume,
+        }
+    )
+    frame = frame.dropna(subset=["time", *DRIFT_KEYS])
+    return frame.sort_values([*DRIFT_KEYS, "time"], kind="stable").reset_index(drop=True)
+
+
+def rolling_drift(frame, window=DRIFT_WINDOW, quantiles=DRIFT_QUANTILES):
+    """
+    Считает скользящие по времени статистики для каждой пары инструмент/роль.
+    Суммы, среднее и дисперсия обновляются за O(1) на сделку (при входе в окно и выходе
+    из него), квантили — по отсортированному окну за O(log n). Значение в строке
+    относится к окну длины window, заканчивающемуся на этой сделке.
+    """
+    rolling = frame.groupby(DRIFT_KEYS, sort=False, observed=True).rolling(window, on="time")
+    sums = rolling[["mismatch", "volume", "platform_volume", "exchange_volume"]].sum()
+    difference = rolling["fee_difference"]
+
+    # Группы идут в порядке первого появления, а frame отсортирован по ключам и времени,
+    # поэтому строки результата rolling совпадают со строками frame по позиции
+    stats = frame[["time", *DRIFT_KEYS]].assign(
+        trades=rolling["mismatch"].count().to_numpy(dtype=np.int64),
+        mean_fee_difference=difference.mean().to_numpy(),
+        std_fee_difference=difference.std(ddof=0).to_numpy(),
+        **{f"p{round(q * 100)}_fee_difference": difference.quantile(q).to_numpy() for q in quantiles},
+    )
+    stats["mismatch_rate"] = sums["mismatch"].to_numpy() / stats["trades"].to_numpy()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        stats["vw_platform_fee_rate"] = sums["platform_volume"].to_numpy() / sums["volume"].to_numpy()
+        stats["vw_exchange_fee_rate"] = sums["exchange_volume"].to_numpy() / sums["volume"].to_numpy()
+    return stats
+
+
+def bucket_drift(stats, bucket=DRIFT_BUCKET):
+    """
+    Сворачивает построчные скользящие статистики до одной строки на интервал bucket:
+    берется состояние окна на последней сделке интервала и число сделок в интервале.
+    Интервалы без сделок не хранятся, поэтому объем не зависит от длины периода.
+    """
+    keys = [*DRIFT_KEYS, "bucket"]
+    stats = stats.assign(bucket=stats["time"].dt.floor(bucket))
+    # stats отсортированы по ключам и времени: последняя строка интервала — его последняя сделка
+    buckets = stats.drop_duplicates(keys, keep="last")
+    buckets = buckets[[*keys, *stats.columns.drop([*keys, "time"])]].reset_index(drop=True)
+    sizes = stats.groupby(keys, sort=False, observed=True).size()
+    buckets.insert(len(keys), "bucket_trades", sizes.to_numpy())
+    return buckets
+
+
+def flag_change_points(
+    buckets,
+    window=DRIFT_WINDOW,
+    z_threshold=CHANGE_POINT_Z,
+    rate_threshold=CHANGE_POINT_RATE,
+    min_trades=CHANGE_POINT_MIN_TRADES,
+):
+    """
+    Помечает точки изменения: окно, заканчивающееся на интервале, сравнивается с
+    предыдущим непересекающимся окном той же пары (merge_asof на время bucket - window).
+    Изменение фиксируется, если z-оценка разницы средних fee_difference не меньше
+    z_threshold или доля расхождений сдвинулась не меньше чем на rate_threshold.
+    """
+    buckets = buckets.sort_values("bucket", kind="stable").reset_index(drop=True)
+    previous = buckets[[*DRIFT_KEYS, "bucket", "trades", "mean_fee_difference", "std_fee_difference", "mismatch_rate"]]
+    previous = previous.rename(columns={"bucket": "previous_bucket"})
+    lookup = buckets[[*DRIFT_KEYS, "bucket"]].assign(previous_bucket=buckets["bucket"] - pd.Timedelta(window))
+    matched = pd.merge_asof(
+        lookup.reset_index(), previous, on="previous_bucket", by=DRIFT_KEYS, direction="backward"
+    ).set_index("index").sort_index()
+
+    n, n_previous = buckets["trades"].to_numpy(dtype=float), matched["trades"].to_numpy(dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        spread = np.sqrt(
+            buckets["std_fee_difference"].to_numpy() ** 2 / n + matched["std_fee_difference"].to_numpy() ** 2 / n_previous
+        )
+        shift = buckets["mean_fee_difference"].to_numpy() - matched["mean_fee_difference"].to_numpy()
+        z = np.where(spread > 0, shift / spread, np.where(shift != 0, np.inf, 0.0))
+    rate_shift = np.abs(buckets["mismatch_rate"].to_numpy() - matched["mismatch_rate"].to_numpy())
+
+    enough = (n >= min_trades) & (n_previous >= min_trades)
+    buckets["drift_z"] = np.where(enough, z, np.nan)
+    buckets["change_point"] = enough & ((np.abs(z) >= z_threshold) | (rate_shift >= rate_threshold))
+    return buckets.sort_values([*DRIFT_KEYS, "bucket"], kind="stable").reset_index(drop=True)
+
+
+def compute_fee_drift(data, time_column="platform_time", window=DRIFT_WINDOW, bucket=DRIFT_BUCKET, **options):
+    """
+    Строит временной ряд дрейфа комиссий по инструментам и ролям: скользящие статистики
+    на конец каждого интервала bucket и признак точки изменения.
+    options — atol/rtol для признака расхождения и пороги flag_change_points.
+    """
+    tolerances = {key: options.pop(key) for key in ("atol", "rtol") if key in options}
+    frame = drift_frame(data, time_column, **tolerances)
+    if frame.empty:
+        logging.warning("No timestamped comparison rows, drift is empty.")
+    buckets = bucket_drift(rolling_drift(frame, window), bucket)
+    return flag_change_points(buckets, window, **options)
+
+
+def save_fee_drift(drift, output_file):
+    """
+    Сохраняет ряд компактно: ключи — категории, статистики — float32.
+    С pyarrow пишется Parquet (сжатие и чтение отдельных столбцов), иначе — CSV.gz.
+    Возвращает путь записанного файла.
+    """
+    drift = drift.copy()
+    for key in DRIFT_KEYS:
+        drift[key] = drift[key].astype("category")
+    floats = drift.select_dtypes(include="float64").columns
+    drift[floats] = drift[floats].astype(DRIFT_FLOAT_DTYPE)
+
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    if pyarrow is not None:
+        output_file = output_file.with_suffix(".parquet")
+        drift.to_parquet(output_file, index=False, compression="zstd")
+    else:
+        output_file = output_file.with_suffix(".csv.gz")
+        drift.to_csv(output_file, index=False, compression="gzip")
+    logging.info(f"Fee drift ({len(drift)} buckets, {int(drift['change_point'].sum())} change points) saved to {output_file}")
+    return output_file
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Monitor fee drift over time per instrument and role.")
+    parser.add_argument("--input", default="output/_fee_comparison.csv", help="Comparison file with trade context")
+    parser.add_argument("--output", default="output/_fee_drift", help="Output path (suffix is chosen by format)")
+    parser.add_argument(
+        "--time-column", default="platform_time", choices=TRADE_CONTEXT_COLUMNS[:2], help="Timestamp to bucket by"
+    )
+    parser.add_argument("--window", default=DRIFT_WINDOW, help="Rolling window length (pandas offset)")
+    parser.add_argument("--bucket", default=DRIFT_BUCKET, help="Output time bucket (pandas offset)")
+    parser.add_argument("--atol", type=float, default=0.0, help="Absolute tolerance for fee rate comparison")
+    parser.add_argument("--rtol", type=float, default=0.0, help="Relative tolerance for fee rate comparison")
+    parser.add_argument("--z-threshold", type=float, default=CHANGE_POINT_Z, help="Change point z-score")
+    parser.add_argument(
+        "--rate-threshold", type=float, default=CHANGE_POINT_RATE, help="Change point mismatch rate shift"
+    )
+    parser.add_argument(
+        "--min-trades", type=int, default=CHANGE_POINT_MIN_TRADES, help="Trades needed in both compared windows"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    header = csv_columns(args.input)
+    data = pd.read_csv(args.input, parse_dates=[column for column in TRADE_CONTEXT_COLUMNS[:2] if column in header])
+    drift = compute_fee_drift(
+        data,
+        time_column=args.time_column,
+        window=args.window,
+        bucket=args.bucket,
+        atol=args.atol,
+        rtol=args.rtol,
+        z_threshold=args.z_threshold,
+        rate_threshold=args.rate_threshold,
+        min_trades=args.min_trades,
+    )
+    save_fee_drift(drift, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,41 +1,102 @@
+import argparse
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import logging
-from utils.visualization import plot_heatmap, plot_histograms, visualize_mismatches
-from utils.analyze_mismatch_influence import analyze_mismatch_influence, save_analysis_results
+from utils.analyze_mismatch_influence import (
+    build_mismatch_cube,
+    cube_flag_counts,
+    cube_value_counts,
+    save_analysis_results,
+    slice_mismatch_cube,
+)
+from utils.fixed_point import fixed_point_equal
+from utils.trace_index import TRACE_INDEX_DIR, attach_dump_log_offsets
+from utils.instrumentation import (
+    add_instrumentation_arguments,
+    configure_from_args,
+    staged,
+    write_reports_from_args,
+)
+from scripts.data_analysis import AMOUNT_COLUMNS, EXPECTED_RATE_COLUMN
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+MISMATCH_TYPES = ["fee_mismatch", "asset_mismatch", "fee_difference", "sign_mismatch"]
+FEATURES = ["side", "role", "is_fee_evaluated"]
+ASSET_COLUMNS = ["platform_fee_asset", "exchange_fee_asset"]
+SUMMARY_FLAGS = ["sign_mismatch", "fee_mismatch", "asset_mismatch"]
+# Признаки отклонения от таблицы комиссий (есть, только если сравнение строилось с --fee-schedule)
+SCHEDULE_MISMATCH_TYPES = ["platform_schedule_mismatch", "exchange_schedule_mismatch"]
 
+
+@staged("load")
 def load_comparison_data(filepath):
     """Загружает данные сравнения из из заданного файла."""
     try:
-        comparison_df = pd.read_csv(filepath)
+        # Суммы комиссий читаются строками, чтобы точный режим сравнивал исходные десятичные значения
+        comparison_df = pd.read_csv(filepath, dtype={column: str for column in AMOUNT_COLUMNS})
         return comparison_df
     except FileNotFoundError as e:
         logging.error(f"Error loading comparison data: {e}")
         raise
 
 
-def detect_mismatches(data):
-    """Выявляет расхождения между платформой и биржей."""
-    # Сравнить платформенные и биржевые комиссии
-    data["fee_mismatch"] = data["platform_fee_rate"] != data["exchange_fee_rate"]
-    data["asset_mismatch"] = data["platform_fee_asset"] != data["exchange_fee_asset"]
+def rates_differ(rates, reference, atol=0.0, rtol=0.0):
+    """
+    Поэлементно проверяет, что ставки не совпадают с опорными:
+    совпадением считается |rates - reference| <= atol + rtol * |reference|. NaN не совпадает ни с чем.
+    """
+    with np.errstate(invalid="ignore"):
+        within_tolerance = np.abs(rates - reference) <= atol + rtol * np.abs(reference)
+    return ~(within_tolerance | (rates == reference))
 
-    # Отфильтровать строки с расхождениями
-    mismatched_data = data[(data["fee_mismatch"]) | (data["asset_mismatch"])]
 
-    # Проанализировать характер ошибок
-    mismatched_data["fee_difference"] = (
-        data["platform_fee_rate"] - data["exchange_fee_rate"]
-    )
-    mismatched_data["sign_mismatch"] = (
-        (data["platform_fee_rate"] > 0) & (data["exchange_fee_rate"] < 0)
-    ) | ((data["platform_fee_rate"] < 0) & (data["exchange_fee_rate"] > 0))
+@staged("detect")
+def detect_mismatches(data, atol=0.0, rtol=0.0, exact=False):
+    """
+    Выявляет расхождения между платформой и биржей за один проход по массивам NumPy.
+    Ставки считаются совпадающими, если |platform - exchange| <= atol + rtol * |exchange|.
+    При exact=True комиссии сравниваются точно по суммам (platform_fee_amount и
+    exchange_fee_amount, см. compare_fees(include_amounts=True)) в целочисленном виде.
+    Если в данных есть expected_fee_rate, ставки обеих сторон сверяются и с таблицей комиссий
+    (с теми же допусками); строки без ставки в таблице отклонением не считаются.
+    Исходный DataFrame не изменяется.
+    """
+    platform_rate = pd.to_numeric(data["platform_fee_rate"], errors="coerce").to_numpy(dtype=float)
+    exchange_rate = pd.to_numeric(data["exchange_fee_rate"], errors="coerce").to_numpy(dtype=float)
+
+    if exact:
+        missing = [column for column in AMOUNT_COLUMNS if column not in data.columns]
+        if missing:
+            raise ValueError(f"Exact comparison requires fee amount columns: {missing}")
+        fee_mismatch = ~fixed_point_equal(data["platform_fee_amount"], data["exchange_fee_amount"])
+    else:
+        fee_mismatch = rates_differ(platform_rate, exchange_rate, atol, rtol)
+    asset_mismatch = data["platform_fee_asset"].ne(data["exchange_fee_asset"]).to_numpy()
+    mask = fee_mismatch | asset_mismatch
+
+    schedule_flags = {}
+    if EXPECTED_RATE_COLUMN in data.columns:
+        expected_rate = pd.to_numeric(data[EXPECTED_RATE_COLUMN], errors="coerce").to_numpy(dtype=float)
+        has_schedule = ~np.isnan(expected_rate)
+        schedule_flags = {
+            "platform_schedule_mismatch": has_schedule & rates_differ(platform_rate, expected_rate, atol, rtol),
+            "exchange_schedule_mismatch": has_schedule & rates_differ(exchange_rate, expected_rate, atol, rtol),
+        }
+        for flags in schedule_flags.values():
+            mask |= flags
+
+    # Дальнейшие признаки считаются только для строк с расхождениями
+    platform_rate, exchange_rate = platform_rate[mask], exchange_rate[mask]
+    columns = {column: data[column].array[mask] for column in data.columns}
+    columns["fee_mismatch"] = fee_mismatch[mask]
+    columns["asset_mismatch"] = asset_mismatch[mask]
+    columns["fee_difference"] = platform_rate - exchange_rate
+    columns["sign_mismatch"] = np.sign(platform_rate) * np.sign(exchange_rate) < 0
+    for name, flags in schedule_flags.items():
+        columns[name] = flags[mask]
 
-    return mismatched_data
+    return pd.DataFrame(columns, index=data.index[mask])
 
 
 def save_summary_report(summary, output_file):
@@ -69,26 +130,28 @@ def save_summary_report(summary, output_file):
 #     return "\n".join(formatted)
 
 
-def summarize_mismatches(mismatched_data, output_file="output/_mismatched_summary.csv"):
+def schedule_mismatch_types(mismatched_data):
+    """Признаки отклонения от таблицы комиссий, присутствующие в данных (или в кубе агрегатов)."""
+    columns = set(mismatched_data.columns)
+    return [column for column in SCHEDULE_MISMATCH_TYPES if column in columns or f"{column}_sum" in columns]
+
+
+def build_summary_cube(mismatched_data):
+    """Строит куб агрегатов по признакам и активам, из которого пишутся все отчеты."""
+    mismatch_types = MISMATCH_TYPES + schedule_mismatch_types(mismatched_data)
+    return build_mismatch_cube(mismatched_data, mismatch_types, FEATURES + ASSET_COLUMNS)
+
+
+def summarize_mismatches(mismatched_data, output_file="output/_mismatched_summary.csv", cube=None):
     """Выводит и сохраняет сводный отчет по расхождениям."""
-    summary = {
-        "Total mismatched rows": len(mismatched_data),
-        "Mismatches by platform_fee_asset": mismatched_data["platform_fee_asset"]
-        .value_counts()
-        .to_dict(),
-        "Mismatches by exchange_fee_asset": mismatched_data["exchange_fee_asset"]
-        .value_counts()
-        .to_dict(),
-        "Mismatches by sign_mismatch": mismatched_data["sign_mismatch"]
-        .value_counts()
-        .to_dict(),
-        "Mismatches by fee_mismatch": mismatched_data["fee_mismatch"]
-        .value_counts()
-        .to_dict(),
-        "Mismatches by asset_mismatch": mismatched_data["asset_mismatch"]
-        .value_counts()
-        .to_dict(),
-    }
+    summary_flags = SUMMARY_FLAGS + schedule_mismatch_types(mismatched_data)
+    if cube is None:
+        cube = build_mismatch_cube(mismatched_data, summary_flags, ASSET_COLUMNS)
+    summary = {"Total mismatched rows": int(cube["count"].sum())}
+    for column in ASSET_COLUMNS:
+        summary[f"Mismatches by {column}"] = cube_value_counts(cube, column).to_dict()
+    for flag in summary_flags:
+        summary[f"Mismatches by {flag}"] = cube_flag_counts(cube, flag)
 
     # print("\nSummary of mismatched data:")
     # print(format_summary(summary))
@@ -96,11 +159,13 @@ def summarize_mismatches(mismatched_data, output_file="output/_mismatched_summar
 
 
 def summarize_grouped_mismatches(
-    mismatched_data, output_file="output/_grouped_summary.csv"
+    mismatched_data, output_file="output/_grouped_summary.csv", cube=None
 ):
     """Создает группировку по Side и Role."""
     try:
-        grouped = mismatched_data.groupby(["side", "role"]).size().reset_index(name="count")
+        if cube is None:
+            cube = build_mismatch_cube(mismatched_data, [], ["side", "role"])
+        grouped = cube.groupby(level=["side", "role"], sort=True)["count"].sum().reset_index()
         grouped.to_csv(output_file, index=False)
         logging.info(f"Grouped summary saved to {output_file}")
     except Exception as e:
@@ -118,32 +183,56 @@ def save_mismatches(mismatched_data, output_file="output/_mismatched_data.csv"):
         raise
 
 
-def main():
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Detect and analyze fee mismatches.")
+    parser.add_argument("--atol", type=float, default=0.0, help="Absolute tolerance for fee rate comparison")
+    parser.add_argument("--rtol", type=float, default=0.0, help="Relative tolerance for fee rate comparison")
+    parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Compare fee amounts exactly in fixed point (needs data_analysis --include-amounts)",
+    )
+    parser.add_argument(
+        "--dump-log-pointers",
+        action="store_true",
+        help="Add dump_log byte offsets of every mismatch (builds the trace_id index if needed)",
+    )
+    parser.add_argument("--dump-log", default="data/dump_log.csv", help="dump_log the pointers refer to")
+    parser.add_argument("--index-dir", default=TRACE_INDEX_DIR, help="Directory of the trace_id index")
+    parser.add_argument("--no-plots", action="store_true", help="Skip chart rendering (headless runs)")
+    parser.add_argument(
+        "--plot-workers", type=int, default=None, help="Processes for chart rendering (default: CPU count)"
+    )
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def run_analysis(args):
+    """Поиск и анализ расхождений по параметрам командной строки."""
     data = load_comparison_data("output/_fee_comparison.csv")
-    mismatched_data = detect_mismatches(data)
+    mismatched_data = detect_mismatches(data, atol=args.atol, rtol=args.rtol, exact=args.exact)
+    if args.dump_log_pointers:
+        # Указатели на исходные строки: scripts.trace_lookup --offset выводит их за миллисекунды
+        mismatched_data = attach_dump_log_offsets(mismatched_data, args.dump_log, args.index_dir)
     save_mismatches(mismatched_data)
 
+    # Все сводные таблицы строятся из одного куба агрегатов
+    mismatch_types = MISMATCH_TYPES + schedule_mismatch_types(mismatched_data)
+    cube = build_summary_cube(mismatched_data)
+
     # Сводный отчет о расхождениях
-    summarize_mismatches(mismatched_data)
+    summarize_mismatches(mismatched_data, cube=cube)
 
     # Группировка расхождений по Side и Role
-    summarize_grouped_mismatches(mismatched_data)
+    summarize_grouped_mismatches(mismatched_data, cube=cube)
 
     # Анализ влияния переменных
-    mismatch_types = [
-        "fee_mismatch",
-        "asset_mismatch",
-        "fee_difference",
-        "sign_mismatch",
-    ]
-    features = ["side", "role", "is_fee_evaluated"]
-
     analysis_results = {}
 
     for mismatch_type in mismatch_types:
-        for feature in features:
+        for feature in FEATURES:
             print(f"Analyzing {mismatch_type} by {feature}...")
-            result = analyze_mismatch_influence(mismatched_data, mismatch_type, feature)
+            result = slice_mismatch_cube(cube, mismatch_type, feature)
             analysis_results[f"{mismatch_type}_{feature}"] = result
             print(result)
             print("\n")
@@ -151,7 +240,21 @@ def main():
     save_analysis_results(analysis_results, "output")
 
     # Визуализация
-    visualize_mismatches(mismatched_data, mismatch_types, features)
+    if not args.no_plots:
+        # Графическая библиотека загружается только при построении графиков
+        from utils.visualization import visualize_mismatches
+
+        visualize_mismatches(mismatched_data, mismatch_types, FEATURES, workers=args.plot_workers)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_from_args(args)
+    try:
+        run_analysis(args)
+    finally:
+        # Отчет пишется и при ошибке: упавший этап в нем тоже есть
+        write_reports_from_args(args, "inconsistency_detection")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,412 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.data_analysis import (
+    FILL_DUMP_COLUMNS,
+    GROUPED_OUTPUTS,
+    aggregate_comparison_data,
+    compare_fees,
+    comparison_columns,
+    finalize_grouped_data,
+    load_dump_log,
+    merge_partial_aggregates,
+    negate_partial_aggregates,
+    parse_dump_log,
+    read_order_log,
+    read_order_summary,
+    read_own_trade_log,
+    save_grouped_data,
+    trade_venues,
+)
+from utils.compressed_input import is_compressed
+from utils.file_shards import complete_lines_end, read_header
+from utils.order_enrichment import attach_order_info
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+STATE_VERSION = 5
+INCREMENTAL_STATE_DIR = "output/.incremental"
+# Несопоставленные сообщения dump_log хранятся неразобранными: биржа (и разборщик) известна только по сделке
+PENDING_DUMP_COLUMNS = ["trace_id", "message"]
+# Сегменты состояния: несопоставленные сообщения и (с aggregate_fills) разобранные исполнения
+# выведенных сделок, для суммирования с их исполнениями из следующих запусков
+SEGMENT_COLUMNS = {"pending": PENDING_DUMP_COLUMNS, "fills": FILL_DUMP_COLUMNS}
+SEGMENT_READ_OPTIONS = {
+    "pending": {"dtype": {"trace_id": "uint64", "message": str}, "keep_default_na": False},
+    "fills": {"dtype": {"trace_id": "uint64", **{column: str for column in FILL_DUMP_COLUMNS[1:]}}},
+}
+# Сегменты, записанные раньше водяного знака сделок больше чем на этот срок, удаляются:
+# сделка несопоставленного сообщения уже не придет (например, это сообщение другого клиента),
+# а исполнения сделки больше не будут дополнены
+PENDING_HORIZON = "1D"
+
+
+def state_paths(state_dir):
+    """Возвращает пути к файлам состояния инкрементального режима."""
+    state_dir = Path(state_dir)
+    return {
+        "state": state_dir / "state.json",
+        "pending": state_dir / "pending",
+        "fills": state_dir / "fills",
+        "groups": state_dir / "groups",
+    }
+
+
+def load_state(state_dir, grouped_outputs=GROUPED_OUTPUTS):
+    """
+    Загружает водяной знак предыдущего запуска, списки сегментов и частичные агрегаты
+    или возвращает None.
+    """
+    paths = state_paths(state_dir)
+    if not paths["state"].exists():
+        return None
+    with open(paths["state"]) as f:
+        state = json.load(f)
+    if state.get("version") != STATE_VERSION:
+        return None
+
+    groups_dir = paths["groups"] / str(state["generation"])
+    state["groups"] = {
+        output_file: pd.read_csv(groups_dir / f"{Path(output_file).stem}.csv", float_precision="round_trip")
+        for output_file in grouped_outputs
+    }
+    return state
+
+
+def save_state(state_dir, state, groups):
+    """
+    Сохраняет водяной знак, списки сегментов и частичные агрегаты. Агрегаты пишутся
+    в каталог нового поколения, а state.json заменяется атомарно и переключает на него:
+    запуск, упавший до замены, оставляет прежнее состояние целиком.
+    """
+    paths = state_paths(state_dir)
+    groups_dir = paths["groups"] / str(state["generation"])
+    shutil.rmtree(groups_dir, ignore_errors=True)
+    groups_dir.mkdir(parents=True)
+
+    for output_file, partial in groups.items():
+        partial.to_csv(groups_dir / f"{Path(output_file).stem}.csv", index=False)
+    temp_path = paths["state"].with_name(".state.json.tmp")
+    with open(temp_path, "w") as f:
+        json.dump({"version": STATE_VERSION, **state}, f, indent=2)
+    os.replace(temp_path, paths["state"])
+    for directory in paths["groups"].iterdir():
+        if directory != groups_dir:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+def _temp_output(output_file):
+    return Path(output_file).with_name(f".{Path(output_file).name}.tmp")
+
+
+def recover_output(output_file, state):
+    """
+    Приводит output_file к размеру, записанному в состоянии. Если запуск упал после сохранения
+    состояния, но до замены output_file переписанным файлом, замена доводится до конца; строки,
+    дописанные запуском, упавшим до сохранения состояния, обрезаются. Возвращает False, если
+    output_file нет или он короче записанного (тогда расчет начинается с начала).
+    """
+    output_file, temp_path = Path(output_file), _temp_output(output_file)
+    size = state["output_size"]
+    if temp_path.exists():
+        if temp_path.stat().st_size == size:
+            os.replace(temp_path, output_file)
+        else:
+            temp_path.unlink()
+    if not output_file.exists() or output_file.stat().st_size < size:
+        return False
+    if output_file.stat().st_size > size:
+        logging.warning(f"{output_file} has rows of an unfinished run, truncating it to the saved state.")
+        with open(output_file, "r+b") as f:
+            f.truncate(size)
+    return True
+
+
+def rewrite_output(output_file, superseded, chunksize=100_000):
+    """
+    Переписывает output_file во временный файл без строк сделок superseded, читая его частями.
+    Значения копируются текстом, без преобразования типов. Возвращает путь временного файла.
+    """
+    temp_path = _temp_output(output_file)
+    superseded = pd.Index(superseded.astype(str)).unique()
+    temp_path.write_bytes(read_header(output_file))
+    for chunk in pd.read_csv(output_file, dtype=str, keep_default_na=False, chunksize=chunksize):
+        chunk[~chunk["trace_id"].isin(superseded)].to_csv(temp_path, mode="a", header=False, index=False)
+    return temp_path
+
+
+def read_segments(state_dir, kind, segments, trace_ids, chunksize=100_000):
+    """Читает из сегментов вида kind ("pending", "fills") только строки сделок trace_ids."""
+    directory = state_paths(state_dir)[kind]
+    trace_index = pd.Index(trace_ids).unique()
+    if trace_index.empty:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS[kind])
+    parts = []
+    for segment in segments:
+        for chunk in pd.read_csv(directory / segment["file"], chunksize=chunksize, **SEGMENT_READ_OPTIONS[kind]):
+            parts.append(chunk[trace_index.get_indexer(chunk["trace_id"]) != -1])
+    if not parts:
+        return pd.DataFrame(columns=SEGMENT_COLUMNS[kind])
+    return pd.concat(parts, ignore_index=True)
+
+
+def append_segment(state_dir, kind, rows, name, last_platform_time):
+    """
+    Записывает строки одного запуска отдельным сегментом вида kind и возвращает его описание.
+    Прежние сегменты не переписываются: строки уже обработанных сделок отсеиваются
+    при чтении (read_segments), а сам сегмент удаляется по сроку (evict_segments).
+    """
+    directory = state_paths(state_dir)[kind]
+    directory.mkdir(parents=True, exist_ok=True)
+    file_name = f"{name}.csv"
+    rows[SEGMENT_COLUMNS[kind]].to_csv(directory / file_name, index=False)
+    return {"file": file_name, "rows": len(rows), "last_platform_time": last_platform_time}
+
+
+def evict_segments(kind, segments, last_platform_time, horizon=PENDING_HORIZON):
+    """
+    Отбирает сегменты, записанные раньше водяного знака last_platform_time больше чем на horizon.
+    Возвращает оставшиеся и вытесненные сегменты; файлы вытесненных удаляет remove_segments
+    после сохранения состояния. Сегментам, записанным до первой сделки, срок отсчитывается
+    от текущего водяного знака.
+    """
+    if last_platform_time is None:
+        return segments, []
+    cutoff = pd.Timestamp(last_platform_time) - pd.Timedelta(horizon)
+    kept, evicted = [], []
+    for segment in segments:
+        written = segment["last_platform_time"]
+        if written is not None and pd.Timestamp(written) < cutoff:
+            evicted.append(segment)
+        else:
+            kept.append({**segment, "last_platform_time": written or last_platform_time})
+    evicted_rows = sum(segment["rows"] for segment in evicted)
+    if evicted_rows and kind == "pending":
+        logging.warning(f"{evicted_rows} dump_log messages without a trade for {horizon} were evicted.")
+    return kept, evicted
+
+
+def remove_segments(state_dir, kind, segments):
+    """Удаляет файлы сегментов вида kind."""
+    directory = state_paths(state_dir)[kind]
+    for segment in segments:
+        (directory / segment["file"]).unlink(missing_ok=True)
+
+
+def compare_split_fills(own_trade_log, new_trades, new_dump, pending_dump, order_log, options, earlier_fills):
+    """
+    Сравнение с aggregate_fills, когда исполнения одной сделки приходят в разных запусках.
+    Сообщения новых сделок и новые сообщения ранее выведенных сделок разбираются по биржам
+    сделок, а earlier_fills(trace_ids) возвращает исполнения тех же сделок из прежних запусков.
+    Сделка выводится с суммой всех исполнений; для ранее выведенной сделки возвращается и
+    ее прежняя строка, чтобы вычесть ее из частичных агрегатов.
+    Возвращает строки сравнения, прежние строки и разобранные исполнения этого запуска.
+    """
+    affected = own_trade_log["trace_id"].isin(new_trades["trace_id"]) | own_trade_log["trace_id"].isin(
+        new_dump["trace_id"]
+    )
+    trades = own_trade_log[affected]
+    messages = pd.concat([new_dump, pending_dump], ignore_index=True)
+    messages = messages[messages["trace_id"].isin(trades["trace_id"])]
+    fills = parse_dump_log(messages, all_fills=True, venues=trade_venues(trades))
+
+    earlier = earlier_fills(trades["trace_id"])
+    previous_rows = compare_fees(trades, earlier, order_log, *options)
+    rows = compare_fees(trades, pd.concat([earlier, fills], ignore_index=True), order_log, *options)
+    return rows, previous_rows, fills
+
+
+def select_new_trades(own_trade_log, state):
+    """
+    Отбирает сделки после водяного знака по platform_time.
+    Сделки с тем же временем, что и водяной знак, отсеиваются по уже обработанным trace_id.
+    """
+    platform_time = pd.to_datetime(own_trade_log["platform_time"])
+    if state is None or state["last_platform_time"] is None:
+        return own_trade_log, platform_time
+
+    last_time = pd.Timestamp(state["last_platform_time"])
+    is_new = (platform_time > last_time) | (
+        (platform_time == last_time) & ~own_trade_log["trace_id"].isin(state["trace_ids_at_last_time"])
+    )
+    return own_trade_log[is_new], platform_time
+
+
+def trade_watermark(own_trade_log, platform_time):
+    """Вычисляет новый водяной знак по сделкам: последнее время и trace_id с этим временем."""
+    if own_trade_log.empty:
+        return {"last_platform_time": None, "trace_ids_at_last_time": []}
+    last_time = platform_time.max()
+    at_last_time = own_trade_log.loc[platform_time == last_time, "trace_id"]
+    return {"last_platform_time": str(last_time), "trace_ids_at_last_time": at_last_time.tolist()}
+
+
+def run_incremental(
+    own_trade_path,
+    dump_log_path,
+    order_log_path,
+    output_file="output/_fee_comparison.csv",
+    state_dir=INCREMENTAL_STATE_DIR,
+    chunksize=100_000,
+    grouped_outputs=GROUPED_OUTPUTS,
+    include_amounts=False,
+    fee_schedule=None,
+    enrich_orders=False,
+    aggregate_fills=False,
+    with_context=False,
+    price_table=None,
+    pending_horizon=PENDING_HORIZON,
+):
+    """
+    Инкрементально обновляет сравнение комиссий.
+    Новые строки dump_log (после сохраненного смещения) сопоставляются со всеми сделками,
+    а новые сделки — с ранее несопоставленными сообщениями dump_log. Сообщения разбираются
+    только при сопоставлении, разборщиком биржи своей сделки. Результат дописывается
+    в output_file, сгруппированные таблицы обновляются из частичных агрегатов.
+    Размер output_file сохраняется в состоянии: строки запуска, упавшего до сохранения
+    состояния, обрезаются при следующем запуске (recover_output).
+    include_amounts, fee_schedule, enrich_orders, aggregate_fills, with_context и price_table
+    передаются в compare_fees и должны совпадать между запусками. С enrich_orders сделки
+    обогащаются данными ордеров целиком до отбора новых, чтобы число исполнений ордера
+    учитывало и ранее обработанные сделки.
+    Несопоставленные сообщения каждого запуска дописываются новым сегментом состояния
+    и удаляются, когда водяной знак сделок уходит вперед больше чем на pending_horizon.
+    С aggregate_fills в состоянии хранятся и разобранные исполнения выведенных сделок (тот же
+    срок): сделка, исполнения которой пришли в разных запусках, выводится повторно с полными
+    суммами (compare_split_fills). Ее прежняя строка вычитается из частичных агрегатов
+    и удаляется из output_file: файл переписывается во временный и заменяет прежний
+    после сохранения состояния.
+    """
+    if is_compressed(dump_log_path):
+        # Водяной знак — смещение в байтах dump_log, а сжатый файл не дописывается построчно
+        logging.error(f"Incremental mode needs an uncompressed dump_log, got {dump_log_path}")
+        raise ValueError(f"Incremental mode cannot read compressed {dump_log_path}")
+    own_trade_log = read_own_trade_log(own_trade_path)
+    if enrich_orders:
+        order_log = read_order_summary(order_log_path, own_trade_log, chunksize)
+        own_trade_log = attach_order_info(own_trade_log, order_log)
+    else:
+        order_log = read_order_log(order_log_path)
+    state = load_state(state_dir, grouped_outputs)
+
+    dump_offset = len(read_header(dump_log_path))
+    if state is not None:
+        if os.path.getsize(dump_log_path) < state["dump_log_offset"] or not recover_output(output_file, state):
+            logging.warning("dump_log was truncated or output is missing, rebuilding from scratch.")
+            state = None
+        else:
+            dump_offset = state["dump_log_offset"]
+
+    generation = state["generation"] + 1 if state else 0
+    if state is None:
+        # Прежнее состояние (и его сегменты) не относится к пересчету с начала
+        state_paths(state_dir)["state"].unlink(missing_ok=True)
+        for kind in SEGMENT_COLUMNS:
+            shutil.rmtree(state_paths(state_dir)[kind], ignore_errors=True)
+    segments = {kind: state[f"{kind}_segments"] if state else [] for kind in SEGMENT_COLUMNS}
+    new_trades, platform_time = select_new_trades(own_trade_log, state)
+    pending_dump = read_segments(state_dir, "pending", segments["pending"], new_trades["trace_id"], chunksize)
+
+    watermark = trade_watermark(own_trade_log, platform_time)
+    if state is not None and watermark["last_platform_time"] is None:
+        watermark = {key: state[key] for key in watermark}
+
+    # Читаем только завершенные строки dump_log после сохраненного смещения; сообщения
+    # разбираются при сопоставлении, разборщиками бирж своих сделок
+    dump_end = max(complete_lines_end(dump_log_path), dump_offset)
+    if dump_end > dump_offset:
+        new_dump = load_dump_log(dump_log_path, chunksize=chunksize, byte_range=(dump_offset, dump_end))
+    else:
+        new_dump = pd.DataFrame(columns=PENDING_DUMP_COLUMNS)
+
+    options = (include_amounts, fee_schedule, enrich_orders, aggregate_fills, with_context, price_table)
+    parts, previous_rows = [], None
+    if aggregate_fills:
+        rows, previous_rows, fills = compare_split_fills(
+            own_trade_log,
+            new_trades,
+            new_dump,
+            pending_dump,
+            order_log,
+            options,
+            lambda trace_ids: read_segments(state_dir, "fills", segments["fills"], trace_ids, chunksize),
+        )
+        parts.append(rows)
+        if not fills.empty:
+            segments["fills"] = segments["fills"] + [
+                append_segment(state_dir, "fills", fills, generation, watermark["last_platform_time"])
+            ]
+    else:
+        if not new_dump.empty:
+            parts.append(compare_fees(own_trade_log, new_dump, order_log, *options))
+        if not pending_dump.empty:
+            parts.append(compare_fees(new_trades, pending_dump, order_log, *options))
+    parts = [part for part in parts if not part.empty]
+    new_rows = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(
+        columns=comparison_columns(
+            include_amounts, fee_schedule is not None, enrich_orders, with_context, price_table is not None
+        )
+    )
+
+    # Первый запуск и замена прежних строк пишут временный файл, он заменяет output_file
+    # после сохранения состояния; иначе строки дописываются, а размер файла сохраняется в состоянии
+    superseded = previous_rows is not None and not previous_rows.empty
+    temp_path = None
+    if state is None:
+        temp_path = _temp_output(output_file)
+        new_rows.to_csv(temp_path, index=False)
+    elif superseded:
+        temp_path = rewrite_output(output_file, previous_rows["trace_id"], chunksize)
+        new_rows.to_csv(temp_path, mode="a", header=False, index=False)
+    else:
+        new_rows.to_csv(output_file, mode="a", header=False, index=False)
+    output_size = os.path.getsize(temp_path or output_file)
+    logging.info(f"{len(new_rows)} new comparison rows written to {output_file}")
+    if superseded:
+        logging.info(f"{len(previous_rows)} trades completed by fills of this run replaced their earlier rows.")
+
+    groups = {}
+    for grouped_file, group_by_columns in grouped_outputs.items():
+        partials = [aggregate_comparison_data(new_rows, group_by_columns)]
+        if state is not None:
+            partials.insert(0, state["groups"][grouped_file])
+        if superseded:
+            # Прежние строки дополненных сделок вычитаются: сделка учитывается один раз, с полными суммами
+            previous = aggregate_comparison_data(previous_rows, group_by_columns)
+            partials.append(negate_partial_aggregates(previous, group_by_columns))
+        groups[grouped_file] = merge_partial_aggregates(partials, group_by_columns)
+        save_grouped_data(finalize_grouped_data(groups[grouped_file], group_by_columns), grouped_file)
+
+    # Сообщения dump_log без сделки ждут следующих запусков в новом сегменте
+    unmatched_dump = new_dump[~new_dump["trace_id"].isin(own_trade_log["trace_id"])]
+    if not unmatched_dump.empty:
+        segments["pending"] = segments["pending"] + [
+            append_segment(state_dir, "pending", unmatched_dump, generation, watermark["last_platform_time"])
+        ]
+    evicted = {}
+    for kind in SEGMENT_COLUMNS:
+        segments[kind], evicted[kind] = evict_segments(
+            kind, segments[kind], watermark["last_platform_time"], pending_horizon
+        )
+    save_state(
+        state_dir,
+        {
+            "generation": generation,
+            "dump_log_offset": dump_end,
+            "output_size": output_size,
+            **watermark,
+            **{f"{kind}_segments": kind_segments for kind, kind_segments in segments.items()},
+        },
+        groups,
+    )
+    if temp_path is not None:
+        os.replace(temp_path, output_file)
+    for kind, kind_segments in evicted.items():
+        remove_segments(state_dir, kind, kind_segments)
+    return new_rows
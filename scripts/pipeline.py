@@ -0,0 +1,465 @@
+import argparse
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from scripts.data_analysis import (
+    COST_CURRENCY,
+    COST_IMPACT_OUTPUT,
+    DUMP_CACHE_DIR,
+    DUMP_LOG_CHUNKSIZE,
+    GROUPED_OUTPUTS,
+    aggregate_comparison_data,
+    aggregate_cost_impact,
+    compare_fees,
+    finalize_grouped_data,
+    load_data,
+    save_grouped_data,
+)
+from scripts.inconsistency_detection import (
+    FEATURES,
+    MISMATCH_TYPES,
+    build_summary_cube,
+    detect_mismatches,
+    schedule_mismatch_types,
+    summarize_grouped_mismatches,
+    summarize_mismatches,
+)
+from utils.analyze_mismatch_influence import save_analysis_results, slice_mismatch_cube
+from utils.dump_cache import source_fingerprint
+from utils.fee_cost import load_price_table
+from utils.fee_schedule import load_fee_schedule
+from utils.instrumentation import add_instrumentation_arguments, configure_from_args, write_reports_from_args
+from utils.trace_index import TRACE_INDEX_DIR, attach_dump_log_offsets
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+PIPELINE_STATE_DIR = "output/.pipeline"
+# Меняется при изменении логики этапов, чтобы сохраненные результаты перестали считаться актуальными
+PIPELINE_VERSION = 1
+TABLE_FORMATS = ("csv", "parquet")
+
+# Граф этапов: зависимости, параметры, влияющие на результат, и параметры-файлы,
+# для которых в отпечаток входят размер и mtime файла
+STAGES = {
+    "load": {
+        "deps": [],
+        "params": ["own_trade_log", "dump_log", "order_log", "enrich_orders", "aggregate_fills"],
+        "files": ["own_trade_log", "dump_log", "order_log"],
+    },
+    "compare": {
+        "deps": ["load"],
+        "params": ["include_amounts", "fee_schedule", "enrich_orders", "aggregate_fills", "with_context", "price_table"],
+        "files": ["fee_schedule", "price_table"],
+    },
+    "group": {"deps": ["compare"], "params": [], "files": []},
+    "cost_impact": {"deps": ["compare"], "params": [], "files": []},
+    "detect": {"deps": ["compare"], "params": ["atol", "rtol", "exact"], "files": []},
+    "analyze": {"deps": ["detect"], "params": [], "files": []},
+    "drift": {"deps": ["compare"], "params": ["drift_window", "drift_bucket"], "files": []},
+    "completeness": {
+        "deps": [],
+        "params": ["own_trade_log", "dump_log", "duplicate_method"],
+        "files": ["own_trade_log", "dump_log"],
+    },
+}
+
+# Выходные файлы: этап, результат которого записывается
+OUTPUTS = {
+    "comparison": "compare",
+    "grouped": "group",
+    "cost_impact": "cost_impact",
+    "mismatches": "detect",
+    "summary": "analyze",
+    "influence": "analyze",
+    "charts": "detect",
+    "drift": "drift",
+    "completeness": "completeness",
+}
+# Большие промежуточные таблицы (comparison, mismatches) по умолчанию не пишутся
+DEFAULT_OUTPUTS = ["grouped", "cost_impact", "summary", "influence", "charts"]
+
+
+def _run_load(inputs, options):
+    return load_data(
+        options["own_trade_log"],
+        options["dump_log"],
+        options["order_log"],
+        chunksize=options["chunksize"],
+        cache_dir=options["cache_dir"],
+        workers=options["workers"],
+        order_summary=options["enrich_orders"],
+        all_fills=options["aggregate_fills"],
+        index_dir=options["index_dir"] if options["dump_log_pointers"] else None,
+    )
+
+
+def _run_compare(inputs, options):
+    return compare_fees(
+        *inputs["load"],
+        include_amounts=options["include_amounts"],
+        fee_schedule=load_fee_schedule(options["fee_schedule"]) if options["fee_schedule"] else None,
+        enrich_orders=options["enrich_orders"],
+        aggregate_fills=options["aggregate_fills"],
+        with_context=options["with_context"],
+        price_table=load_price_table(options["price_table"]) if options["price_table"] else None,
+    )
+
+
+def _run_group(inputs, options):
+    return {
+        output_file: finalize_grouped_data(aggregate_comparison_data(inputs["compare"], columns), columns)
+        for output_file, columns in GROUPED_OUTPUTS.items()
+    }
+
+
+def _run_cost_impact(inputs, options):
+    # Без таблицы цен в сравнении нет стоимостей, и отчета о стоимости нет
+    return aggregate_cost_impact(inputs["compare"]) if options["price_table"] else None
+
+
+def _run_detect(inputs, options):
+    return detect_mismatches(inputs["compare"], atol=options["atol"], rtol=options["rtol"], exact=options["exact"])
+
+
+def _run_analyze(inputs, options):
+    mismatched_data = inputs["detect"]
+    cube = build_summary_cube(mismatched_data)
+    influence = {
+        f"{mismatch_type}_{feature}": slice_mismatch_cube(cube, mismatch_type, feature)
+        for mismatch_type in MISMATCH_TYPES + schedule_mismatch_types(mismatched_data)
+        for feature in FEATURES
+    }
+    return {"cube": cube, "influence": influence}
+
+
+def _run_drift(inputs, options):
+    from scripts.fee_drift import compute_fee_drift
+
+    return compute_fee_drift(inputs["compare"], window=options["drift_window"], bucket=options["drift_bucket"])
+
+
+def _run_completeness(inputs, options):
+    from scripts.completeness_check import TRADE_ID_COLUMNS, check_completeness
+    from scripts.data_analysis import OWN_TRADE_COLUMNS, read_own_trade_log
+
+    own_trade_log = read_own_trade_log(options["own_trade_log"], OWN_TRADE_COLUMNS + TRADE_ID_COLUMNS)
+    return check_completeness(
+        own_trade_log, options["dump_log"], chunksize=options["chunksize"], method=options["duplicate_method"]
+    )
+
+
+STAGE_RUNNERS = {
+    "load": _run_load,
+    "compare": _run_compare,
+    "group": _run_group,
+    "cost_impact": _run_cost_impact,
+    "detect": _run_detect,
+    "analyze": _run_analyze,
+    "drift": _run_drift,
+    "completeness": _run_completeness,
+}
+
+
+def write_table(data, output_stem, table_format="csv"):
+    """Пишет таблицу в CSV или Parquet (Parquet сохраняет типы и точные значения ставок)."""
+    output_stem = Path(output_stem)
+    output_stem.parent.mkdir(parents=True, exist_ok=True)
+    if table_format == "parquet":
+        path = output_stem.with_suffix(".parquet")
+        data.to_parquet(path, index=False)
+    else:
+        path = output_stem.with_suffix(".csv")
+        data.to_csv(path, index=False)
+    logging.info(f"{len(data)} rows saved to {path}")
+    return path
+
+
+def write_output(name, results, options):
+    """Записывает выходной файл name из результатов этапов (results — функция этап -> результат)."""
+    output_dir = Path(options["output_dir"])
+    if name == "comparison":
+        write_table(results("compare"), output_dir / "_fee_comparison", options["table_format"])
+    elif name == "grouped":
+        for output_file, grouped in results("group").items():
+            save_grouped_data(grouped, output_dir / Path(output_file).name)
+    elif name == "cost_impact":
+        impact = results("cost_impact")
+        if impact is None:
+            logging.warning("No price table, cost impact report skipped.")
+            return
+        impact.to_csv(output_dir / Path(COST_IMPACT_OUTPUT).name, index=False)
+        logging.info(f"Fee cost impact saved to {output_dir / Path(COST_IMPACT_OUTPUT).name}")
+    elif name == "mismatches":
+        mismatched_data = results("detect")
+        if options["dump_log_pointers"]:
+            mismatched_data = attach_dump_log_offsets(mismatched_data, options["dump_log"], options["index_dir"])
+        write_table(mismatched_data, output_dir / "_mismatched_data", options["table_format"])
+    elif name == "summary":
+        mismatched_data, cube = results("detect"), results("analyze")["cube"]
+        summarize_mismatches(mismatched_data, output_dir / "_mismatched_summary.csv", cube=cube)
+        summarize_grouped_mismatches(mismatched_data, output_dir / "_grouped_summary.csv", cube=cube)
+    elif name == "influence":
+        save_analysis_results(results("analyze")["influence"], output_dir)
+    elif name == "charts":
+        # Графическая библиотека загружается только при построении графиков
+        from utils.visualization import visualize_mismatches
+
+        mismatched_data = results("detect")
+        mismatch_types = MISMATCH_TYPES + schedule_mismatch_types(mismatched_data)
+        visualize_mismatches(mismatched_data, mismatch_types, FEATURES, output_dir, workers=options["plot_workers"])
+    elif name == "drift":
+        from scripts.fee_drift import save_fee_drift
+
+        save_fee_drift(results("drift"), output_dir / "_fee_drift")
+    elif name == "completeness":
+        from scripts.completeness_check import COMPLETENESS_OUTPUT, ORPHAN_TRADES_OUTPUT, save_completeness
+
+        summary, orphan_trades = results("completeness")
+        save_completeness(
+            summary,
+            orphan_trades,
+            output_dir / Path(COMPLETENESS_OUTPUT).name,
+            output_dir / Path(ORPHAN_TRADES_OUTPUT).name,
+        )
+
+
+def stage_closure(stages):
+    """Этапы stages и все их зависимости в порядке графа."""
+    needed = set()
+
+    def visit(name):
+        if name not in needed:
+            needed.add(name)
+            for dependency in STAGES[name]["deps"]:
+                visit(dependency)
+
+    for name in stages:
+        visit(name)
+    return [name for name in STAGES if name in needed]
+
+
+class Pipeline:
+    """
+    Выполняет граф этапов, передавая результаты между ними в памяти.
+    Отпечаток этапа — хеш его параметров, отпечатков входных файлов и отпечатков
+    зависимостей. Результат этапа сохраняется в state_dir (pickle сохраняет типы),
+    и этап с прежним отпечатком не выполняется: его результат читается с диска,
+    только если он нужен зависимому этапу или выходному файлу.
+    """
+
+    def __init__(self, options, state_dir=PIPELINE_STATE_DIR, force=False, use_state=True):
+        self.options = options
+        self.state_dir = Path(state_dir)
+        self.force = force
+        self.use_state = use_state
+        self.results = {}
+        self.ran = []
+        self.fingerprints = {}
+        self.state = self._load_state() if use_state else {"stages": {}, "outputs": {}}
+
+    def _load_state(self):
+        path = self.state_dir / "state.json"
+        if not path.exists():
+            return {"stages": {}, "outputs": {}}
+        state = json.loads(path.read_text())
+        if state.get("version") != PIPELINE_VERSION:
+            return {"stages": {}, "outputs": {}}
+        return state
+
+    def _save_state(self):
+        if not self.use_state:
+            return
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        path = self.state_dir / "state.json"
+        temp_path = path.with_name(".state.json.tmp")
+        temp_path.write_text(json.dumps({"version": PIPELINE_VERSION, **self.state}, indent=2))
+        os.replace(temp_path, path)
+
+    def _artifact_path(self, name):
+        return self.state_dir / f"{name}.pkl"
+
+    def fingerprint(self, name):
+        if name not in self.fingerprints:
+            spec = STAGES[name]
+            params = {key: self.options[key] for key in spec["params"]}
+            files = {
+                key: source_fingerprint(self.options[key], with_hash=False)
+                for key in spec["files"]
+                if self.options[key]
+            }
+            payload = {
+                "version": PIPELINE_VERSION,
+                "stage": name,
+                "params": params,
+                "files": files,
+                "deps": [self.fingerprint(dependency) for dependency in spec["deps"]],
+            }
+            digest = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+            self.fingerprints[name] = digest
+        return self.fingerprints[name]
+
+    def is_current(self, name):
+        """Этап не нужно выполнять: отпечаток не изменился, и его результат сохранен."""
+        return (
+            not self.force
+            and self.use_state
+            and self.state["stages"].get(name) == self.fingerprint(name)
+            and self._artifact_path(name).exists()
+        )
+
+    def result(self, name):
+        """Результат этапа: из памяти, из сохраненного состояния или после выполнения этапа."""
+        if name in self.results:
+            return self.results[name]
+        if self.is_current(name):
+            logging.info(f"Stage {name} is unchanged, reusing its stored result")
+            self.results[name] = pd.read_pickle(self._artifact_path(name))
+            return self.results[name]
+
+        inputs = {dependency: self.result(dependency) for dependency in STAGES[name]["deps"]}
+        logging.info(f"Running stage {name}")
+        self.results[name] = STAGE_RUNNERS[name](inputs, self.options)
+        self.ran.append(name)
+        if self.use_state:
+            self.state_dir.mkdir(parents=True, exist_ok=True)
+            pd.to_pickle(self.results[name], self._artifact_path(name))
+            self.state["stages"][name] = self.fingerprint(name)
+            self._save_state()
+        return self.results[name]
+
+    def run(self, stages=None, outputs=DEFAULT_OUTPUTS):
+        """
+        Выполняет этапы stages (по умолчанию — нужные для outputs) с зависимостями
+        и записывает outputs, чьи этапы входят в выполняемый граф. Выходной файл
+        пишется заново, только если изменился отпечаток его этапа.
+        Возвращает списки выполненных и пропущенных этапов.
+        """
+        targets = stage_closure(stages or [OUTPUTS[name] for name in outputs])
+        for name in targets:
+            if not self.is_current(name):
+                self.result(name)
+
+        for name in outputs:
+            stage = OUTPUTS[name]
+            if stage not in targets:
+                continue
+            # Файл актуален, если записан из того же результата этапа в тот же каталог и формат
+            written = f"{self.fingerprint(stage)}:{self.options['output_dir']}:{self.options['table_format']}"
+            if name == "mismatches" and self.options["dump_log_pointers"]:
+                written += ":pointers"
+            if self.state["outputs"].get(name) == written and not self.force:
+                continue
+            write_output(name, self.result, self.options)
+            self.state["outputs"][name] = written
+            self._save_state()
+
+        skipped = [name for name in targets if name not in self.ran]
+        logging.info(f"Pipeline finished: ran {self.ran or 'nothing'}, skipped unchanged {skipped or 'nothing'}")
+        return {"ran": list(self.ran), "skipped": skipped}
+
+
+def pipeline_options(args):
+    """Параметры этапов из аргументов командной строки."""
+    outputs = args.write or DEFAULT_OUTPUTS
+    return {
+        "own_trade_log": args.own_trade_log,
+        "dump_log": args.dump_log,
+        "order_log": args.order_log,
+        "chunksize": args.chunksize,
+        "cache_dir": None if args.no_cache else args.cache_dir,
+        "workers": args.workers,
+        # Точное сравнение нуждается в исходных суммах комиссий
+        "include_amounts": args.include_amounts or args.exact,
+        "fee_schedule": args.fee_schedule,
+        "enrich_orders": args.enrich_orders,
+        "aggregate_fills": args.aggregate_fills,
+        # Дрейф и отчет о стоимости строятся по времени и инструменту сделки
+        "with_context": args.trade_context
+        or args.price_table is not None
+        or "drift" in outputs
+        or "drift" in (args.stages or []),
+        "price_table": args.price_table,
+        "atol": args.atol,
+        "rtol": args.rtol,
+        "exact": args.exact,
+        "drift_window": args.drift_window,
+        "drift_bucket": args.drift_bucket,
+        "duplicate_method": args.duplicate_method,
+        "dump_log_pointers": args.dump_log_pointers,
+        "index_dir": args.index_dir,
+        "output_dir": args.output_dir,
+        "table_format": args.format,
+        "plot_workers": args.plot_workers,
+    }
+
+
+def parse_args(argv=None):
+    from scripts.completeness_check import DUPLICATE_METHODS
+    from scripts.fee_drift import DRIFT_BUCKET, DRIFT_WINDOW
+
+    parser = argparse.ArgumentParser(description="Run fee comparison and mismatch analysis as one pipeline.")
+    parser.add_argument("--own-trade-log", default="data/own_trade_log.csv", help="Platform trades")
+    parser.add_argument("--dump-log", default="data/dump_log.csv", help="Exchange messages")
+    parser.add_argument("--order-log", default="data/order_log.csv", help="Platform orders")
+    parser.add_argument("--output-dir", default="output", help="Directory for requested outputs")
+    parser.add_argument(
+        "--stages", nargs="+", choices=list(STAGES), help="Stages to run with their dependencies (default: all needed)"
+    )
+    parser.add_argument(
+        "--write",
+        nargs="+",
+        choices=list(OUTPUTS),
+        help=f"Outputs to write (default: {' '.join(DEFAULT_OUTPUTS)})",
+    )
+    parser.add_argument("--format", choices=TABLE_FORMATS, default="csv", help="Format of comparison/mismatch tables")
+    parser.add_argument("--state-dir", default=PIPELINE_STATE_DIR, help="Directory with stored stage results")
+    parser.add_argument("--force", action="store_true", help="Run all selected stages even if unchanged")
+    parser.add_argument("--no-state", action="store_true", help="Do not store stage results or skip stages")
+    parser.add_argument("--chunksize", type=int, default=DUMP_LOG_CHUNKSIZE, help="dump_log rows read at once")
+    parser.add_argument("--cache-dir", default=DUMP_CACHE_DIR, help="Parquet cache of parsed dump_log entries")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the dump_log cache")
+    parser.add_argument("--workers", type=int, default=1, help="Processes parsing dump_log shards")
+    parser.add_argument("--include-amounts", action="store_true", help="Keep raw fee amounts in the comparison")
+    parser.add_argument("--fee-schedule", default=None, help="CSV fee schedule for expected fee rates")
+    parser.add_argument("--aggregate-fills", action="store_true", help="Sum exchange fees of all fills per trace_id")
+    parser.add_argument(
+        "--price-table", default=None, help=f"CSV of asset prices in {COST_CURRENCY}; enables the cost impact report"
+    )
+    parser.add_argument("--trade-context", action="store_true", help="Keep trade time, instrument, account and volume")
+    parser.add_argument("--enrich-orders", action="store_true", help="Join order information to trades")
+    parser.add_argument("--atol", type=float, default=0.0, help="Absolute tolerance for fee rate comparison")
+    parser.add_argument("--rtol", type=float, default=0.0, help="Relative tolerance for fee rate comparison")
+    parser.add_argument("--exact", action="store_true", help="Compare fee amounts exactly in fixed point")
+    parser.add_argument("--drift-window", default=DRIFT_WINDOW, help="Rolling window of the drift stage")
+    parser.add_argument("--drift-bucket", default=DRIFT_BUCKET, help="Output bucket of the drift stage")
+    parser.add_argument(
+        "--duplicate-method", choices=DUPLICATE_METHODS, default="exact", help="Duplicate fill detection of completeness"
+    )
+    parser.add_argument(
+        "--dump-log-pointers", action="store_true", help="Add dump_log byte offsets to the mismatches output"
+    )
+    parser.add_argument("--index-dir", default=TRACE_INDEX_DIR, help="Directory of the trace_id index")
+    parser.add_argument("--plot-workers", type=int, default=None, help="Processes for chart rendering")
+    add_instrumentation_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    configure_from_args(args)
+    pipeline = Pipeline(pipeline_options(args), args.state_dir, force=args.force, use_state=not args.no_state)
+    try:
+        return pipeline.run(args.stages, args.write or DEFAULT_OUTPUTS)
+    finally:
+        # Отчет пишется и при ошибке: упавший этап в нем тоже есть
+        write_reports_from_args(args, "pipeline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import sys
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from scripts.data_analysis import DUMP_LOG_FILTERS, compare_fees
+from scripts.inconsistency_detection import detect_mismatches
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+MISMATCH_TYPES = ["fee_mismatch", "asset_mismatch", "sign_mismatch"]
+YIELD_EVERY_LINES = 1000
+
+
+class FeeStreamMatcher:
+    """
+    Сопоставляет сделки и сообщения биржи по trace_id в скользящем временном окне.
+    Записи старше окна вытесняются, поэтому объем памяти ограничен потоком за окно.
+    """
+
+    def __init__(self, window_seconds=60.0, max_entries=1_000_000):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        # trace_id -> (время поступления, запись); порядок вставки совпадает с порядком поступления
+        self.trades = OrderedDict()
+        # trace_id -> (время поступления первого сообщения, [(время, сообщение), ...])
+        self.messages = OrderedDict()
+        self.evicted_trades = 0
+        self.evicted_messages = 0
+
+    def add_trade(self, trace_id, trade, now):
+        """
+        Добавляет сделку и возвращает пары с уже пришедшими сообщениями:
+        (сделка, сообщение, время поступления первой записи пары, время сопоставления).
+        """
+        self.trades[trace_id] = (now, trade)
+        self.trades.move_to_end(trace_id)
+        _, pending = self.messages.pop(trace_id, (None, []))
+        return [(trade, message, arrived_at, now) for arrived_at, message in pending]
+
+    def add_message(self, trace_id, message, now):
+        """Добавляет сообщение биржи и возвращает пару (как add_trade), если сделка уже пришла."""
+        if trace_id in self.trades:
+            arrived_at, trade = self.trades[trace_id]
+            return [(trade, message, arrived_at, now)]
+        self.messages.setdefault(trace_id, (now, []))[1].append((now, message))
+        return []
+
+    def evict(self, now):
+        """Удаляет записи старше окна и сверх лимита размера."""
+        deadline = now - self.window_seconds
+        for buffer, counter in ((self.trades, "evicted_trades"), (self.messages, "evicted_messages")):
+            while buffer and (next(iter(buffer.values()))[0] < deadline or len(buffer) > self.max_entries):
+                buffer.popitem(last=False)
+                setattr(self, counter, getattr(self, counter) + 1)
+
+    def __len__(self):
+        return len(self.trades) + len(self.messages)
+
+
+class LatencyTracker:
+    """Хранит последние задержки сопоставления в ограниченном буфере и считает перцентили."""
+
+    def __init__(self, size=10_000):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def percentiles(self, quantiles=(50, 95, 99), prefix=""):
+        if not self.samples:
+            return {}
+        values = np.percentile(np.fromiter(self.samples, dtype=float), quantiles) * 1000
+        return {f"{prefix}p{q}_ms": round(float(v), 3) for q, v in zip(quantiles, values)}
+
+
+async def tail_lines(path, follow=True, poll_interval=0.2):
+    """Читает файл построчно; при follow=True ждет дописываемые строки, как tail -f."""
+    with open(path, "r", newline="") as f:
+        buffer = ""
+        lines_read = 0
+        while True:
+            line = f.readline()
+            if line:
+                buffer += line
+                if buffer.endswith("\n"):
+                    yield buffer.rstrip("\r\n")
+                    buffer = ""
+                lines_read += 1
+                if lines_read % YIELD_EVERY_LINES == 0:
+                    # Чтение файла не блокируется, поэтому периодически отдаем управление циклу событий
+                    await asyncio.sleep(0)
+                continue
+            if not follow:
+                if buffer:
+                    yield buffer
+                return
+            await asyncio.sleep(poll_interval)
+
+
+async def socket_lines(host, port):
+    """Читает строки из локального TCP-сокета до закрытия соединения."""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while line := await reader.readline():
+            yield line.decode().rstrip("\r\n")
+    finally:
+        writer.close()
+
+
+def open_source(source, follow):
+    """Возвращает асинхронный источник строк: tcp://host:port или путь к файлу."""
+    source = str(source)
+    if source.startswith("tcp://"):
+        host, port = source[len("tcp://") :].rsplit(":", 1)
+        return socket_lines(host, int(port))
+    return tail_lines(source, follow=follow)
+
+
+async def read_records(source, follow):
+    """Разбирает CSV-строки источника в словари; первая строка — заголовок."""
+    header = None
+    async for line in open_source(source, follow):
+        if not line:
+            continue
+        fields = next(csv.reader([line]))
+        if header is None:
+            header = fields
+            continue
+        yield dict(zip(header, fields))
+
+
+def is_exchange_fill(record):
+    """Проверяет, что строка dump_log — входящее WsPayload сообщение."""
+    return all(record.get(column) == value for column, value in DUMP_LOG_FILTERS.items())
+
+
+def reconcile_pairs(pairs):
+    """
+    Сравнивает комиссии для пачки пар (сделка, сообщение) логикой compare_fees/detect_mismatches.
+    Каждая пара получает свой ключ, чтобы повторные trace_id не давали декартова произведения.
+    """
+    trades = pd.DataFrame([pair[0] for pair in pairs])
+    messages = pd.DataFrame([pair[1] for pair in pairs])
+    original_trace_ids = trades["trace_id"].to_numpy()
+    trades["trace_id"] = messages["trace_id"] = np.arange(len(pairs))
+
+    comparison = compare_fees(trades, messages, None)
+    mismatched = detect_mismatches(comparison)
+    mismatched = mismatched[mismatched[MISMATCH_TYPES].any(axis=1)]
+    mismatched = mismatched.assign(
+        pair=mismatched["trace_id"].to_numpy(),
+        trace_id=original_trace_ids[mismatched["trace_id"].to_numpy()],
+    )
+    return mismatched
+
+
+def format_events(mismatched, batch, now):
+    """
+    Формирует JSON-строки событий о расхождениях пачки. latency_ms — задержка от поступления
+    первой записи пары (сделки или сообщения), то есть с ожиданием второй; match_latency_ms —
+    от сопоставления пары до события.
+    """
+    pairs = mismatched["pair"].to_numpy()
+    arrived_at = np.array([pair[2] for pair in batch], dtype=float)[pairs]
+    matched_at = np.array([pair[3] for pair in batch], dtype=float)[pairs]
+    events = mismatched.drop(columns="pair").assign(
+        latency_ms=((now - arrived_at) * 1000).round(3), match_latency_ms=((now - matched_at) * 1000).round(3)
+    )
+    return "".join(json.dumps(event, default=str) + "\n" for event in events.to_dict("records"))
+
+
+async def run_stream(
+    trades_source,
+    dump_source,
+    output=sys.stdout,
+    window_seconds=60.0,
+    batch_interval=0.05,
+    batch_size=1000,
+    follow=True,
+    stats_interval=10.0,
+):
+    """
+    Потоковая сверка комиссий: читает сделки и сообщения биржи, сопоставляет их
+    по trace_id в окне window_seconds и пишет события о расхождениях в output.
+    Сопоставленные пары обрабатываются пачками не реже чем раз в batch_interval секунд.
+    Перцентили задержки считаются от поступления первой записи пары (p50_ms и далее)
+    и от сопоставления пары (match_p50_ms и далее). Пачка, сверка которой дала ошибку,
+    пропускается и учитывается в failed_batches; если сверка остановилась по другой причине
+    (например, ошибка записи в output), чтение потоков прекращается и ошибка поднимается.
+    """
+    matcher = FeeStreamMatcher(window_seconds)
+    latency = LatencyTracker()
+    match_latency = LatencyTracker()
+    pairs = []
+    counters = {"trades": 0, "messages": 0, "pairs": 0, "events": 0, "failed_batches": 0}
+    readers_done = asyncio.Event()
+
+    def flush():
+        if not pairs:
+            return
+        batch = pairs.copy()
+        pairs.clear()
+        try:
+            mismatched = reconcile_pairs(batch)
+            now = time.monotonic()
+            events = format_events(mismatched, batch, now) if not mismatched.empty else ""
+        except Exception as e:
+            counters["failed_batches"] += 1
+            trace_ids = [pair[0].get("trace_id") for pair in batch[:10]]
+            logging.error(f"Batch of {len(batch)} pairs could not be reconciled (trace_id {trace_ids}...): {e}")
+            return
+        if events:
+            output.write(events)
+            counters["events"] += len(mismatched)
+        for _, _, arrived_at, matched_at in batch:
+            latency.add(now - arrived_at)
+            match_latency.add(now - matched_at)
+        output.flush()
+
+    async def consume_trades():
+        async for trade in read_records(trades_source, follow):
+            counters["trades"] += 1
+            pairs.extend(matcher.add_trade(trade["trace_id"], trade, time.monotonic()))
+
+    async def consume_messages():
+        async for message in read_records(dump_source, follow):
+            if not is_exchange_fill(message):
+                continue
+            counters["messages"] += 1
+            pairs.extend(matcher.add_message(message["trace_id"], message, time.monotonic()))
+
+    async def flush_loop():
+        last_stats = time.monotonic()
+        while True:
+            done = readers_done.is_set()
+            counters["pairs"] += len(pairs)
+            flush()
+            now = time.monotonic()
+            matcher.evict(now)
+            if now - last_stats >= stats_interval:
+                logging.info(
+                    f"Stream stats: {counters}, buffered={len(matcher)}, latency={latency.percentiles()}, "
+                    f"match latency={match_latency.percentiles()}"
+                )
+                last_stats = now
+            if done:
+                return
+            await asyncio.sleep(batch_interval if len(pairs) < batch_size else 0)
+
+    flusher = asyncio.create_task(flush_loop())
+    readers = asyncio.gather(consume_trades(), consume_messages())
+
+    def stop_readers(task):
+        # Без сверки пары копились бы без ограничения, пока читатели следят за файлами
+        if not task.cancelled() and task.exception() is not None:
+            readers.cancel()
+
+    flusher.add_done_callback(stop_readers)
+    try:
+        await readers
+    finally:
+        readers_done.set()
+        await flusher
+
+    stats = {
+        **counters,
+        "evicted_trades": matcher.evicted_trades,
+        "evicted_messages": matcher.evicted_messages,
+        **latency.percentiles(),
+        **match_latency.percentiles(prefix="match_"),
+    }
+    logging.info(f"Stream finished: {stats}")
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Real-time fee reconciliation of trade and exchange streams.")
+    parser.add_argument("--trades", default="data/own_trade_log.csv", help="own_trade_log file or tcp://host:port")
+    parser.add_argument("--dump", default="data/dump_log.csv", help="dump_log file or tcp://host:port")
+    parser.add_argument("--window", type=float, default=60.0, help="Matching window in seconds")
+    parser.add_argument("--batch-interval", type=float, default=0.05, help="Max delay before a batch is reconciled")
+    parser.add_argument("--no-follow", action="store_true", help="Stop at the end of input files instead of tailing")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    asyncio.run(
+        run_stream(
+            args.trades,
+            args.dump,
+            window_seconds=args.window,
+            batch_interval=args.batch_interval,
+            follow=not args.no_follow,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import json
+import logging
+
+from utils.trace_index import TRACE_INDEX_DIR, TraceIndex, build_trace_index
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+
+def lookup_messages(trace_ids, dump_log_path, index_dir=TRACE_INDEX_DIR, raw=False):
+    """
+    Строки dump_log по каждому trace_id: {trace_id: [строки]}.
+    Индекс строится, если его нет или он устарел. С raw=True строки возвращаются как в файле.
+    """
+    index = TraceIndex.open(dump_log_path, index_dir)
+    return {
+        trace_id: index.raw_lines(trace_id) if raw else index.messages(trace_id) for trace_id in trace_ids
+    }
+
+
+def read_row_at(dump_log_path, offset):
+    """Строка dump_log по смещению dump_log_offset из таблицы расхождений."""
+    with open(dump_log_path, "rb") as file:
+        file.seek(offset)
+        return file.readline().decode().rstrip("\r\n")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Show raw dump_log messages of trace_ids via the on-disk index.")
+    parser.add_argument("trace_ids", nargs="*", type=int, help="trace_ids to look up")
+    parser.add_argument("--dump-log", default="data/dump_log.csv", help="Exchange messages")
+    parser.add_argument("--index-dir", default=TRACE_INDEX_DIR, help="Directory of the trace_id index")
+    parser.add_argument("--offset", type=int, action="append", default=[], help="Print the row at a dump_log_offset")
+    parser.add_argument("--raw", action="store_true", help="Print rows as they are in the file")
+    parser.add_argument("--build", action="store_true", help="Rebuild the index before the lookup")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.build:
+        build_trace_index(args.dump_log, args.index_dir)
+    for offset in args.offset:
+        print(read_row_at(args.dump_log, offset))
+    if not args.trace_ids:
+        return
+    for trace_id, rows in lookup_messages(args.trace_ids, args.dump_log, args.index_dir, args.raw).items():
+        if not rows:
+            logging.warning(f"trace_id {trace_id} is not in {args.dump_log}")
+        for row in rows:
+            print(row if args.raw else json.dumps(row, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
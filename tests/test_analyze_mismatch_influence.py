@@ -0,0 +1,54 @@
+import pandas as pd
+import pytest
+from utils.analyze_mismatch_influence import (
+    analyze_mismatch_influence,
+    build_mismatch_cube,
+    cube_flag_counts,
+    cube_value_counts,
+    slice_mismatch_cube,
+)
+
+
+@pytest.fixture
+def mismatched_data():
+    """Расхождения с пропуском в одном из признаков."""
+    return pd.DataFrame(
+        {
+            "side": ["Buy", "Sell", "Buy", "Sell", "Buy"],
+            "role": ["Taker", "Maker", "Maker", "Taker", None],
+            "is_fee_evaluated": [True, False, True, True, False],
+            "platform_fee_asset": ["USDT", "USDT", "GT", "USDT", "BTC"],
+            "fee_mismatch": [True, False, True, True, False],
+            "fee_difference": [0.5, -0.25, 1.0, None, 0.25],
+        }
+    )
+
+
+def test_cube_slices_match_groupby(mismatched_data):
+    """Срезы куба совпадают с отдельным groupby по каждому признаку."""
+    cube = build_mismatch_cube(
+        mismatched_data, ["fee_mismatch", "fee_difference"], ["side", "role", "is_fee_evaluated"]
+    )
+
+    for mismatch_column in ["fee_mismatch", "fee_difference"]:
+        for feature in ["side", "role", "is_fee_evaluated"]:
+            expected = (
+                mismatched_data.groupby(feature)[mismatch_column]
+                .agg(count="size", mismatched_count="sum", proportion="mean")
+                .reset_index()
+                .sort_values(by="mismatched_count", ascending=False)
+            )
+            result = slice_mismatch_cube(cube, mismatch_column, feature)
+            pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    combined = slice_mismatch_cube(cube, "fee_mismatch", ["side", "role"])
+    assert combined["count"].sum() == 4, "Строка с пропуском в role не должна попасть в срез."
+    assert analyze_mismatch_influence(mismatched_data, "fee_mismatch", "side")["count"].tolist() == [3, 2]
+
+
+def test_cube_value_and_flag_counts(mismatched_data):
+    """Счетчики из куба совпадают с value_counts."""
+    cube = build_mismatch_cube(mismatched_data, ["fee_mismatch"], ["platform_fee_asset"])
+
+    assert cube_value_counts(cube, "platform_fee_asset").to_dict() == {"USDT": 3, "GT": 1, "BTC": 1}
+    assert cube_flag_counts(cube, "fee_mismatch") == {True: 3, False: 2}
@@ -0,0 +1,188 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic_logs import write_synthetic_logs
+from scripts.batch_analysis import discover_partitions, load_partials, merge_partials, rollup, run_batch, run_jobs
+from scripts.data_analysis import (
+    GROUPED_OUTPUTS,
+    aggregate_comparison_data,
+    compare_fees,
+    load_dump_log,
+    read_order_log,
+    read_own_trade_log,
+    trade_venues,
+)
+from scripts.inconsistency_detection import ASSET_COLUMNS, FEATURES, build_summary_cube, detect_mismatches
+
+DATES = ["2024-03-30", "2024-03-31", "2024-04-01"]
+# Сделки на границе дней, сообщения которых попадают в соседний день
+CROSSING_TRADES = 5
+
+
+def extra_fill_message(message, suffix):
+    """Еще одно сообщение сделки: первое исполнение message с новым id."""
+    payload = json.loads(message)
+    result = payload["data"]["result"]
+    fill = dict(result[0] if isinstance(result, list) else result)
+    fill["id"] = int(f"{fill['id']}{suffix}")
+    payload["data"]["result"] = [fill]
+    return json.dumps(payload)
+
+
+def assert_same_aggregates(actual, expected, keys):
+    """Сравнивает агрегаты по группам без учета порядка групп и типов ключей (категории после CSV — строки)."""
+    actual, expected = (
+        frame.reset_index().astype({key: str for key in keys}).set_index(keys).sort_index()
+        for frame in (actual, expected)
+    )
+    pd.testing.assert_frame_equal(actual[expected.columns], expected, check_dtype=False)
+
+
+@pytest.fixture
+def daily_logs(tmp_path):
+    """Синтетические логи, разделенные на три дня; часть сообщений перенесена через полночь в обе стороны."""
+    source = write_synthetic_logs(tmp_path / "source", 600, seed=3)
+    logs = {name: pd.read_csv(path, dtype=str, keep_default_na=False) for name, path in source.items()}
+    trades = logs["own_trade_log"]
+    trade_day = pd.Series(np.arange(len(trades)) * len(DATES) // len(trades), index=trades["trace_id"])
+    trade_day = trade_day[~trade_day.index.duplicated()]
+
+    dump_log = logs["dump_log"]
+    positions = np.arange(len(dump_log)) * len(DATES) // len(dump_log)
+    dump_day = dump_log["trace_id"].map(trade_day).fillna(pd.Series(positions)).astype(int)
+    first_day = trade_day.index[trade_day == 0]
+    second_day = trade_day.index[trade_day == 1]
+    dump_day[dump_log["trace_id"].isin(first_day[-CROSSING_TRADES:])] = 1
+    dump_day[dump_log["trace_id"].isin(second_day[:CROSSING_TRADES])] = 0
+
+    # Сделки, исполнения которых пришли в сообщениях по обе стороны полуночи: у сделки дня 0
+    # второе сообщение в дне 1, у сделки дня 1 — в дне 0 и в дне 2
+    split = [(first_day[0], [1]), (second_day[-1], [0, 2])]
+    incoming = dump_log[(dump_log["direction"] == "In") & (dump_log["message_name"] == "WsPayload")]
+    extra, extra_days = [], []
+    for trace_id, message_days in split:
+        row = incoming[incoming["trace_id"] == trace_id].iloc[0]
+        for k, day in enumerate(message_days):
+            extra.append(row.copy())
+            extra[-1]["message"] = extra_fill_message(row["message"], 7 + k)
+            extra_days.append(day)
+    dump_log = logs["dump_log"] = pd.concat([dump_log, pd.DataFrame(extra)], ignore_index=True)
+    dump_day = pd.concat([dump_day, pd.Series(extra_days)], ignore_index=True)
+    dump_log.to_csv(source["dump_log"], index=False)
+    days = {
+        "own_trade_log": trade_day.reindex(trades["trace_id"]).to_numpy(),
+        "dump_log": dump_day.to_numpy(),
+        "order_log": logs["order_log"]["trace_id"].map(trade_day).fillna(0).astype(int).to_numpy(),
+    }
+
+    root = tmp_path / "data"
+    for day, date in enumerate(DATES):
+        (root / f"date={date}").mkdir(parents=True)
+        for name, log in logs.items():
+            log[days[name] == day].to_csv(root / f"date={date}" / f"{name}.csv", index=False)
+    (root / "2024-04-02").mkdir()
+    (root / "archive").mkdir()
+    return root, source
+
+
+@pytest.mark.parametrize("options", [{}, {"aggregate_fills": True, "enrich_orders": True, "exact": True}])
+def test_run_batch_matches_single_run(tmp_path, daily_logs, options):
+    """Тест: сводки по дням с переносом через полночь совпадают с расчетом по всем логам сразу."""
+    root, source = daily_logs
+    output_dir = tmp_path / "batch"
+    summary = run_batch(root, output_dir, workers=2, memory_budget_mb=10_000, chunksize=97, **options)
+
+    own_trade_log = read_own_trade_log(source["own_trade_log"])
+    all_fills = options.get("aggregate_fills", False)
+    dump_entries = load_dump_log(
+        source["dump_log"],
+        own_trade_log["trace_id"],
+        parse=True,
+        all_fills=all_fills,
+        venues=trade_venues(own_trade_log),
+    )
+    comparison = compare_fees(
+        own_trade_log,
+        dump_entries,
+        read_order_log(source["order_log"]),
+        include_amounts=options.get("exact", False),
+        enrich_orders=options.get("enrich_orders", False),
+        aggregate_fills=all_fills,
+    )
+    mismatched = detect_mismatches(comparison, exact=options.get("exact", False))
+
+    days = [output_dir / "days" / date / source_name for date in DATES for source_name in ("day", "carried")]
+    merged = merge_partials([load_partials(directory) for directory in days])
+    for output_file, columns in GROUPED_OUTPUTS.items():
+        expected = aggregate_comparison_data(comparison, columns)
+        assert_same_aggregates(merged["groups"][output_file], expected, columns)
+    assert_same_aggregates(merged["cube"], build_summary_cube(mismatched), FEATURES + ASSET_COLUMNS)
+
+    counts = summary.set_index(["period", "key"])
+    assert counts["comparison_rows"].xs("day").sum() == len(comparison)
+    assert counts["mismatched_rows"].xs("day").sum() == len(mismatched)
+    assert counts.loc[("month", "2024-03"), "days"] == 2
+    assert counts.loc[("month", "2024-04"), "trades"] == counts.loc[("day", "2024-04-01"), "trades"]
+    unmatched_trades = ~own_trade_log["trace_id"].isin(comparison["trace_id"])
+    assert counts["unmatched_trades"].xs("day").sum() == unmatched_trades.sum()
+    # Сделки, пересекшие полночь в обе стороны, сопоставлены при переносе
+    carried = [load_partials(output_dir / "days" / date / "carried")["counts"] for date in DATES[:2]]
+    assert all(count["comparison_rows"] >= CROSSING_TRADES for count in carried)
+
+    # Сводки пересобираются из частичных агрегатов без исходных логов
+    month = pd.read_csv(output_dir / "months" / "2024-03" / "_grouped_summary.csv")
+    for path in root.rglob("*.csv"):
+        path.unlink()
+    pd.testing.assert_frame_equal(rollup(output_dir), summary)
+    pd.testing.assert_frame_equal(pd.read_csv(output_dir / "months" / "2024-03" / "_grouped_summary.csv"), month)
+
+
+def test_rollup_ignores_days_of_earlier_runs(tmp_path, daily_logs):
+    """Тест: запуск на части дней не подмешивает в сводки месяцев дни, оставшиеся от прошлого запуска."""
+    root, _ = daily_logs
+    output_dir = tmp_path / "batch"
+    full = run_batch(root, output_dir, workers=1).set_index(["period", "key"])
+
+    summary = run_batch(root, output_dir, start=DATES[1], workers=1).set_index(["period", "key"])
+
+    assert list(summary.index) == [("day", DATES[1]), ("day", DATES[2]), ("month", "2024-03"), ("month", "2024-04")]
+    assert summary.loc[("month", "2024-03"), "days"] == 1
+    assert summary.loc[("month", "2024-03"), "trades"] == full.loc[("day", DATES[1]), "trades"]
+    only_first = rollup(output_dir, start=DATES[0], end=DATES[0]).set_index(["period", "key"])
+    assert list(only_first.index) == [("day", DATES[0]), ("month", "2024-03")]
+    assert only_first.loc[("month", "2024-03"), "trades"] == full.loc[("day", DATES[0]), "trades"]
+
+
+def test_discover_partitions_filters_dates(daily_logs):
+    """Тест: дни без всех логов и каталоги без даты пропускаются, диапазон дат включителен."""
+    root, _ = daily_logs
+    assert list(discover_partitions(root)) == DATES
+    assert list(discover_partitions(root, start="2024-03-31", end="2024-04-01")) == DATES[1:]
+
+
+def test_run_jobs_keeps_memory_budget():
+    """Тест: одновременно выполняемые задания не превышают бюджет, задание больше бюджета идет в одиночку."""
+    lock = threading.Lock()
+    running, peaks = {}, []
+
+    def job(key, memory_mb):
+        with lock:
+            running[key] = memory_mb
+            peaks.append(dict(running))
+        time.sleep(0.02)
+        with lock:
+            del running[key]
+        return key
+
+    estimates = {"a": 60, "b": 30, "c": 50, "d": 120, "e": 10, "f": 40}
+    jobs = {key: (memory_mb, (key, memory_mb)) for key, memory_mb in estimates.items()}
+    results = run_jobs(jobs, job, workers=4, memory_budget_mb=100, executor_class=ThreadPoolExecutor)
+
+    assert results == {key: key for key in estimates}
+    assert all(sum(peak.values()) <= 100 or list(peak) == ["d"] for peak in peaks)
+    assert max(len(peak) for peak in peaks) > 1
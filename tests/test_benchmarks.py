@@ -0,0 +1,73 @@
+from benchmarks.bench_compare_fees import make_logs
+from benchmarks.bench_decompression import run as run_decompression
+from benchmarks.bench_pipeline import best_of, compare_with_baseline, format_report, peak_rss_mb, run
+from benchmarks.synthetic_logs import write_synthetic_logs
+from scripts.data_analysis import compare_fees, load_data
+from utils import instrumentation
+
+
+def test_synthetic_logs_match_by_trace_id(tmp_path):
+    """Сгенерированные по частям логи читаются конвейером, и у каждой сделки есть комиссия биржи."""
+    paths = write_synthetic_logs(tmp_path, 500, seed=1, chunk_size=200)
+
+    own_trade_log, dump_log, order_log = load_data(paths["own_trade_log"], paths["dump_log"], paths["order_log"])
+    comparison_df = compare_fees(own_trade_log, dump_log, order_log)
+
+    assert len(own_trade_log) == 500
+    assert own_trade_log["trace_id"].is_unique
+    assert set(order_log["status"]) == {"New", "Filled"}
+    assert len(comparison_df) == 500
+    assert comparison_df["exchange_fee_rate"].notna().all()
+    assert set(comparison_df["exchange_fee_asset"]) == {"aux", "quote", "base"}
+
+
+def test_compare_fees_benchmark_pairs_fees_with_trades():
+    """Комиссия в сообщении каждой сделки совпадает с комиссией платформы, шум отсеивается фильтром."""
+    own_trade_log, dump_log, order_log = make_logs(1001, seed=2)
+    comparison_df = compare_fees(own_trade_log, dump_log, order_log)
+
+    assert len(dump_log) == 1001
+    assert len(comparison_df) == len(own_trade_log)
+    assert (comparison_df["exchange_fee_rate"] - comparison_df["platform_fee_rate"]).abs().max() < 1e-9
+    assert (comparison_df["exchange_fee_asset"] == comparison_df["platform_fee_asset"]).all()
+
+
+def test_pipeline_benchmark_reports_regressions(tmp_path):
+    """Каждый этап замеряется отдельно; замедление и изменение числа строк попадают в замечания."""
+    paths = write_synthetic_logs(tmp_path, 300)
+
+    stages = run(paths, plots=False)
+
+    assert list(stages) == ["load_data", "compare_fees", "detect_mismatches", "influence_analysis"]
+    assert all(stage["peak_rss_mb"] > 0 for stage in stages.values())
+    results = {"stages": stages}
+    assert compare_with_baseline(results, results) == []
+
+    slower = {name: dict(stage, seconds=10.0) for name, stage in stages.items()}
+    baseline = {"stages": {name: dict(stage, seconds=1.0) for name, stage in stages.items()}}
+    baseline["stages"]["compare_fees"]["rows"] += 1
+    problems = compare_with_baseline({"stages": slower}, baseline)
+    assert len(problems) == len(stages) + 1
+
+
+def test_pipeline_benchmark_without_resource_module(monkeypatch):
+    """Без модуля resource (не Unix) пиковый RSS не замеряется, а отчет все равно строится."""
+    monkeypatch.setattr(instrumentation, "resource", None)
+
+    assert peak_rss_mb() is None
+    stage = {"seconds": 1.0, "peak_rss_mb": peak_rss_mb(), "rows": 10}
+    best = best_of([{"load_data": stage}, {"load_data": dict(stage, seconds=0.5)}])
+    assert best["load_data"] == {"seconds": 0.5, "peak_rss_mb": None, "rows": 10}
+    assert "-" in format_report({"stages": best}).splitlines()[1]
+
+
+def test_decompression_benchmark_compares_inputs(tmp_path):
+    """Сжатые копии пишутся один раз, все варианты дают одинаковое сравнение, распаковка замеряется отдельно."""
+    paths = write_synthetic_logs(tmp_path, 300)
+
+    results = run_decompression(paths, variants=("csv", "gzip"))
+
+    assert results["csv"]["rows"] == results["gzip"]["rows"] == 300
+    assert results["gzip"]["input_mb"] < results["csv"]["input_mb"]
+    assert {"decompress_seconds", "overlap_seconds", "break_even_disk_mb_per_s"} <= set(results["gzip"])
+    assert (tmp_path / "dump_log.csv.gz").exists()
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.completeness_check import check_completeness
+from utils.key_sets import BloomFilter, KeyCounter, id_keys, key_label
+
+
+@pytest.fixture
+def completeness_logs(tmp_path, sample_data_extended):
+    """Сделка 3 без исполнения, исполнение сделки 4 без сделки, id исполнения 11 повторяется."""
+    own_trade_log, _, _ = sample_data_extended
+    own_trade_log["exchange_trade_id"] = ["11", "12", "13"]
+    messages = {
+        1: '{"data": {"result": [{"id": 11, "fee": 0.1, "fee_currency": "USD"}]}}',
+        2: '{"data": {"result": [{"id": 12, "fee": 0.25, "fee_currency": "USD"}]}}',
+        4: '{"data": {"result": [{"id": 11, "fee": 0.2, "fee_currency": "USD"}]}}',
+    }
+    dump_log = pd.DataFrame(
+        {
+            "trace_id": list(messages),
+            "direction": "In",
+            "message_name": "WsPayload",
+            "message_kind": "Regular",
+            "message": list(messages.values()),
+        }
+    )
+    dump_log.to_csv(tmp_path / "dump.csv", index=False)
+    return own_trade_log, tmp_path / "dump.csv"
+
+
+@pytest.mark.parametrize(
+    "options",
+    [{"method": "exact"}, {"method": "exact", "max_memory_keys": 1, "chunksize": 1}, {"method": "bloom"}],
+)
+def test_check_completeness_finds_orphans_and_duplicates(tmp_path, completeness_logs, options):
+    """Тест сиротских сделок и исполнений и повторов id исполнений точным методом, со сбросом на диск и фильтром Блума."""
+    own_trade_log, dump_log_path = completeness_logs
+    options = {**options, "bloom_capacity": 1000} if options["method"] == "bloom" else options
+
+    summary, orphan_trades = check_completeness(
+        own_trade_log, dump_log_path, spill_dir=tmp_path, orphan_fills_output=tmp_path / "orphan_fills.csv", **options
+    )
+
+    counts = summary.set_index("check")["count"]
+    assert counts["trades"] == 3 and counts["exchange_fills"] == 3
+    assert orphan_trades["trace_id"].tolist() == [3]
+    assert counts["orphan_trades"] == 1 and counts["orphan_fills"] == 1
+    assert pd.read_csv(tmp_path / "orphan_fills.csv")["trace_id"].tolist() == [4]
+    assert counts["duplicate_fill_id"] == 1
+    assert summary.set_index("check").loc["duplicate_fill_id", "examples"] == "11"
+    assert counts["duplicate_trade_exchange_trade_id"] == 0
+    # Файлы разделов удаляются после проверки
+    assert not list(tmp_path.glob("keys_*"))
+
+
+def test_key_counter_spill_matches_in_memory_counts(tmp_path):
+    """Тест: повторы после сброса в файлы разделов совпадают с подсчетом в памяти."""
+    keys = np.random.default_rng(0).integers(0, 5000, 20000).astype(np.uint64)
+    expected_keys, expected_counts = np.unique(keys, return_counts=True)
+    repeated = expected_counts > 1
+
+    with KeyCounter(max_memory_keys=1000, spill_dir=tmp_path, partitions=8) as counter:
+        for batch in np.array_split(keys, 40):
+            counter.add(batch)
+        assert counter.spilled
+        duplicate_keys, counts = counter.duplicates()
+
+    order = np.argsort(duplicate_keys)
+    np.testing.assert_array_equal(duplicate_keys[order], expected_keys[repeated])
+    np.testing.assert_array_equal(counts[order], expected_counts[repeated])
+
+
+def test_bloom_filter_never_misses_repeats():
+    """Тест фильтра Блума: все повторы найдены, ложных срабатываний не больше нескольких процентов ожидаемого."""
+    bloom = BloomFilter(capacity=10000, error_rate=0.01)
+    first = bloom.add(np.arange(10000, dtype=np.uint64))
+    assert bloom.add(np.arange(0, 10000, 7, dtype=np.uint64)).all()
+    assert first.mean() < 0.03
+    assert bloom.add(np.array([5, 5], dtype=np.uint64)).all()
+
+
+def test_id_keys_keeps_numeric_ids():
+    """Тест ключей: десятичные id сохраняют значение, прочие хешируются, пустые отмечаются."""
+    keys, valid = id_keys(["800000011", "abc", None])
+    assert valid.tolist() == [True, True, False]
+    assert key_label(keys[0]) == "800000011"
+    assert key_label(keys[1]).startswith("#")
@@ -0,0 +1,98 @@
+import gzip
+import threading
+
+import pandas as pd
+import pytest
+from benchmarks.synthetic_logs import write_synthetic_logs
+from scripts.batch_analysis import discover_partitions
+from scripts.data_analysis import compare_fees, load_data
+from scripts.incremental_analysis import run_incremental
+from utils.compressed_input import BackgroundDecompressor, open_input, resolve_input
+
+INPUT_NAMES = ("own_trade_log", "dump_log", "order_log")
+
+
+def gzip_copies(paths):
+    """Сжимает входные файлы в .gz рядом с исходными."""
+    compressed = {}
+    for name, path in paths.items():
+        compressed[name] = path.with_name(f"{path.name}.gz")
+        compressed[name].write_bytes(gzip.compress(path.read_bytes()))
+    return compressed
+
+
+@pytest.fixture
+def synthetic_paths(tmp_path):
+    return write_synthetic_logs(tmp_path / "data", 400, seed=7)
+
+
+def test_background_decompressor_streams_all_blocks(tmp_path):
+    """Тест: многочленный gzip читается целиком мелкими блоками, обрезанный архив дает ошибку при чтении."""
+    data = b"".join(f"{i},row\n".encode() for i in range(20000))
+    path = tmp_path / "rows.csv.gz"
+    path.write_bytes(gzip.compress(data[:50000]) + gzip.compress(data[50000:]))
+
+    with BackgroundDecompressor(path, block_size=4096, queue_blocks=2) as source:
+        assert source.read() == data
+
+    path.write_bytes(gzip.compress(data)[:-100])
+    with pytest.raises(EOFError), open_input(path) as source:
+        source.read()
+
+
+def test_background_decompressor_stops_on_early_close(tmp_path):
+    """Тест: закрытие до конца файла останавливает поток распаковки, ожидающий места в очереди."""
+    path = tmp_path / "rows.csv.gz"
+    path.write_bytes(gzip.compress(b"x" * 10**6))
+    source = BackgroundDecompressor(path, block_size=1024, queue_blocks=1)
+    source.read(10)
+    source.close()
+    assert not any(thread.name == "decompress-rows.csv.gz" for thread in threading.enumerate())
+
+
+@pytest.mark.parametrize("options", [{}, {"chunksize": 97, "order_summary": True}, {"workers": 2}])
+def test_load_data_reads_gzip_inputs(tmp_path, synthetic_paths, options):
+    """Тест: сжатые логи дают те же данные и сравнение, что и несжатые; шарды и индекс для них отключаются."""
+    plain = [synthetic_paths[name] for name in INPUT_NAMES]
+    compressed = [gzip_copies(synthetic_paths)[name] for name in INPUT_NAMES]
+    expected = load_data(*plain, **{key: value for key, value in options.items() if key != "workers"})
+
+    loaded = load_data(*compressed, index_dir=tmp_path / "index", **options)
+
+    for frame, expected_frame in zip(loaded, expected):
+        pd.testing.assert_frame_equal(frame, expected_frame)
+    pd.testing.assert_frame_equal(compare_fees(*loaded), compare_fees(*expected))
+    assert not (tmp_path / "index").exists()
+
+
+def test_zstd_inputs(tmp_path, synthetic_paths):
+    """Тест: .zst читается так же, как несжатый файл."""
+    zstandard = pytest.importorskip("zstandard")
+    path = synthetic_paths["dump_log"]
+    compressed = path.with_name(f"{path.name}.zst")
+    compressed.write_bytes(zstandard.ZstdCompressor().compress(path.read_bytes()))
+    with open_input(compressed) as source:
+        assert source.read() == path.read_bytes()
+
+
+def test_compressed_inputs_are_found(tmp_path, synthetic_paths):
+    """Тест: вместо отсутствующего файла берется его сжатая копия, в том числе в каталогах дней."""
+    gzip_copies(synthetic_paths)
+    synthetic_paths["dump_log"].unlink()
+    assert resolve_input(synthetic_paths["dump_log"]).name == "dump_log.csv.gz"
+    assert resolve_input(synthetic_paths["own_trade_log"]) == synthetic_paths["own_trade_log"]
+
+    day = tmp_path / "days" / "2024-03-23"
+    day.parent.mkdir()
+    synthetic_paths["own_trade_log"].parent.rename(day)
+    assert discover_partitions(tmp_path / "days")["2024-03-23"]["dump_log"].name == "dump_log.csv.gz"
+
+
+def test_incremental_rejects_compressed_dump_log(tmp_path, synthetic_paths):
+    """Тест: инкрементальный режим (смещения в байтах dump_log) не принимает сжатый файл."""
+    compressed = gzip_copies(synthetic_paths)
+    with pytest.raises(ValueError):
+        run_incremental(
+            synthetic_paths["own_trade_log"], compressed["dump_log"], synthetic_paths["order_log"],
+            state_dir=tmp_path / "state",
+        )
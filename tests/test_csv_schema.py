@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+import utils.csv_schema as csv_schema
+from utils.csv_schema import read_typed_csv
+
+SCHEMA = {
+    "platform_time": "datetime",
+    "trace_id": "uint64",
+    "side": "category",
+    "fee_amount": "string",
+    "price": "float64",
+    "is_fee_evaluated": "bool",
+}
+
+
+@pytest.fixture(params=["pyarrow", "pandas"])
+def csv_engine(request, monkeypatch):
+    """Прогоняет тест с CSV-парсером pyarrow и с движком C pandas."""
+    if request.param == "pyarrow":
+        pytest.importorskip("pyarrow")
+    else:
+        monkeypatch.setattr(csv_schema, "pa", None)
+    return request.param
+
+
+def test_read_typed_csv(tmp_path, csv_engine):
+    """Тест чтения по схеме: типы, текст сумм без потерь, отбрасывание столбцов."""
+    path = tmp_path / "own_trade_log.csv"
+    path.write_text(
+        '"platform_time","trace_id","side","fee_amount","price","is_fee_evaluated","source"\n'
+        "2024-03-23 00:09:51.606865503,9189440833438079542,Bid,0.100000000000000001,0.6133,true,OrderChange\n"
+        "2024-03-23 00:10:37.963539567,12,Ask,0.000000000000000000,174.34,false,OrderChange\n"
+    )
+
+    df = read_typed_csv(path, SCHEMA, usecols=["trace_id", "side", "fee_amount", "price", "is_fee_evaluated"])
+
+    assert list(df.columns) == ["trace_id", "side", "fee_amount", "price", "is_fee_evaluated"]
+    assert df["trace_id"].dtype == "uint64"
+    assert df["trace_id"].tolist() == [9189440833438079542, 12]
+    assert df["side"].cat.categories.tolist() == ["Ask", "Bid"]
+    assert df["fee_amount"].tolist() == ["0.100000000000000001", "0.000000000000000000"]
+    assert df["is_fee_evaluated"].tolist() == [True, False]
+
+    times = read_typed_csv(path, SCHEMA, usecols=["platform_time"])["platform_time"]
+    assert times.dtype == "datetime64[ns]"
+    assert times.iloc[0] == pd.Timestamp("2024-03-23 00:09:51.606865503")
+
+
+def test_read_typed_csv_blank_ids(tmp_path, csv_engine):
+    """Пустые идентификаторы читаются как пропуски (UInt64), столбцы без пропусков остаются uint64."""
+    path = tmp_path / "order_log.csv"
+    path.write_text("trace_id,order_id\n1,10\n2,\n")
+
+    df = read_typed_csv(path, {"trace_id": "uint64", "order_id": "uint64"})
+
+    assert df["trace_id"].dtype == "uint64"
+    assert df["order_id"].dtype == "UInt64"
+    assert df["order_id"].isna().tolist() == [False, True]
+
+
+def test_read_typed_csv_empty_file(tmp_path, csv_engine):
+    """Пустой файл дает EmptyDataError, как pd.read_csv."""
+    path = tmp_path / "empty.csv"
+    path.write_text("")
+    with pytest.raises(pd.errors.EmptyDataError):
+        read_typed_csv(path, SCHEMA)
@@ -2,13 +2,22 @@ import pytest
 import pandas as pd
 import json
 import os
+from benchmarks.synthetic_logs import write_synthetic_logs
 from scripts.data_analysis import (
     extract_fee_from_message,
     load_data,
+    load_dump_log,
+    load_dump_log_parallel,
     compare_fees,
     save_results,
-    group_comparison_data
+    group_comparison_data,
+    aggregate_cost_impact,
+    read_own_trade_log,
 )
+from utils import instrumentation
+from utils.fee_schedule import FeeSchedule
+from utils.instrumentation import stage
+from utils.message_parsing import EXTRACTORS, FeeExtractor
 
 
 def test_extract_fee_from_message_valid():
@@ -63,6 +72,145 @@ def test_load_data(sample_data):
     assert len(own_trade_log) == 2, "own_trade_log должен содержать 2 записи."
 
 
+def test_load_data_tolerates_blank_ids(tmp_path):
+    """Строки с пустыми trace_id и order_id не ломают загрузку: служебные сообщения отбрасываются."""
+    own_trade_path = tmp_path / "own_trade_log.csv"
+    dump_log_path = tmp_path / "dump_log.csv"
+    order_log_path = tmp_path / "order_log.csv"
+    own_trade_path.write_text(
+        "trace_id,order_id,fee_amount,price,base_amount,fee_asset_name,base_asset_name,quote_asset_name,"
+        "side,role,is_fee_evaluated\n"
+        "1,10,0.001,100,1,USD,BTC,USD,bid,taker,True\n"
+        "2,,0.002,200,2,USD,BTC,USD,ask,maker,True\n"
+    )
+    dump_log_path.write_text(
+        "trace_id,direction,message_name,message_kind,message\n"
+        '1,In,WsPayload,Regular,"{""data"": {""result"": [{""fee"": 0.001, ""fee_currency"": ""USD""}]}}"\n'
+        ",Out,WsPing,Regular,ping\n"
+    )
+    order_log_path.write_text("trace_id,order_id,status,side\n1,10,filled,bid\n,,canceling,ask\n")
+
+    own_trade_log, dump_log, order_log = load_data(own_trade_path, dump_log_path, order_log_path)
+
+    assert (len(own_trade_log), len(dump_log), len(order_log)) == (2, 1, 2)
+    assert own_trade_log["trace_id"].dtype == "uint64"
+    assert own_trade_log["order_id"].isna().tolist() == [False, True]
+    assert dump_log["trace_id"].dtype == "uint64"
+    assert compare_fees(own_trade_log, dump_log, order_log)["trace_id"].tolist() == [1]
+
+
+def test_load_dump_log_filters_chunks(tmp_path):
+    """Тест потоковой загрузки dump_log с фильтрацией внутри частей."""
+    dump_log_path = tmp_path / "dump_log.csv"
+    dump_log_path.write_text(
+        "trace_id,timestamp,direction,message_name,message_kind,message\n"
+        "1,10,In,WsPayload,Regular,msg1\n"
+        "1,11,Out,WsPayload,Regular,msg2\n"
+        "2,12,In,WsPing,Regular,msg3\n"
+        "3,13,In,WsPayload,Regular,msg4\n"
+        "2,14,In,WsPayload,Regular,msg5\n"
+    )
+
+    dump_log = load_dump_log(dump_log_path, trace_ids=[1, 2], chunksize=2)
+
+    assert list(dump_log.columns) == ["trace_id", "message"], "Должны остаться только нужные столбцы."
+    assert dump_log["message"].tolist() == ["msg1", "msg5"], "Лишние сообщения должны быть отфильтрованы."
+
+
+def test_load_dump_log_parallel_matches_single_process(tmp_path, sample_data_extended):
+    """Тест параллельного разбора dump_log по шардам."""
+    own_trade_log, dump_log, _ = sample_data_extended
+    dump_log = pd.concat([dump_log] * 20, ignore_index=True)
+    dump_log.loc[::3, "direction"] = "Out"
+    dump_log_path = tmp_path / "dump_log.csv"
+    dump_log.to_csv(dump_log_path, index=False)
+
+    expected = load_dump_log(dump_log_path, own_trade_log["trace_id"], parse=True)
+    instrumentation.reset()
+    with stage("load"):
+        result = load_dump_log_parallel(dump_log_path, own_trade_log["trace_id"], chunksize=4, workers=2)
+
+    pd.testing.assert_frame_equal(result, expected)
+    # Этапы воркеров попадают в отчет родителя под этапом load
+    stages = {record["stage"]: record for record in instrumentation.RECORDER.report()["stages"]}
+    assert stages["load/filter"]["calls"] >= 2
+    assert stages["load/parse"]["rows_out"] == len(expected)
+
+
+def test_load_data_uses_dump_cache(tmp_path, sample_data_extended):
+    """Тест построения и повторного использования Parquet-кэша dump_log."""
+    pytest.importorskip("pyarrow")
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_path = tmp_path / "own_trade_log.csv"
+    dump_log_path = tmp_path / "dump_log.csv"
+    order_log_path = tmp_path / "order_log.csv"
+    own_trade_log.to_csv(own_trade_path, index=False)
+    dump_log.to_csv(dump_log_path, index=False)
+    order_log.to_csv(order_log_path, index=False)
+    cache_dir = tmp_path / "cache"
+
+    expected = compare_fees(*load_data(own_trade_path, dump_log_path, order_log_path))
+    first = load_data(own_trade_path, dump_log_path, order_log_path, cache_dir=cache_dir)
+    assert (cache_dir / "dump_log.csv.parquet").exists(), "Кэш должен быть создан."
+
+    # Изменение содержимого при том же размере обнаруживается по хешу
+    mtime_ns = os.stat(dump_log_path).st_mtime_ns
+    dump_log_path.write_text(dump_log_path.read_text().replace("WsPayload", "WsPayloaX"))
+    os.utime(dump_log_path, ns=(mtime_ns, mtime_ns + 10**9))
+    second = load_data(own_trade_path, dump_log_path, order_log_path, cache_dir=cache_dir)
+    assert second[1].empty, "После изменения dump_log кэш должен быть перестроен."
+
+    pd.testing.assert_frame_equal(compare_fees(*first), expected)
+
+
+def test_dump_cache_filters_uint64_trace_ids(tmp_path):
+    """Тест: фильтр кэша по trace_id принимает значения >= 2**63 и при повторной загрузке дает те же данные."""
+    pytest.importorskip("pyarrow")
+    paths = write_synthetic_logs(tmp_path / "data", 200, seed=5)
+    own_trade_log = read_own_trade_log(paths["own_trade_log"])
+    assert (own_trade_log["trace_id"] >= 2**63).any()
+    inputs = [paths[name] for name in ("own_trade_log", "dump_log", "order_log")]
+
+    expected = compare_fees(*load_data(*inputs))
+    for _ in range(2):
+        loaded = load_data(*inputs, cache_dir=tmp_path / "cache")
+        pd.testing.assert_frame_equal(compare_fees(*loaded), expected)
+
+
+def test_compare_fees_parses_messages_by_venue(tmp_path, monkeypatch, sample_data_extended):
+    """Тест выбора разборщика сообщений по бирже из instrument_name, с кэшем и без."""
+    pytest.importorskip("pyarrow")
+    extractor = FeeExtractor("NestedSpot", ("order",), {"fee": ("commission", "amount"), "fee_currency": "asset"})
+    monkeypatch.setitem(EXTRACTORS, extractor.venue, extractor)
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log["instrument_name"] = ["BTC_USD|GateioSpot", "BTC_USD|NestedSpot", "BTC_USD"]
+    dump_log.loc[1, "message"] = '{"order": {"commission": {"amount": "0.25"}, "asset": "USD"}}'
+    paths = [tmp_path / name for name in ("own_trade_log.csv", "dump_log.csv", "order_log.csv")]
+    for data, path in zip(sample_data_extended, paths):
+        data.to_csv(path, index=False)
+
+    comparison = compare_fees(own_trade_log, dump_log, order_log)
+    assert comparison["exchange_fee_rate"].tolist() == comparison["platform_fee_rate"].tolist()
+    assert comparison["exchange_fee_asset"].tolist() == ["quote", "quote", "base"]
+
+    for cache_dir in (None, tmp_path / "cache", tmp_path / "cache"):
+        loaded = load_data(*paths, cache_dir=cache_dir)
+        result = compare_fees(*loaded)
+        assert result["exchange_fee_rate"].tolist() == comparison["exchange_fee_rate"].tolist()
+        assert result["exchange_fee_asset"].tolist() == comparison["exchange_fee_asset"].tolist()
+    venue_cache = tmp_path / "cache" / "venues" / "NestedSpot" / "dump_log.csv.parquet"
+    assert venue_cache.exists(), "Кэш хранится отдельно по биржам."
+
+    # Новая сделка меняет соответствие trace_id и бирж, но не делает кэш бирж устаревшим
+    built_ns = venue_cache.stat().st_mtime_ns
+    own_trade_log.loc[3] = own_trade_log.loc[1].copy()
+    own_trade_log.loc[3, "trace_id"] = 4
+    own_trade_log.to_csv(paths[0], index=False)
+    load_data(*paths, cache_dir=tmp_path / "cache")
+    assert venue_cache.stat().st_mtime_ns == built_ns
+    assert [path.name for path in (tmp_path / "cache" / "venues").iterdir()] == ["NestedSpot"]
+
+
 def test_load_data_file_not_found():
     """Тест обработки ошибки при отсутствии файла."""
     with pytest.raises(FileNotFoundError):
@@ -109,3 +257,100 @@ def test_group_comparison_data(tmp_path, sample_comparison_data_extended):
     grouped_df = pd.read_csv(output_file)
     assert "total_count" in grouped_df.columns, "Должна быть колонка total_count."
     assert "avg_platform_fee" in grouped_df.columns, "Должна быть колонка avg_platform_fee."
+
+
+def test_compare_fees_keeps_order_and_all_messages(sample_data_extended):
+    """Тест порядка строк и обработки нескольких сообщений на одну сделку."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    extra_message = dump_log.iloc[[0]].assign(
+        message='{"data": {"result": [{"fee": 0.2, "fee_currency": "BTC"}]}}'
+    )
+    dump_log = pd.concat([extra_message, dump_log.iloc[::-1]], ignore_index=True)
+
+    comparison_df = compare_fees(own_trade_log, dump_log, order_log)
+
+    assert comparison_df["trace_id"].tolist() == [1, 1, 2, 3], "Строки должны идти в порядке own_trade_log."
+    assert comparison_df["exchange_fee_rate"].tolist() == [0.2, 0.1, 0.0625, 0.01667]
+    assert comparison_df["exchange_fee_asset"].tolist() == ["base", "quote", "quote", "base"]
+
+
+def test_compare_fees_adds_expected_fee_rate(sample_data_extended):
+    """Тест добавления ожидаемой ставки из таблицы комиссий."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    fee_schedule = FeeSchedule(
+        pd.DataFrame(
+            {
+                "instrument_name": ["*", "*"],
+                "role": ["taker", "maker"],
+                "account_name": ["*", "*"],
+                "gt_discount": [False, False],
+                "fee_rate": [0.1, 0.0625],
+            }
+        )
+    )
+
+    comparison_df = compare_fees(own_trade_log, dump_log, order_log, fee_schedule=fee_schedule)
+
+    assert comparison_df["expected_fee_rate"].tolist() == [0.1, 0.0625, 0.1]
+    assert "expected_fee_rate" not in compare_fees(own_trade_log, dump_log, order_log).columns
+
+
+def test_compare_fees_enriches_orders(sample_data_extended):
+    """Тест присоединения данных ордеров к результату сравнения."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log = own_trade_log.assign(
+        platform_time=pd.to_datetime(["2024-03-23 00:00:02", "2024-03-23 00:00:03", "2024-03-23 00:00:01"]),
+        order_id=[10, 20, 10],
+    )
+    order_log = order_log.assign(
+        platform_time=pd.to_datetime(["2024-03-23 00:00:00", "2024-03-23 00:00:01", "2024-03-23 00:00:03"]),
+        order_id=[10, 20, 10],
+    )
+
+    comparison_df = compare_fees(own_trade_log, dump_log, order_log, enrich_orders=True)
+
+    assert comparison_df["order_status"].tolist() == ["filled", "filled", "filled"]
+    assert comparison_df["time_to_fill"].tolist() == [2.0, 2.0, 1.0]
+    assert comparison_df["fill_count"].tolist() == [2, 1, 2]
+    assert comparison_df["fill_number"].tolist() == [2, 1, 1]
+    assert "order_status" not in compare_fees(own_trade_log, dump_log, order_log).columns
+
+
+def test_compare_fees_aggregates_partial_fills(sample_data_extended):
+    """Тест суммирования комиссий всех исполнений и сообщений одного trace_id."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    dump_log = dump_log.copy()
+    dump_log.loc[0, "message"] = (
+        '{"data": {"result": [{"id": 1, "fee": "0.04", "fee_currency": "USD", "gt_fee": "0"}, '
+        '{"id": 2, "fee": "0.06", "fee_currency": "USD", "gt_fee": "0"}]}}'
+    )
+    # Повтор сообщения с той же сделкой не должен учитываться дважды
+    dump_log = pd.concat([dump_log, dump_log.iloc[[0]]], ignore_index=True)
+
+    comparison_df = compare_fees(own_trade_log, dump_log, order_log, include_amounts=True, aggregate_fills=True)
+
+    assert comparison_df["trace_id"].tolist() == [1, 2, 3]
+    assert comparison_df["exchange_fee_amount"].tolist() == ["0.100000000000000000", "0.25", "0.15"]
+    assert comparison_df["exchange_fee_rate"].tolist() == [0.1, 0.0625, 0.01667]
+    assert len(compare_fees(own_trade_log, dump_log, order_log)) == 4
+
+
+def test_compare_fees_adds_costs_and_cost_impact(sample_data_extended):
+    """Тест пересчета комиссий в USDT и отчета о стоимости расхождений."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log = own_trade_log.assign(
+        platform_time=pd.to_datetime(["2024-03-23 10:00"] * 3),
+        account_name="gt.sub1",
+        instrument_name="BTC_USD|GateioSpot",
+    )
+    price_table = pd.DataFrame(
+        {"time": pd.to_datetime(["2024-03-23 09:00", "2024-03-23 09:00"]), "asset": ["USD", "BTC"], "price": [1.0, 2.0]}
+    )
+
+    comparison_df = compare_fees(own_trade_log, dump_log, order_log, with_context=True, price_table=price_table)
+
+    assert comparison_df["platform_fee_cost"].tolist() == [0.1, 0.25, 0.3]
+    assert comparison_df["fee_cost_difference"].tolist() == [0.0, 0.0, 0.0]
+    impact = aggregate_cost_impact(comparison_df)
+    assert impact["total_count"].sum() == 3
+    assert impact["abs_cost_difference"].sum() == 0.0
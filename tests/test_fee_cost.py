@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+from utils.fee_cost import combine_prices, convert_to_currency, load_price_table, trade_prices
+
+
+def test_convert_to_currency_uses_price_as_of_time(tmp_path):
+    """Берется последняя цена не позже времени сделки; USDT не пересчитывается."""
+    path = tmp_path / "prices.csv"
+    path.write_text("time,asset,price\n2024-03-23 10:00,GT,10\n2024-03-23 09:00,GT,9\n2024-03-23 09:00,BTC,60000\n")
+    prices = combine_prices(load_price_table(path))
+
+    costs = convert_to_currency(
+        ["1", "2", "0.5", "0.0001", "3", "1"],
+        ["GT", "GT", "GT", "BTC", "USDT", "DOGE"],
+        pd.to_datetime(["2024-03-23 09:30", "2024-03-23 10:00", "2024-03-23 08:00", "2024-03-23 12:00", None, "2024-03-23 12:00"]),
+        prices,
+    )
+
+    np.testing.assert_allclose(costs, [9.0, 20.0, np.nan, 6.0, 3.0, np.nan])
+
+
+def test_trade_prices_come_from_usdt_pairs():
+    """Сделки по парам к USDT дают цену базового актива на момент сделки."""
+    own_trade_log = pd.DataFrame(
+        {
+            "platform_time": pd.to_datetime(["2024-03-23 09:00", "2024-03-23 09:01"]),
+            "price": [0.6, 0.01],
+            "base_asset_name": ["ADA", "DOGE"],
+            "quote_asset_name": ["USDT", "BTC"],
+        }
+    )
+
+    prices = trade_prices(own_trade_log)
+
+    assert prices.to_dict("list") == {"time": [pd.Timestamp("2024-03-23 09:00")], "asset": ["ADA"], "price": [0.6]}
@@ -0,0 +1,69 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.fee_drift import compute_fee_drift, save_fee_drift
+
+
+@pytest.fixture
+def comparison_with_context():
+    """Сделки раз в 10 секунд по двум ролям; с 12:00 ставка биржи у Taker растет."""
+    times = pd.date_range("2024-03-23 11:00", "2024-03-23 13:00", freq="10s", inclusive="left")
+    rng = np.random.default_rng(0)
+    data = pd.concat(
+        [
+            pd.DataFrame(
+                {
+                    "platform_time": times,
+                    "instrument_name": "ADA_USDT|GateioSpot",
+                    "role": role,
+                    "trade_volume": 100.0,
+                    "platform_fee_rate": 0.1,
+                    "exchange_fee_rate": 0.1 + rng.normal(0, 0.001, len(times)),
+                    "platform_fee_asset": "quote",
+                    "exchange_fee_asset": "quote",
+                }
+            )
+            for role in ["Maker", "Taker"]
+        ],
+        ignore_index=True,
+    )
+    shifted = (data["role"] == "Taker") & (data["platform_time"] >= "2024-03-23 12:00")
+    data.loc[shifted, "exchange_fee_rate"] += 0.02
+    return data
+
+
+def test_compute_fee_drift_flags_change_point(comparison_with_context):
+    """Точки изменения появляются только у Taker и только после сдвига ставки."""
+    drift = compute_fee_drift(comparison_with_context, window="10min", bucket="5min")
+
+    assert drift["bucket_trades"].eq(30).all()
+    change_points = drift[drift["change_point"]]
+    assert set(change_points["role"]) == {"Taker"}
+    assert change_points["bucket"].min() == pd.Timestamp("2024-03-23 12:00")
+    assert change_points["bucket"].max() < pd.Timestamp("2024-03-23 12:20")
+
+    # Окно на конце интервала 12:25 целиком после сдвига
+    row = drift[(drift["role"] == "Taker") & (drift["bucket"] == "2024-03-23 12:25")].iloc[0]
+    assert row["trades"] == 60
+    assert row["mismatch_rate"] == 1.0
+    assert row["vw_exchange_fee_rate"] == pytest.approx(0.12, abs=1e-3)
+    assert row["p50_fee_difference"] == pytest.approx(-0.02, abs=1e-3)
+
+
+def test_compute_fee_drift_requires_trade_context(comparison_with_context):
+    """Без времени сделки дрейф не считается."""
+    with pytest.raises(ValueError):
+        compute_fee_drift(comparison_with_context.drop(columns="platform_time"))
+
+
+def test_save_fee_drift_is_compact(tmp_path, comparison_with_context):
+    """Статистики сохраняются в float32, ключи — категориями."""
+    drift = compute_fee_drift(comparison_with_context, window="10min", bucket="5min")
+
+    path = save_fee_drift(drift, tmp_path / "_fee_drift")
+
+    saved = pd.read_parquet(path) if path.suffix == ".parquet" else pd.read_csv(path)
+    assert len(saved) == len(drift)
+    if path.suffix == ".parquet":
+        assert saved["mean_fee_difference"].dtype == np.float32
+        assert saved["role"].dtype == "category"
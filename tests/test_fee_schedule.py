@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils.fee_schedule import FeeSchedule, load_fee_schedule
+
+
+@pytest.fixture
+def fee_schedule_path(tmp_path):
+    """Таблица ставок с общими (*) и точными строками."""
+    path = tmp_path / "fee_schedule.csv"
+    path.write_text(
+        "instrument_name,role,account_name,gt_discount,fee_rate\n"
+        "*,Maker,*,false,-0.01\n"
+        "*,Taker,*,false,0.022\n"
+        "*,Taker,*,true,0.0187\n"
+        "DOGE_USDT|GateioSpot,Taker,*,false,0.13\n"
+        "DOGE_USDT|GateioSpot,Taker,gt.sub1,false,0.12\n"
+    )
+    return path
+
+
+def test_expected_rates_prefers_exact_keys(fee_schedule_path):
+    """Более точная строка таблицы имеет приоритет, отсутствующий ключ дает NaN."""
+    schedule = load_fee_schedule(fee_schedule_path)
+
+    rates = schedule.expected_rates(
+        pd.Series(["DOGE_USDT|GateioSpot", "DOGE_USDT|GateioSpot", "ADA_USDT|GateioSpot", "ADA_USDT|GateioSpot", None]),
+        pd.Series(["Taker", "Taker", "Taker", "Maker", "Maker"], dtype="category"),
+        pd.Series(["gt.sub1", "gt.sub2", "gt.sub1", "gt.sub1", "gt.sub1"]),
+        [False, False, True, True, False],
+    )
+
+    np.testing.assert_array_equal(rates, [0.12, 0.13, 0.0187, np.nan, -0.01])
+
+
+def test_fee_schedule_rejects_duplicate_keys(fee_schedule_path):
+    """Повторяющиеся ключи в таблице ставок считаются ошибкой."""
+    table = pd.read_csv(fee_schedule_path)
+    with pytest.raises(ValueError):
+        FeeSchedule(pd.concat([table, table.iloc[:1]]))
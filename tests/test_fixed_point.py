@@ -0,0 +1,43 @@
+import pytest
+from utils.fixed_point import fixed_point_equal, sum_fixed_point, to_fixed_point
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [
+        ("0.1", (0, 10**17, True)),
+        ("-1.000000000000000002", (-1, -2, True)),
+        ("+2.", (2, 0, True)),
+        (".5", (0, 5 * 10**17, True)),
+        ("1e-05", (0, 10**13, True)),
+        ("-0", (0, 0, True)),
+        ("0.0000000000000000001", (0, 0, False)),
+        ("1.2.3", (0, 0, False)),
+        ("abc", (0, 0, False)),
+        (None, (0, 0, False)),
+    ],
+)
+def test_to_fixed_point(value, expected):
+    """Тест перевода десятичных строк в целую и дробную части."""
+    units, fraction, valid = to_fixed_point([value])
+    assert (units[0], fraction[0], valid[0]) == expected
+
+
+def test_fixed_point_equal():
+    """Тест точного поэлементного сравнения; пустые значения не равны ничему."""
+    left = ["0.10", "0.1", "1e-3", None]
+    right = ["0.100000000000000000", "0.100000000000000001", "0.001", None]
+    assert fixed_point_equal(left, right).tolist() == [True, False, True, False]
+
+
+def test_sum_fixed_point():
+    """Тест точного суммирования по группам с переносом между целой и дробной частью."""
+    values = ["0.999999999999999999", "0.000000000000000001", "-0.25", "0.1", None, "-1", "abc"]
+    sums = sum_fixed_point(values, ["a", "a", "b", "b", "c", "d", "d"])
+
+    assert sums.to_dict() == {
+        "a": "1.000000000000000000",
+        "b": "-0.150000000000000000",
+        "c": None,
+        "d": "-1.000000000000000000",
+    }
@@ -0,0 +1,55 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+HEAVY_MODULES = {"matplotlib", "seaborn"}
+
+ANALYSIS_ONLY_RUN = """
+import os, sys
+sys.path.insert(0, {root!r})
+os.chdir({workdir!r})
+import scripts.data_analysis, scripts.incremental_analysis, scripts.stream_reconciliation
+from scripts.inconsistency_detection import main
+main(["--no-plots"])
+"""
+
+
+def imported_modules(importtime_log):
+    """Разбирает вывод python -X importtime: имя модуля -> накопленное время импорта, мкс."""
+    modules = {}
+    for line in importtime_log.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+
+@pytest.fixture
+def comparison_workdir(tmp_path):
+    """Рабочий каталог с output/_fee_comparison.csv для запуска анализа."""
+    (tmp_path / "output").mkdir()
+    (tmp_path / "output" / "_fee_comparison.csv").write_text(
+        "trace_id,side,role,is_fee_evaluated,platform_fee_rate,platform_fee_asset,exchange_fee_rate,exchange_fee_asset\n"
+        "1,Buy,Taker,True,0.001,USDT,0.001,USDT\n"
+        "2,Sell,Maker,False,0.002,USDT,0.001,GT\n"
+    )
+    return tmp_path
+
+
+def test_analysis_path_does_not_import_plotting(comparison_workdir):
+    """Анализ без графиков не должен загружать matplotlib и seaborn."""
+    script = ANALYSIS_ONLY_RUN.format(root=str(PROJECT_ROOT), workdir=str(comparison_workdir))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script], capture_output=True, text=True, check=True
+    )
+    modules = imported_modules(result.stderr)
+
+    assert "scripts.inconsistency_detection" in modules
+    heavy = sorted(name for name in modules if name.split(".")[0] in HEAVY_MODULES)
+    slowest = sorted(modules.items(), key=lambda item: -item[1])[:5]
+    assert not heavy, f"Plotting modules imported on the analysis-only path: {heavy[:5]}; slowest imports: {slowest}"
+    assert (comparison_workdir / "output" / "_mismatched_data.csv").exists()
@@ -82,4 +82,73 @@ def test_save_summary_report(tmp_path, sample_summary):
     # Проверяем наличие ключевой метрики "Total mismatched rows"
     assert df[df["Metric"] == "Total mismatched rows"]["Value"].iloc[0] == 5, (
         "Некорректное значение для 'Total mismatched rows'."
-    )
\ No newline at end of file
+    )
+
+
+def test_detect_mismatches_tolerance_and_no_mutation():
+    """Тест допусков сравнения ставок; исходные данные не должны изменяться."""
+    data = pd.DataFrame(
+        {
+            "trace_id": [1, 2, 3, 4],
+            "platform_fee_rate": [0.1, 0.10001, 0.2, -0.1],
+            "exchange_fee_rate": [0.1, 0.1, 0.19, 0.1],
+            "platform_fee_asset": ["USD", "USD", "USD", "USD"],
+            "exchange_fee_asset": ["USD", "USD", "USD", "USD"],
+        }
+    )
+    original = data.copy()
+
+    assert detect_mismatches(data)["trace_id"].tolist() == [2, 3, 4]
+    assert detect_mismatches(data, atol=1e-4)["trace_id"].tolist() == [3, 4]
+    relaxed = detect_mismatches(data, rtol=0.1)
+    assert relaxed["trace_id"].tolist() == [4]
+    assert relaxed["sign_mismatch"].tolist() == [True]
+    assert relaxed.index.tolist() == [3]
+    pd.testing.assert_frame_equal(data, original)
+
+
+def test_detect_mismatches_exact_amounts():
+    """Тест точного сравнения сумм комиссий в целочисленном виде."""
+    data = pd.DataFrame(
+        {
+            "trace_id": [1, 2, 3, 4],
+            "platform_fee_rate": [0.05, 0.05, 0.001, 0.1],
+            "exchange_fee_rate": [0.05, 0.05, 0.001, 0.1],
+            "platform_fee_asset": ["USDT", "USDT", "USDT", "USDT"],
+            "exchange_fee_asset": ["USDT", "USDT", "USDT", "USDT"],
+            "platform_fee_amount": [
+                "0.050000000000000000",
+                "-0.050000000000000000",
+                "0.001000000000000000",
+                "0.1",
+            ],
+            "exchange_fee_amount": ["0.05", "-0.050000000000000003", "1e-3", None],
+        }
+    )
+
+    mismatched_data = detect_mismatches(data, exact=True)
+
+    assert mismatched_data["trace_id"].tolist() == [2, 4]
+    assert mismatched_data["fee_mismatch"].all()
+    with pytest.raises(ValueError):
+        detect_mismatches(data.drop(columns=["exchange_fee_amount"]), exact=True)
+
+
+def test_detect_mismatches_reports_schedule_deviations():
+    """Отклонения от таблицы комиссий отмечаются для каждой стороны отдельно."""
+    data = pd.DataFrame(
+        {
+            "trace_id": [1, 2, 3, 4],
+            "platform_fee_rate": [0.1, 0.2, 0.1, 0.3],
+            "exchange_fee_rate": [0.1, 0.1, 0.2, 0.3],
+            "platform_fee_asset": ["USD", "USD", "USD", "USD"],
+            "exchange_fee_asset": ["USD", "USD", "USD", "USD"],
+            "expected_fee_rate": [0.1, 0.1, 0.1, None],
+        }
+    )
+
+    mismatched_data = detect_mismatches(data)
+
+    assert mismatched_data["trace_id"].tolist() == [2, 3]
+    assert mismatched_data["platform_schedule_mismatch"].tolist() == [True, False]
+    assert mismatched_data["exchange_schedule_mismatch"].tolist() == [False, True]
@@ -0,0 +1,186 @@
+import pandas as pd
+import pytest
+from scripts import incremental_analysis
+from scripts.data_analysis import aggregate_comparison_data, compare_fees, finalize_grouped_data
+from scripts.incremental_analysis import run_incremental
+from utils.message_parsing import EXTRACTORS, FeeExtractor
+
+
+def write_logs(tmp_path, own_trade_log, dump_lines):
+    """Записывает журналы сделок и биржи во временные файлы."""
+    own_trade_log.to_csv(tmp_path / "own_trade_log.csv", index=False)
+    (tmp_path / "dump_log.csv").write_text("".join(dump_lines))
+
+
+def test_run_incremental_matches_full_run(tmp_path, sample_data_extended):
+    """Тест: два инкрементальных запуска дают те же строки, что и полный расчет."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log = own_trade_log.assign(
+        platform_time=["2024-03-23 00:00:01", "2024-03-23 00:00:02", "2024-03-23 00:00:03"]
+    )
+    order_log.to_csv(tmp_path / "order_log.csv", index=False)
+    dump_lines = dump_log.to_csv(index=False).splitlines(keepends=True)
+    grouped_outputs = {str(tmp_path / "grouped.csv"): ["side", "role"]}
+    paths = [tmp_path / "own_trade_log.csv", tmp_path / "dump_log.csv", tmp_path / "order_log.csv"]
+    kwargs = {
+        "output_file": tmp_path / "comparison.csv",
+        "state_dir": tmp_path / "state",
+        "grouped_outputs": grouped_outputs,
+    }
+
+    # Первый запуск: сделки 1-2 и сообщения для сделок 1 и 3 (сообщение 3 ждет свою сделку)
+    write_logs(tmp_path, own_trade_log.iloc[:2], [dump_lines[0], dump_lines[1], dump_lines[3]])
+    first = run_incremental(*paths, **kwargs)
+    assert first["trace_id"].tolist() == [1]
+
+    # Второй запуск: появились сделка 3, сообщение для сделки 2 и незавершенная строка
+    write_logs(tmp_path, own_trade_log, [dump_lines[0], dump_lines[1], dump_lines[3], dump_lines[2], "2,In"])
+    second = run_incremental(*paths, **kwargs)
+    assert sorted(second["trace_id"].tolist()) == [2, 3]
+
+    result = pd.read_csv(tmp_path / "comparison.csv")
+    assert sorted(result["trace_id"].tolist()) == [1, 2, 3], "Каждая сделка должна попасть в результат один раз."
+
+    grouped = pd.read_csv(tmp_path / "grouped.csv")
+    assert grouped["total_count"].sum() == 3, "Сгруппированная таблица должна учитывать все строки."
+
+
+def test_pending_messages_parsed_by_trade_venue(tmp_path, monkeypatch, sample_data_extended):
+    """Тест: сообщение, пришедшее раньше своей сделки, разбирается разборщиком биржи этой сделки."""
+    extractor = FeeExtractor("NestedSpot", ("order",), {"fee": ("commission", "amount"), "fee_currency": "asset"})
+    monkeypatch.setitem(EXTRACTORS, extractor.venue, extractor)
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log = own_trade_log.assign(
+        platform_time=["2024-03-23 00:00:01", "2024-03-23 00:00:02", "2024-03-23 00:00:03"],
+        instrument_name=["BTC_USD", "BTC_USD", "BTC_USD|NestedSpot"],
+    )
+    dump_log.loc[2, "message"] = '{"order": {"commission": {"amount": "0.15"}, "asset": "BTC"}}'
+    order_log.to_csv(tmp_path / "order_log.csv", index=False)
+    paths = [tmp_path / "own_trade_log.csv", tmp_path / "dump_log.csv", tmp_path / "order_log.csv"]
+    kwargs = {
+        "output_file": tmp_path / "comparison.csv",
+        "state_dir": tmp_path / "state",
+        "grouped_outputs": {str(tmp_path / "grouped.csv"): ["side", "role"]},
+    }
+    write_logs(tmp_path, own_trade_log.iloc[:2], dump_log.to_csv(index=False).splitlines(keepends=True))
+    run_incremental(*paths, **kwargs)
+
+    write_logs(tmp_path, own_trade_log, dump_log.to_csv(index=False).splitlines(keepends=True))
+    second = run_incremental(*paths, **kwargs)
+
+    assert second["trace_id"].tolist() == [3]
+    assert second["exchange_fee_rate"].tolist() == pytest.approx(second["platform_fee_rate"].tolist())
+    assert second["exchange_fee_asset"].tolist() == ["base"]
+
+
+def test_pending_segments_are_appended_and_evicted(tmp_path, sample_data_extended):
+    """Тест: сегменты несопоставленных сообщений не переписываются и удаляются по сроку ожидания."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log = own_trade_log.assign(
+        platform_time=["2024-03-23 00:00:01", "2024-03-23 12:00:00", "2024-03-25 00:00:00"]
+    )
+    order_log.to_csv(tmp_path / "order_log.csv", index=False)
+    dump_lines = dump_log.to_csv(index=False).splitlines(keepends=True)
+    paths = [tmp_path / "own_trade_log.csv", tmp_path / "dump_log.csv", tmp_path / "order_log.csv"]
+    kwargs = {
+        "output_file": tmp_path / "comparison.csv",
+        "state_dir": tmp_path / "state",
+        "grouped_outputs": {str(tmp_path / "grouped.csv"): ["side", "role"]},
+    }
+    pending_dir = tmp_path / "state" / "pending"
+
+    # Сообщения сделок 2 и 3 приходят раньше сделок и ждут в первом сегменте
+    write_logs(tmp_path, own_trade_log.iloc[:1], dump_lines)
+    run_incremental(*paths, **kwargs)
+    (segment,) = pending_dir.iterdir()
+    written = segment.read_bytes()
+
+    # Сделка 2 в пределах срока ожидания сопоставляется, сегмент при этом не переписывается
+    write_logs(tmp_path, own_trade_log.iloc[:2], dump_lines + ["4,In,WsPayload,Regular,{}\n"])
+    assert run_incremental(*paths, **kwargs)["trace_id"].tolist() == [2]
+    assert segment.read_bytes() == written
+    assert len(list(pending_dir.iterdir())) == 2
+
+    # Сделка 3 сопоставляется, а водяной знак уходит дальше срока ожидания обоих сегментов
+    write_logs(tmp_path, own_trade_log, dump_lines + ["4,In,WsPayload,Regular,{}\n"])
+    assert run_incremental(*paths, **kwargs, pending_horizon="1D")["trace_id"].tolist() == [3]
+    assert not list(pending_dir.iterdir())
+
+    # Сообщение сделки 4 удалено вместе с сегментом: опоздавшая сделка не сопоставляется
+    late_trade = own_trade_log.iloc[[2]].assign(trace_id=4, platform_time="2024-03-25 00:00:01")
+    write_logs(tmp_path, pd.concat([own_trade_log, late_trade]), dump_lines + ["4,In,WsPayload,Regular,{}\n"])
+    assert run_incremental(*paths, **kwargs).empty
+
+
+def test_aggregate_fills_split_across_runs(tmp_path, sample_data_extended):
+    """Тест: с aggregate_fills сделка с исполнениями из двух запусков учитывается один раз, с полной суммой."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log = own_trade_log.assign(
+        platform_time=["2024-03-23 00:00:01", "2024-03-23 00:00:02", "2024-03-23 00:00:03"]
+    )
+    first_fill = '{"data": {"result": [{"id": 21, "fee": "0.1", "fee_currency": "USD"}]}}'
+    second_fill = '{"data": {"result": [{"id": 22, "fee": "0.15", "fee_currency": "USD"}]}}'
+    dump_log.loc[1, "message"] = first_fill
+    dump_log = pd.concat([dump_log, dump_log.iloc[[1, 1]]], ignore_index=True)
+    dump_log.loc[4, "message"] = second_fill
+    order_log.to_csv(tmp_path / "order_log.csv", index=False)
+    dump_lines = dump_log.to_csv(index=False).splitlines(keepends=True)
+    paths = [tmp_path / "own_trade_log.csv", tmp_path / "dump_log.csv", tmp_path / "order_log.csv"]
+    grouped_file = tmp_path / "grouped.csv"
+    kwargs = {
+        "output_file": tmp_path / "comparison.csv",
+        "state_dir": tmp_path / "state",
+        "grouped_outputs": {str(grouped_file): ["side", "role"]},
+        "aggregate_fills": True,
+    }
+
+    write_logs(tmp_path, own_trade_log, dump_lines[:4])
+    assert run_incremental(*paths, **kwargs)["trace_id"].tolist() == [1, 2, 3]
+    # Второе исполнение сделки 2 и повтор первого (тот же id) приходят в следующем запуске
+    write_logs(tmp_path, own_trade_log, dump_lines)
+    second = run_incremental(*paths, **kwargs)
+
+    expected = compare_fees(own_trade_log, dump_log, order_log, aggregate_fills=True)
+    assert second["trace_id"].tolist() == [2]
+    assert second["exchange_fee_rate"].tolist() == pytest.approx(expected.loc[[1], "exchange_fee_rate"].tolist())
+    grouped = pd.read_csv(grouped_file).set_index(["side", "role"])
+    expected_grouped = finalize_grouped_data(aggregate_comparison_data(expected, ["side", "role"]), ["side", "role"])
+    pd.testing.assert_frame_equal(grouped, expected_grouped.set_index(["side", "role"]), check_dtype=False)
+
+    # Прежняя строка сделки 2 удалена из результата, а не только вычтена из агрегатов
+    result = pd.read_csv(tmp_path / "comparison.csv")
+    assert sorted(result["trace_id"].tolist()) == [1, 2, 3]
+    result = result.sort_values("trace_id")
+    assert result["exchange_fee_rate"].tolist() == pytest.approx(expected["exchange_fee_rate"].tolist())
+    assert not list(tmp_path.glob(".comparison.csv.tmp"))
+
+
+def test_unfinished_run_is_rolled_back(tmp_path, monkeypatch, sample_data_extended):
+    """Тест: строки запуска, упавшего до сохранения состояния, не дописываются повторно."""
+    own_trade_log, dump_log, order_log = sample_data_extended
+    own_trade_log = own_trade_log.assign(
+        platform_time=["2024-03-23 00:00:01", "2024-03-23 00:00:02", "2024-03-23 00:00:03"]
+    )
+    order_log.to_csv(tmp_path / "order_log.csv", index=False)
+    dump_lines = dump_log.to_csv(index=False).splitlines(keepends=True)
+    paths = [tmp_path / "own_trade_log.csv", tmp_path / "dump_log.csv", tmp_path / "order_log.csv"]
+    grouped_file = tmp_path / "grouped.csv"
+    kwargs = {
+        "output_file": tmp_path / "comparison.csv",
+        "state_dir": tmp_path / "state",
+        "grouped_outputs": {str(grouped_file): ["side", "role"]},
+    }
+    write_logs(tmp_path, own_trade_log.iloc[:1], dump_lines[:2])
+    run_incremental(*paths, **kwargs)
+
+    # Второй запуск падает после записи результата, до сохранения состояния
+    write_logs(tmp_path, own_trade_log, dump_lines)
+    with monkeypatch.context() as patch:
+        patch.setattr(incremental_analysis, "save_state", lambda *args: 1 / 0)
+        with pytest.raises(ZeroDivisionError):
+            run_incremental(*paths, **kwargs)
+    assert len(pd.read_csv(tmp_path / "comparison.csv")) == 3
+
+    assert sorted(run_incremental(*paths, **kwargs)["trace_id"].tolist()) == [2, 3]
+    assert sorted(pd.read_csv(tmp_path / "comparison.csv")["trace_id"].tolist()) == [1, 2, 3]
+    assert pd.read_csv(grouped_file)["total_count"].sum() == 3
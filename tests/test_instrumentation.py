@@ -0,0 +1,98 @@
+import json
+
+import pandas as pd
+import pytest
+from utils import instrumentation
+from utils.instrumentation import format_prometheus, stage, staged, write_run_report
+
+
+@pytest.fixture(autouse=True)
+def recorder():
+    """Каждый тест начинает с пустого регистратора и без профилировщика."""
+    instrumentation.configure()
+    instrumentation.reset()
+    yield instrumentation.RECORDER
+    instrumentation.configure()
+    instrumentation.reset()
+
+
+@staged("parse")
+def parse(frame):
+    return frame[frame["value"] > 1]
+
+
+def test_stages_nest_and_accumulate(tmp_path):
+    """Вложенные этапы получают путь, повторные запуски суммируются, отчет пишется в JSON."""
+    frame = pd.DataFrame({"value": [1, 2, 3]})
+    with stage("load") as load:
+        parts = [parse(frame) for _ in range(3)]
+        load.rows_out = sum(len(part) for part in parts)
+
+    report = write_run_report(tmp_path / "run.json", job="test")
+
+    assert json.loads((tmp_path / "run.json").read_text()) == report
+    stages = {record["stage"]: record for record in report["stages"]}
+    assert list(stages) == ["load", "load/parse"]
+    assert stages["load/parse"]["parent"] == "load"
+    assert (stages["load/parse"]["calls"], stages["load/parse"]["rows_in"], stages["load/parse"]["rows_out"]) == (3, 9, 6)
+    assert stages["load"]["rows_out"] == 6 and stages["load"]["rows_in"] is None
+    assert stages["load"]["wall_seconds"] >= stages["load/parse"]["wall_seconds"]
+    assert stages["load"]["process_peak_rss_bytes"] > 0
+
+
+def test_failed_stage_is_recorded():
+    """Этап, завершившийся исключением, остается в отчете."""
+    with pytest.raises(ZeroDivisionError):
+        with stage("detect"):
+            1 / 0
+    assert instrumentation.RECORDER.report()["stages"][0]["calls"] == 1
+
+
+def test_profile_and_memory_tracing(tmp_path):
+    """cProfile пишет профиль внешнего этапа, tracemalloc — пик выделений каждого этапа."""
+    instrumentation.configure(profiler="cprofile", profile_dir=tmp_path, trace_memory=True)
+    with stage("aggregate"):
+        with stage("render"):
+            data = bytearray(10**6)
+        del data
+
+    stages = {record["stage"]: record for record in instrumentation.RECORDER.report()["stages"]}
+    assert stages["aggregate"]["profile"] == str(tmp_path / "aggregate.prof")
+    assert (tmp_path / "aggregate.prof").exists()
+    assert stages["aggregate/render"]["profile"] is None
+    assert stages["aggregate"]["heap_peak_bytes"] >= 10**6
+    assert stages["aggregate/render"]["heap_peak_bytes"] >= 10**6
+
+
+def test_prometheus_text_format():
+    """Метрики выводятся с типом (calls_total — counter) и метками job и stage; пустые поля пропускаются."""
+    with stage('join "x"') as join:
+        join.rows_out = 5
+
+    text = format_prometheus(instrumentation.RECORDER.report("data_analysis"))
+
+    assert "# TYPE fee_analysis_stage_wall_seconds gauge" in text
+    assert "# TYPE fee_analysis_stage_calls_total counter" in text
+    assert 'fee_analysis_stage_rows_out{job="data_analysis",stage="join \\"x\\""} 5' in text
+    assert "fee_analysis_stage_rows_in" not in text
+    assert text.endswith("\n")
+
+
+def test_worker_stages_are_merged(recorder):
+    """Этапы воркера собираются без унаследованных записей и добавляются под текущий этап родителя."""
+    frame = pd.DataFrame({"value": [1, 2, 3]})
+    with stage("detect"):
+        pass
+    # Воркер после fork наследует записи родителя; collect их сбрасывает
+    workers = [recorder.collect(parse, frame)[1] for _ in range(2)]
+    assert [[record["stage"] for record in records] for records in workers] == [["parse"], ["parse"]]
+
+    recorder.reset()
+    with stage("load"):
+        for records in workers:
+            instrumentation.merge_stages(records)
+
+    stages = {record["stage"]: record for record in recorder.report()["stages"]}
+    assert list(stages) == ["load", "load/parse"]
+    assert (stages["load/parse"]["calls"], stages["load/parse"]["rows_in"], stages["load/parse"]["rows_out"]) == (2, 6, 4)
+    assert stages["load/parse"]["parent"] == "load"
@@ -0,0 +1,168 @@
+import json
+import pytest
+from utils import message_parsing
+from utils.message_parsing import (
+    EXTRACTORS,
+    FeeExtractor,
+    extract_fees,
+    instrument_venues,
+    parse_fee_fields,
+    parse_fill_records,
+)
+
+
+GATEIO_MESSAGE = json.dumps(
+    {
+        "data": {
+            "channel": "spot.usertrades",
+            "event": "update",
+            "result": [
+                {
+                    "id": 7980637033,
+                    "fee": "-0.001139695210449927",
+                    "fee_currency": "USDT",
+                    "point_fee": "0",
+                    "gt_fee": "0.0012",
+                    "text": "t-abc",
+                }
+            ],
+        }
+    },
+    separators=(",", ":"),
+)
+
+MESSAGES = [
+    GATEIO_MESSAGE,
+    GATEIO_MESSAGE.replace(":[{", ":{").replace("}]}", "}}"),
+    '{"data": {"result": [{"fee": 0.05, "fee_currency": "BTC", "gt_fee": 0}]}}',
+    '{"data": {"result": {}}}',
+    '{"data": {"result": []}}',
+    '{"data": {"result": [{"fee": "1", "fee_currency": "BTC", "gt_fee": "0"}]',
+    '{"result": [{"fee": "1"}]}',
+    "not json",
+]
+
+
+@pytest.fixture(params=["auto", "scanner", "json", "json_without_orjson"])
+def parser_mode(request, monkeypatch):
+    """Запускает тест с каждым способом разбора сообщений, независимо от того, установлен ли orjson."""
+    if request.param == "json_without_orjson":
+        monkeypatch.setattr(message_parsing, "orjson", None)
+        return "json"
+    return request.param
+
+
+def test_parse_fee_fields(parser_mode):
+    """Тест пакетного извлечения полей комиссии."""
+    fees, fee_currencies, gt_fees = parse_fee_fields(MESSAGES, parser=parser_mode)
+
+    assert fees.tolist() == ["-0.001139695210449927", "-0.001139695210449927", 0.05, None, None, None, None, None]
+    assert fee_currencies.tolist() == ["USDT", "USDT", "BTC", None, None, None, None, None]
+    assert gt_fees.tolist() == ["0.0012", "0.0012", 0, None, None, None, None, None]
+
+
+def test_extract_fees_uses_gt_fee(parser_mode):
+    """Тест выбора gt_fee для GT-актива."""
+    fees, fee_currencies = extract_fees(MESSAGES[:3], ["GT", "usdt", "gt"], parser=parser_mode)
+
+    assert fees.tolist() == ["0.0012", "-0.001139695210449927", 0]
+    assert fee_currencies.tolist() == ["GT", "USDT", None], "Нулевая gt_fee не должна давать валюту GT."
+
+
+def test_parse_fill_records_returns_every_fill(parser_mode):
+    """Тест извлечения всех сделок массива result; сообщение без сделок дает пустую запись."""
+    split_fill = GATEIO_MESSAGE.replace("}]}", '},{"id":7980637034,"fee":"0.5","fee_currency":"USDT","gt_fee":"0"}]}')
+    messages = [split_fill] + MESSAGES[1:5]
+    positions, fill_ids, fees, fee_currencies, gt_fees = parse_fill_records(messages, parser=parser_mode)
+
+    assert positions.tolist() == [0, 0, 1, 2, 3, 4]
+    assert fill_ids.tolist() == ["7980637033", "7980637034", "7980637033", None, None, None]
+    assert fees.tolist() == ["-0.001139695210449927", "0.5", "-0.001139695210449927", 0.05, None, None]
+    assert fee_currencies.tolist() == ["USDT", "USDT", "USDT", "BTC", None, None]
+    assert gt_fees.tolist() == ["0.0012", "0", "0.0012", 0, None, None]
+
+
+# Исполнения вложены в объект order, комиссия — в объект commission, gt_fee нет
+NESTED_MESSAGE = json.dumps(
+    {"order": {"fills": [{"tradeId": 5, "commission": {"amount": "0.3", "asset": "BNB"}}, {"tradeId": 6}]}}
+)
+
+
+@pytest.fixture
+def nested_venue(monkeypatch):
+    """Регистрирует разборщик тестовой биржи с вложенными полями."""
+    extractor = FeeExtractor(
+        "NestedSpot",
+        ("order", "fills"),
+        {"id": "tradeId", "fee": ("commission", "amount"), "fee_currency": ("commission", "asset")},
+    )
+    monkeypatch.setitem(EXTRACTORS, extractor.venue, extractor)
+    return extractor.venue
+
+
+def test_parse_fee_fields_dispatches_by_venue(parser_mode, nested_venue):
+    """Тест разбора сообщений разных бирж в одном столбце и пустых полей для неизвестной биржи."""
+    messages = [GATEIO_MESSAGE, NESTED_MESSAGE, MESSAGES[2], NESTED_MESSAGE]
+    venues = instrument_venues(["BTC_USDT|GateioSpot", "BNB_USDT|NestedSpot", "ETH_BTC", "BNB_USDT|OtherSpot"])
+
+    fees, fee_currencies, gt_fees = parse_fee_fields(messages, venues, parser_mode)
+
+    assert venues.tolist() == ["GateioSpot", "NestedSpot", "GateioSpot", "OtherSpot"]
+    assert fees.tolist() == ["-0.001139695210449927", "0.3", 0.05, None]
+    assert fee_currencies.tolist() == ["USDT", "BNB", "BTC", None]
+    assert gt_fees.tolist() == ["0.0012", None, 0, None]
+
+
+def test_parse_fill_records_keeps_message_order_across_venues(parser_mode, nested_venue):
+    """Тест: записи исполнений разных бирж возвращаются в порядке сообщений."""
+    positions, fill_ids, fees, _, _ = parse_fill_records(
+        [NESTED_MESSAGE, GATEIO_MESSAGE, NESTED_MESSAGE], ["NestedSpot", "GateioSpot", "NestedSpot"], parser_mode
+    )
+
+    assert positions.tolist() == [0, 0, 1, 2, 2]
+    assert fill_ids.tolist() == ["5", "6", "7980637033", "5", "6"]
+    assert fees.tolist() == ["0.3", None, "-0.001139695210449927", "0.3", None]
+
+
+def test_unknown_message_parser_is_rejected():
+    """Тест: неизвестный способ разбора дает ошибку, а не тихий выбор другого."""
+    with pytest.raises(ValueError):
+        parse_fee_fields(MESSAGES, parser="regex")
+
+
+def test_scanner_is_used_when_requested(monkeypatch):
+    """Тест: parser="scanner" читает плоские сообщения Gate.io без разбора JSON и при установленном orjson."""
+    monkeypatch.setattr(message_parsing, "_json_loads", lambda message: pytest.fail("JSON parser was used"))
+    fees, fee_currencies, gt_fees = parse_fee_fields([GATEIO_MESSAGE], parser="scanner")
+
+    assert fees.tolist() == ["-0.001139695210449927"]
+    assert (fee_currencies.tolist(), gt_fees.tolist()) == (["USDT"], ["0.0012"])
+
+
+# Формы, на которых сканер должен давать то же, что разбор JSON: нецелый id и лишний текст после сообщения
+TWO_FILLS = GATEIO_MESSAGE.replace("}]", '},{"id":8,"fee":"0.5","fee_currency":"BTC","gt_fee":"0"}]')
+PARITY_MESSAGES = [
+    TWO_FILLS,
+    TWO_FILLS.replace('"id":7980637033', '"id":"12"'),
+    TWO_FILLS.replace('"id":7980637033', '"id":12.5'),
+    TWO_FILLS.replace('"id":7980637033', '"id":null'),
+    TWO_FILLS + " garbage",
+    TWO_FILLS + "}",
+    TWO_FILLS + '{"x":1}',
+    TWO_FILLS[:-1] + " x}",
+    TWO_FILLS[:-2] + ',"time":1}}',
+    TWO_FILLS + " \n",
+    GATEIO_MESSAGE.replace(":[{", ":{").replace("}]}", "}}") + "}",
+]
+
+
+def test_scanner_matches_json_parser():
+    """Тест: сканер и разбор JSON дают одинаковые поля; сообщения, которые JSON отвергает, не разбираются и сканером."""
+    scanned = parse_fill_records(PARITY_MESSAGES, parser="scanner")
+    parsed = parse_fill_records(PARITY_MESSAGES, parser="json")
+    for scanned_values, parsed_values in zip(scanned, parsed):
+        assert scanned_values.tolist() == parsed_values.tolist()
+    assert parsed[1].tolist()[:6] == ["7980637033", "8", "12", "8", "12.5", "8"]
+    assert [
+        values.tolist() for values in parse_fee_fields(PARITY_MESSAGES, parser="scanner")
+    ] == [values.tolist() for values in parse_fee_fields(PARITY_MESSAGES, parser="json")]
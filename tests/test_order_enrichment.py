@@ -0,0 +1,70 @@
+import numpy as np
+import pandas as pd
+import pytest
+from scripts.data_analysis import ORDER_LOG_SCHEMA
+from utils.csv_schema import read_typed_csv_chunks
+from utils.order_enrichment import attach_order_info, load_order_summary, summarize_orders
+
+
+@pytest.fixture
+def order_log_path(tmp_path):
+    """order_log с несколькими записями на ордер, не по порядку времени."""
+    path = tmp_path / "order_log.csv"
+    path.write_text(
+        "platform_time,trace_id,order_id,exchange_order_id,status,side\n"
+        "2024-03-23 00:00:05,1,10,e10,PartiallyFilled,Bid\n"
+        "2024-03-23 00:00:01,1,10,e10,New,Bid\n"
+        "2024-03-23 00:00:02,2,20,e20,New,Ask\n"
+        "2024-03-23 00:00:09,1,10,e10,Filled,Bid\n"
+        "2024-03-23 00:00:03,3,30,e30,New,Ask\n"
+        "2024-03-23 00:00:04,3,99,e99,Canceled,Ask\n"
+    )
+    return path
+
+
+@pytest.fixture
+def trades():
+    """Сделки: два исполнения ордера 10, одно — ордера 20 и сделка без ордера в логе."""
+    return pd.DataFrame(
+        {
+            "platform_time": pd.to_datetime(
+                ["2024-03-23 00:00:08", "2024-03-23 00:00:06", "2024-03-23 00:00:04", "2024-03-23 00:00:07"]
+            ),
+            "order_id": np.array([10, 10, 777, 40], dtype=np.uint64),
+            "exchange_order_id": ["e10", "e10", "e20", "e40"],
+        }
+    )
+
+
+def test_load_order_summary_matches_across_chunk_sizes(order_log_path, trades):
+    """Сводка по частям совпадает с разовой и содержит только ордера сделок."""
+    summaries = [
+        load_order_summary(
+            read_typed_csv_chunks(order_log_path, ORDER_LOG_SCHEMA, chunksize=chunksize),
+            trades["order_id"],
+            trades["exchange_order_id"],
+        )
+        for chunksize in (1, 4, 100)
+    ]
+
+    for summary in summaries[1:]:
+        pd.testing.assert_frame_equal(summary, summaries[0])
+    summary = summaries[0].set_index("order_id")
+    assert sorted(summary.index) == [10, 20]
+    assert summary.loc[10, "order_status"] == "Filled"
+    assert summary.loc[10, "placement_time"] == pd.Timestamp("2024-03-23 00:00:01")
+    assert summary.loc[10, "order_update_count"] == 3
+
+
+def test_attach_order_info_joins_by_order_and_exchange_id(order_log_path, trades):
+    """Сделки связываются по order_id, затем по exchange_order_id; без ордера — пропуски."""
+    order_log = pd.concat(read_typed_csv_chunks(order_log_path, ORDER_LOG_SCHEMA, chunksize=2), ignore_index=True)
+
+    enriched = attach_order_info(trades, order_log)
+
+    assert enriched["order_status"].tolist() == ["Filled", "Filled", "New", None]
+    assert enriched["time_to_fill"].tolist()[:3] == [7.0, 5.0, 2.0]
+    assert np.isnan(enriched["time_to_fill"].iloc[3])
+    assert enriched["fill_count"].tolist() == [2, 2, 1, 1]
+    assert enriched["fill_number"].tolist() == [2, 1, 1, 1]
+    pd.testing.assert_frame_equal(enriched, attach_order_info(trades, summarize_orders(order_log)))
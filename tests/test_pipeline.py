@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+from benchmarks.synthetic_logs import write_synthetic_logs
+from scripts.data_analysis import compare_fees, load_data
+from scripts.inconsistency_detection import detect_mismatches
+from scripts.pipeline import main
+
+
+@pytest.fixture
+def pipeline_dir(tmp_path, monkeypatch):
+    """Рабочий каталог с синтетическими логами в data/."""
+    write_synthetic_logs(tmp_path / "data", 400, seed=3)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_pipeline_skips_unchanged_stages(pipeline_dir):
+    """Повторный запуск ничего не выполняет; смена допуска перезапускает только зависимые этапы."""
+    first = main(["--no-cache", "--write", "grouped", "summary", "influence"])
+    assert first["ran"] == ["load", "compare", "group", "detect", "analyze"]
+    assert (pipeline_dir / "output" / "_mismatched_summary.csv").exists()
+    # Промежуточные таблицы пишутся только по запросу
+    assert not (pipeline_dir / "output" / "_fee_comparison.csv").exists()
+
+    assert main(["--no-cache", "--write", "summary"])["ran"] == []
+    rerun = main(["--no-cache", "--atol", "0.001", "--write", "summary"])
+    assert rerun == {"ran": ["detect", "analyze"], "skipped": ["load", "compare"]}
+
+
+def test_pipeline_passes_exact_values_between_stages(pipeline_dir):
+    """Выбранные этапы пишут таблицы из результатов в памяти без потери точности ставок."""
+    result = main(["--no-cache", "--stages", "detect", "--write", "comparison", "mismatches", "--format", "parquet"])
+
+    assert result["ran"] == ["load", "compare", "detect"]
+    comparison = compare_fees(*load_data("data/own_trade_log.csv", "data/dump_log.csv", "data/order_log.csv"))
+    pd.testing.assert_frame_equal(pd.read_parquet("output/_fee_comparison.parquet"), comparison)
+    expected = detect_mismatches(comparison).reset_index(drop=True)
+    pd.testing.assert_frame_equal(pd.read_parquet("output/_mismatched_data.parquet"), expected)
+    assert not (pipeline_dir / "output" / "_mismatched_summary.csv").exists()
@@ -0,0 +1,105 @@
+import asyncio
+import io
+import json
+import time
+
+import pytest
+from scripts import stream_reconciliation
+from scripts.stream_reconciliation import FeeStreamMatcher, run_stream
+
+
+def test_run_stream_emits_mismatch_events(tmp_path, sample_data_extended):
+    """Тест потоковой сверки: событие выдается только для пары с расхождением."""
+    own_trade_log, dump_log, _ = sample_data_extended
+    dump_log.loc[1, "message"] = '{"data": {"result": [{"fee": 0.3, "fee_currency": "BTC"}]}}'
+    own_trade_log.to_csv(tmp_path / "trades.csv", index=False)
+    dump_log.iloc[::-1].to_csv(tmp_path / "dump.csv", index=False)
+    output = io.StringIO()
+
+    stats = asyncio.run(
+        run_stream(tmp_path / "trades.csv", tmp_path / "dump.csv", output=output, follow=False)
+    )
+
+    events = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [event["trace_id"] for event in events] == ["2"], "Расхождение должно быть только у сделки 2."
+    assert events[0]["fee_mismatch"] and events[0]["asset_mismatch"]
+    assert stats["pairs"] == 3
+    assert "p99_ms" in stats and "match_p99_ms" in stats, "Должны считаться перцентили обеих задержек."
+    assert events[0]["latency_ms"] >= events[0]["match_latency_ms"] >= 0
+
+
+def test_fee_stream_matcher_evicts_stale_entries():
+    """Тест вытеснения записей старше окна."""
+    matcher = FeeStreamMatcher(window_seconds=10)
+    assert matcher.add_message("1", {"message": "m1"}, now=0) == []
+    matcher.add_trade("2", {"trade": "t2"}, now=5)
+
+    matcher.evict(now=12)
+    assert len(matcher) == 1, "Сообщение старше окна должно быть вытеснено."
+    assert matcher.add_trade("1", {"trade": "t1"}, now=12) == []
+    assert matcher.add_message("2", {"message": "m2"}, now=13) == [({"trade": "t2"}, {"message": "m2"}, 5, 13)]
+
+
+def test_fee_stream_matcher_keeps_first_arrival():
+    """Тест: пара хранит время поступления первой записи, чтобы задержка включала ожидание второй."""
+    matcher = FeeStreamMatcher(window_seconds=10)
+    matcher.add_message("1", {"message": "m1"}, now=1)
+    matcher.add_message("1", {"message": "m1b"}, now=2)
+
+    pairs = matcher.add_trade("1", {"trade": "t1"}, now=4)
+    assert [(arrived_at, matched_at) for _, _, arrived_at, matched_at in pairs] == [(1, 4), (2, 4)]
+
+
+def slow_records(read_records):
+    """Отдает записи с паузами, чтобы пары приходили в разные пачки."""
+
+    async def records(source, follow):
+        async for record in read_records(source, follow):
+            await asyncio.sleep(0.03)
+            yield record
+
+    return records
+
+
+def test_failed_batch_is_counted_and_skipped(tmp_path, monkeypatch, sample_data_extended):
+    """Тест: ошибка сверки одной пачки учитывается, а поток продолжает сверять следующие."""
+    own_trade_log, dump_log, _ = sample_data_extended
+    own_trade_log.to_csv(tmp_path / "trades.csv", index=False)
+    dump_log.to_csv(tmp_path / "dump.csv", index=False)
+    reconcile_pairs = stream_reconciliation.reconcile_pairs
+    calls = []
+
+    def fail_first(batch):
+        calls.append(len(batch))
+        if len(calls) == 1:
+            raise ValueError("bad batch")
+        return reconcile_pairs(batch)
+
+    monkeypatch.setattr(stream_reconciliation, "reconcile_pairs", fail_first)
+    monkeypatch.setattr(stream_reconciliation, "read_records", slow_records(stream_reconciliation.read_records))
+
+    stats = asyncio.run(
+        run_stream(tmp_path / "trades.csv", tmp_path / "dump.csv", follow=False, batch_interval=0.01)
+    )
+
+    assert stats["failed_batches"] == 1
+    assert len(calls) > 1 and stats["pairs"] == 3
+
+
+def test_flusher_failure_stops_readers(tmp_path, sample_data_extended):
+    """Тест: если сверка остановилась (ошибка записи), чтение с follow=True прекращается, а ошибка поднимается."""
+    own_trade_log, dump_log, _ = sample_data_extended
+    dump_log.loc[1, "message"] = '{"data": {"result": [{"fee": 0.3, "fee_currency": "BTC"}]}}'
+    own_trade_log.to_csv(tmp_path / "trades.csv", index=False)
+    dump_log.to_csv(tmp_path / "dump.csv", index=False)
+    output = io.StringIO()
+    output.close()
+
+    started = time.monotonic()
+    with pytest.raises(ValueError):
+        asyncio.run(
+            asyncio.wait_for(
+                run_stream(tmp_path / "trades.csv", tmp_path / "dump.csv", output=output, follow=True), timeout=5
+            )
+        )
+    assert time.monotonic() - started < 2, "Чтение должно остановиться сразу, а не по тайм-ауту."
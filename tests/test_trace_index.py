@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+import pytest
+from benchmarks.synthetic_logs import write_synthetic_logs
+from scripts.data_analysis import load_data
+from scripts.trace_lookup import lookup_messages, read_row_at
+from utils.trace_index import (
+    TraceIndex,
+    attach_dump_log_offsets,
+    build_trace_index,
+    index_is_current,
+    index_paths,
+)
+
+
+@pytest.fixture
+def synthetic_paths(tmp_path):
+    return write_synthetic_logs(tmp_path / "data", 300, seed=5)
+
+
+def test_trace_index_returns_raw_rows(tmp_path, synthetic_paths):
+    """Тест поиска: по индексу находятся все строки trace_id в порядке файла, указатели ведут на них."""
+    dump_log_path = synthetic_paths["dump_log"]
+    dump_log = pd.read_csv(dump_log_path, dtype={"trace_id": "uint64"})
+    trace_id = int(dump_log["trace_id"].iloc[10])
+
+    messages = lookup_messages([trace_id, 1], dump_log_path, tmp_path / "index")[trace_id]
+
+    expected = dump_log[dump_log["trace_id"] == trace_id]
+    assert [row["message"] for row in messages] == expected["message"].tolist()
+    assert lookup_messages([1], dump_log_path, tmp_path / "index") == {1: []}
+
+    mismatches = attach_dump_log_offsets(pd.DataFrame({"trace_id": [trace_id, 1]}), dump_log_path, tmp_path / "index")
+    assert mismatches["dump_log_rows"].tolist() == [len(expected), 0]
+    assert mismatches["dump_log_offset"].iloc[1] == -1
+    assert read_row_at(dump_log_path, mismatches["dump_log_offset"].iloc[0]).startswith(f"{trace_id},")
+
+
+@pytest.mark.parametrize("options", [{}, {"workers": 2}, {"cache_dir": "cache"}, {"cache_dir": "cache", "workers": 2}])
+def test_load_data_builds_trace_index(tmp_path, synthetic_paths, options):
+    """Тест: индекс, построенный при загрузке (последовательно, по шардам, с кэшем), совпадает с отдельным проходом."""
+    if "cache_dir" in options:
+        pytest.importorskip("pyarrow")
+        options = {**options, "cache_dir": tmp_path / options["cache_dir"]}
+    paths = [synthetic_paths[name] for name in ("own_trade_log", "dump_log", "order_log")]
+    build_trace_index(paths[1], tmp_path / "expected")
+
+    load_data(*paths, chunksize=97, index_dir=tmp_path / "index", **options)
+
+    for key in ("trace_ids", "offsets"):
+        expected = np.load(index_paths(paths[1], tmp_path / "expected")[key])
+        np.testing.assert_array_equal(np.load(index_paths(paths[1], tmp_path / "index")[key]), expected)
+
+
+def test_trace_index_detects_stale_and_multiline_files(tmp_path, sample_data_extended):
+    """Тест: измененный файл делает индекс устаревшим, а многострочные записи не индексируются."""
+    _, dump_log, _ = sample_data_extended
+    dump_log_path = tmp_path / "dump_log.csv"
+    dump_log.to_csv(dump_log_path, index=False)
+    build_trace_index(dump_log_path, tmp_path)
+    assert index_is_current(dump_log_path, tmp_path)
+
+    dump_log.iloc[:2].to_csv(dump_log_path, index=False)
+    assert not index_is_current(dump_log_path, tmp_path)
+    with pytest.raises(ValueError):
+        TraceIndex(dump_log_path, tmp_path)
+
+    dump_log.loc[0, "message"] = '{"data":\n{}}'
+    dump_log.to_csv(dump_log_path, index=False)
+    with pytest.raises(ValueError):
+        build_trace_index(dump_log_path, tmp_path)
@@ -0,0 +1,41 @@
+import json
+import pandas as pd
+from utils.visualization import CHART_MANIFEST, visualize_mismatches
+
+
+def test_visualize_mismatches_skips_unchanged_charts(tmp_path):
+    """Графики перестраиваются только при изменении их агрегатов."""
+    data = pd.DataFrame(
+        {
+            "side": ["Buy", "Sell", "Buy"],
+            "role": ["Taker", "Maker", "Maker"],
+            "fee_mismatch": [True, False, True],
+        }
+    )
+
+    rendered = visualize_mismatches(data, ["fee_mismatch"], ["side", "role"], output_dir=tmp_path, workers=1)
+    assert len(rendered) == 4, "Для каждого признака строятся гистограмма и тепловая карта."
+    assert all((tmp_path / name).exists() for name in json.loads((tmp_path / CHART_MANIFEST).read_text()))
+
+    assert visualize_mismatches(data, ["fee_mismatch"], ["side", "role"], output_dir=tmp_path, workers=1) == []
+
+    data.loc[2, "role"] = "Taker"
+    rendered = visualize_mismatches(data, ["fee_mismatch"], ["side", "role"], output_dir=tmp_path, workers=1)
+    assert sorted(rendered) == sorted(
+        str(tmp_path / f"fee_mismatch_by_role_{kind}.png") for kind in ("histogram", "heatmap")
+    )
+
+
+def test_visualize_mismatches_removes_charts_without_data(tmp_path):
+    """График, для которого больше нет данных, удаляется вместе с записью в манифесте."""
+    data = pd.DataFrame({"side": ["Buy", "Sell"], "role": ["Taker", "Maker"], "fee_mismatch": [True, False]})
+    visualize_mismatches(data, ["fee_mismatch"], ["side", "role"], output_dir=tmp_path, workers=1)
+
+    assert visualize_mismatches(data.assign(role=None), ["fee_mismatch"], ["side", "role"], output_dir=tmp_path) == []
+
+    assert not list(tmp_path.glob("fee_mismatch_by_role_*.png"))
+    assert len(list(tmp_path.glob("fee_mismatch_by_side_*.png"))) == 2
+    assert sorted(json.loads((tmp_path / CHART_MANIFEST).read_text())) == [
+        "fee_mismatch_by_side_heatmap.png",
+        "fee_mismatch_by_side_histogram.png",
+    ]
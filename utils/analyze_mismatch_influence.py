@@ -1,24 +1,87 @@
 import logging
 
+import pandas as pd
+
+from utils.instrumentation import staged
+
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
 
+@staged("aggregate")
+def build_mismatch_cube(data, mismatch_columns, dimensions):
+    """
+    Строит куб агрегатов расхождений за один проход groupby по всем измерениям.
+    Для каждой ячейки (комбинации значений dimensions) хранятся общее число записей
+    count, а для каждого столбца расхождений — сумма <column>_sum и число непустых
+    значений <column>_valid. Ячейки с пропусками в измерениях сохраняются, поэтому
+    из куба можно получить срезы по любому подмножеству измерений.
+    """
+    grouped = data.groupby(list(dimensions), dropna=False, observed=True, sort=True)
+    cube = grouped.size().to_frame("count")
+    if mismatch_columns:
+        aggregates = grouped[list(mismatch_columns)].agg(["sum", "count"])
+        aggregates.columns = [
+            f"{column}_{'sum' if statistic == 'sum' else 'valid'}" for column, statistic in aggregates.columns
+        ]
+        cube = cube.join(aggregates)
+    return cube
+
+
+def merge_mismatch_cubes(cubes):
+    """
+    Складывает кубы с одинаковыми измерениями (например, построенные по разным дням):
+    все столбцы куба аддитивны, ячейки с пропусками в измерениях сохраняются.
+    Ячейки, у которых после вычитания (negate_mismatch_cube) не осталось строк, отбрасываются.
+    """
+    cubes = list(cubes)
+    merged = pd.concat(cubes)
+    levels = list(range(merged.index.nlevels))
+    merged = merged.groupby(level=levels, dropna=False, sort=True).sum()
+    return merged[merged["count"] != 0]
+
+
+def negate_mismatch_cube(cube):
+    """Куб с обратным знаком: при сложении (merge_mismatch_cubes) он вычитает строки, по которым построен."""
+    return -cube
+
+
+def slice_mismatch_cube(cube, mismatch_column, features):
+    """
+    Сворачивает куб до измерений features и возвращает для mismatch_column
+    count, mismatched_count и proportion (среднее по непустым значениям),
+    отсортированные по mismatched_count, как analyze_mismatch_influence.
+    """
+    features = [features] if isinstance(features, str) else list(features)
+    rolled = cube.groupby(level=features, sort=True)[
+        ["count", f"{mismatch_column}_sum", f"{mismatch_column}_valid"]
+    ].sum()
+    summary = rolled[["count"]].assign(
+        mismatched_count=rolled[f"{mismatch_column}_sum"],
+        proportion=rolled[f"{mismatch_column}_sum"] / rolled[f"{mismatch_column}_valid"],
+    )
+    return summary.reset_index().sort_values(by="mismatched_count", ascending=False)
+
+
+def cube_value_counts(cube, dimension):
+    """Возвращает число записей по значениям измерения, как value_counts()."""
+    counts = cube.groupby(level=dimension, sort=True)["count"].sum()
+    return counts[counts > 0].sort_values(ascending=False, kind="stable")
+
+
+def cube_flag_counts(cube, flag_column):
+    """Возвращает число значений True/False булева столбца расхождений, как value_counts()."""
+    true_count = cube[f"{flag_column}_sum"].sum()
+    counts = {True: true_count, False: cube[f"{flag_column}_valid"].sum() - true_count}
+    return dict(sorted(((key, value) for key, value in counts.items() if value > 0), key=lambda x: -x[1]))
+
+
 def analyze_mismatch_influence(data, mismatch_column, feature_column):
     """
     Анализирует влияние переменной feature_column на расхождения в mismatch_column.
     """
-    summary = (
-        data.groupby(feature_column)[mismatch_column]
-        .agg(
-            count="size",  # Общее количество записей
-            mismatched_count="sum",  # Количество расхождений
-            proportion=lambda x: x.mean(),  # Доля расхождений
-        )
-        .reset_index()
-    )
-    summary = summary.sort_values(by="mismatched_count", ascending=False)
-    return summary
+    cube = build_mismatch_cube(data, [mismatch_column], [feature_column])
+    return slice_mismatch_cube(cube, mismatch_column, feature_column)
 
 
 def save_analysis_results(results, output_dir):
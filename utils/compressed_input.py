@@ -0,0 +1,153 @@
+import gzip
+import io
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # zstandard не обязателен: без него читаются только несжатые и .gz файлы
+    zstandard = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Сжатие входного файла по расширению
+COMPRESSION_SUFFIXES = {".gz": "gzip", ".zst": "zstd"}
+# Распакованных байт за одно чтение фонового потока и число блоков, распакованных впрок
+DECOMPRESS_BLOCK_SIZE = 1 << 20
+DECOMPRESS_QUEUE_BLOCKS = 8
+
+
+def compression_of(path):
+    """Сжатие файла по расширению ("gzip", "zstd") или None для несжатого."""
+    return COMPRESSION_SUFFIXES.get(Path(path).suffix.lower()) if isinstance(path, (str, Path)) else None
+
+
+def is_compressed(path):
+    return compression_of(path) is not None
+
+
+def resolve_input(path):
+    """
+    Путь к входному файлу: сам path, если он есть, иначе его сжатая копия
+    (path.gz, path.zst), если есть она. Для отсутствующих файлов возвращается path.
+    """
+    if Path(path).exists():
+        return path
+    for suffix in COMPRESSION_SUFFIXES:
+        candidate = Path(f"{path}{suffix}")
+        if candidate.exists():
+            return candidate
+    return path
+
+
+def open_decompressed(path):
+    """Открывает файл для чтения с распаковкой в вызывающем потоке (несжатый — как есть)."""
+    compression = compression_of(path)
+    if compression == "gzip":
+        return gzip.open(path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            logging.error(f"Cannot read {path}: the zstandard package is not installed.")
+            raise ImportError("zstandard is required to read .zst inputs")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, "rb"), read_across_frames=True, closefd=True)
+    return open(path, "rb")
+
+
+class BackgroundDecompressor(io.RawIOBase):
+    """
+    Поток распакованных байт сжатого файла. Распаковка идет в отдельном потоке
+    блоками по block_size и опережает чтение не больше чем на queue_blocks блоков.
+    zlib и zstandard отпускают GIL на время распаковки, поэтому она идет параллельно
+    с разбором CSV и сообщений в основном потоке. Ошибка распаковки (битый или
+    обрезанный архив) поднимается при чтении.
+    """
+
+    def __init__(self, path, block_size=DECOMPRESS_BLOCK_SIZE, queue_blocks=DECOMPRESS_QUEUE_BLOCKS):
+        self._source = open_decompressed(path)
+        self._blocks = queue.Queue(queue_blocks)
+        self._stopped = threading.Event()
+        self._block = memoryview(b"")
+        self._finished = False
+        self._thread = threading.Thread(
+            target=self._decompress, args=(block_size,), name=f"decompress-{Path(path).name}", daemon=True
+        )
+        self._thread.start()
+
+    def _decompress(self, block_size):
+        try:
+            while not self._stopped.is_set():
+                block = self._source.read(block_size)
+                self._put(block)
+                if not block:
+                    return
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        # Ожидание с тайм-аутом, чтобы close() мог остановить поток при полной очереди
+        while not self._stopped.is_set():
+            try:
+                self._blocks.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._block:
+            if self._finished:
+                return 0
+            item = self._blocks.get()
+            if isinstance(item, Exception):
+                self._finished = True
+                raise item
+            if not item:
+                self._finished = True
+                return 0
+            self._block = memoryview(item)
+        n = min(len(buffer), len(self._block))
+        buffer[:n] = self._block[:n]
+        self._block = self._block[n:]
+        return n
+
+    def close(self):
+        if not self.closed:
+            self._stopped.set()
+            self._thread.join()
+            self._source.close()
+        super().close()
+
+
+def open_input(path, background=True):
+    """
+    Открывает входной файл как поток байт. Сжатый файл распаковывается на лету,
+    с background=True — в отдельном потоке (BackgroundDecompressor).
+    """
+    if background and is_compressed(path):
+        return io.BufferedReader(BackgroundDecompressor(path), buffer_size=DECOMPRESS_BLOCK_SIZE)
+    return open_decompressed(path)
+
+
+def csv_source(path):
+    """
+    Источник для pd.read_csv: путь несжатого файла или поток с фоновой распаковкой
+    сжатого. Поток (если источник — не path) закрывает вызывающий код.
+    """
+    return open_input(path) if is_compressed(path) else path
+
+
+@contextmanager
+def csv_input(path):
+    """csv_source, закрываемый при выходе из блока with."""
+    source = csv_source(path)
+    try:
+        yield source
+    finally:
+        if source is not path:
+            source.close()
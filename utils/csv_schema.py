@@ -0,0 +1,127 @@
+import csv
+import logging
+
+import pandas as pd
+
+from utils.compressed_input import csv_input
+from utils.file_shards import read_header
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:  # pyarrow не обязателен: без него используется движок pandas
+    pa = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Логические типы схемы и их представление в pandas (движок C). Идентификаторы читаются
+# как UInt64 с пропусками (пустые поля) и сужаются до uint64, если пропусков нет
+PANDAS_DTYPES = {
+    "uint64": "UInt64",
+    "float64": "float64",
+    "category": "category",
+    "string": str,
+    "bool": "boolean",
+}
+
+
+def _arrow_types():
+    """Типы pyarrow для логических типов схемы; категории читаются как словари."""
+    return {
+        "uint64": pa.uint64(),
+        "float64": pa.float64(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
+        "string": pa.string(),
+        "bool": pa.bool_(),
+        "datetime": pa.timestamp("ns"),
+    }
+
+
+def csv_columns(path):
+    """Возвращает имена столбцов CSV-файла по его заголовку."""
+    header = read_header(path).decode("utf-8-sig")
+    return next(csv.reader([header]), [])
+
+
+def _select_columns(path, schema, usecols):
+    """Выбирает столбцы файла для чтения и их логические типы."""
+    header = csv_columns(path)
+    if not header:
+        raise pd.errors.EmptyDataError(f"No columns to parse from file {path}")
+    wanted = set(schema if usecols is None else usecols)
+    columns = [column for column in header if column in wanted]
+    return columns, {column: schema[column] for column in columns if column in schema}
+
+
+def _pandas_options(columns, types):
+    """Параметры pd.read_csv для чтения по схеме движком C."""
+    return {
+        "usecols": columns,
+        "dtype": {column: PANDAS_DTYPES[kind] for column, kind in types.items() if kind in PANDAS_DTYPES},
+        "parse_dates": [column for column, kind in types.items() if kind == "datetime"],
+    }
+
+
+def read_typed_csv(path, schema, usecols=None):
+    """
+    Читает CSV по явной схеме {столбец: логический тип}.
+    Читаются только столбцы из usecols (по умолчанию — вся схема), присутствующие в файле;
+    порядок столбцов — как в файле. Типы: uint64, float64, category, string (текст без
+    разбора, например 18-знаковые суммы), bool и datetime (datetime64[ns]).
+    Если установлен pyarrow, файл читается его CSV-парсером, иначе — движком C pandas.
+    Сжатые файлы (.gz, .zst) распаковываются в отдельном потоке во время разбора.
+    """
+    columns, types = _select_columns(path, schema, usecols)
+
+    with csv_input(path) as source:
+        return _read_typed_source(source, columns, types)
+
+
+def _read_typed_source(source, columns, types):
+    if pa is not None:
+        arrow_types = _arrow_types()
+        table = pa_csv.read_csv(
+            source,
+            convert_options=pa_csv.ConvertOptions(
+                column_types={column: arrow_types[kind] for column, kind in types.items()},
+                include_columns=columns,
+                strings_can_be_null=True,
+            ),
+        )
+        df = table.to_pandas(types_mapper={pa.bool_(): pd.BooleanDtype(), pa.uint64(): pd.UInt64Dtype()}.get)
+        # pyarrow упорядочивает категории по первому появлению, pandas — по значению;
+        # сортируем, чтобы группировки по категориям шли в том же порядке, что и раньше
+        for column in df.select_dtypes(include="category").columns:
+            df[column] = df[column].cat.reorder_categories(sorted(df[column].cat.categories))
+        return narrow_ids(df)
+
+    return narrow_ids(pd.read_csv(source, **_pandas_options(columns, types)))
+
+
+def narrow_ids(df):
+    """Приводит столбцы UInt64 без пропусков к uint64; столбцы с пустыми идентификаторами остаются UInt64."""
+    for column in df.select_dtypes(include="UInt64").columns:
+        if not df[column].hasnans:
+            df[column] = df[column].astype("uint64")
+    return df
+
+
+def read_typed_csv_chunks(path, schema, usecols=None, chunksize=100_000):
+    """Потоково читает CSV по схеме частями по chunksize строк (движком C pandas)."""
+    columns, types = _select_columns(path, schema, usecols)
+    return _read_chunks(path, chunksize, _pandas_options(columns, types))
+
+
+def _read_chunks(path, chunksize, options):
+    # Генератор: сжатый файл закрывается (и фоновый поток останавливается) после последней части
+    with csv_input(path) as source:
+        for chunk in pd.read_csv(source, chunksize=chunksize, **options):
+            yield narrow_ids(chunk)
+
+
+def memory_per_row(df):
+    """Объем памяти DataFrame в байтах на строку (с учетом строковых объектов)."""
+    if df.empty:
+        return 0.0
+    return df.memory_usage(deep=True).sum() / len(df)
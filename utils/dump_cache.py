@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow не обязателен: без него кэш отключается
+    pa = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+CACHE_FORMAT_VERSION = 3
+ROW_GROUP_SIZE = 1_000_000
+
+
+def cache_available():
+    """Проверяет, установлен ли pyarrow, необходимый для кэша."""
+    return pa is not None
+
+
+def cache_paths(source_path, cache_dir):
+    """Возвращает пути к Parquet-файлу кэша и к его метаданным."""
+    stem = Path(source_path).name
+    return Path(cache_dir) / f"{stem}.parquet", Path(cache_dir) / f"{stem}.meta.json"
+
+
+def file_hash(path):
+    """Вычисляет sha256 содержимого файла."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def source_fingerprint(path, with_hash=True):
+    """Собирает размер, mtime и (опционально) хеш исходного файла."""
+    stat = os.stat(path)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        fingerprint["sha256"] = file_hash(path)
+    return fingerprint
+
+
+def is_cache_valid(source_path, meta):
+    """
+    Кэш действителен, если совпадают размер и mtime исходного файла.
+    При изменившемся mtime и том же размере сравнивается хеш содержимого.
+    """
+    if meta.get("version") != CACHE_FORMAT_VERSION:
+        return False
+    current = source_fingerprint(source_path, with_hash=False)
+    if current["size"] != meta["source"]["size"]:
+        return False
+    if current["mtime_ns"] == meta["source"]["mtime_ns"]:
+        return True
+    return file_hash(source_path) == meta["source"]["sha256"]
+
+
+def load_cached_dump(source_path, cache_dir, trace_ids=None):
+    """
+    Загружает разобранные записи dump_log из кэша через memory map.
+    Возвращает None, если кэша нет или он устарел.
+    """
+    if not cache_available():
+        return None
+
+    parquet_path, meta_path = cache_paths(source_path, cache_dir)
+    if not parquet_path.exists() or not meta_path.exists():
+        return None
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if not is_cache_valid(source_path, meta):
+        logging.info(f"Cache {parquet_path} is stale, rebuilding.")
+        return None
+
+    mtime_ns = os.stat(source_path).st_mtime_ns
+    if meta["source"]["mtime_ns"] != mtime_ns:
+        # Содержимое не изменилось (совпал хеш): запоминаем новый mtime, чтобы не хешировать повторно
+        meta["source"]["mtime_ns"] = mtime_ns
+        with open(meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    filters = None
+    if trace_ids is not None:
+        # Данные отсортированы по trace_id, поэтому фильтр отбрасывает лишние row group по статистике.
+        # Тип задан явно: без него pyarrow выводит int64 и не принимает trace_id >= 2**63
+        values = np.unique(np.asarray(trace_ids, dtype=np.uint64))
+        filters = pc.field("trace_id").isin(pa.array(values, type=pa.uint64()))
+    table = pq.read_table(parquet_path, memory_map=True, filters=filters)
+    logging.info(f"Loaded {table.num_rows} dump entries from cache {parquet_path}")
+    return table.to_pandas()
+
+
+def write_dump_cache(dump_entries, source_path, cache_dir, fingerprint=None):
+    """
+    Сохраняет разобранные записи dump_log в Parquet, отсортированные по trace_id.
+    Сортировка устойчивая, поэтому порядок сообщений внутри trace_id не меняется.
+    fingerprint должен быть снят с исходного файла до его чтения.
+    """
+    if not cache_available():
+        logging.warning("pyarrow is not installed, dump_log cache is disabled.")
+        return None
+
+    parquet_path, meta_path = cache_paths(source_path, cache_dir)
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+
+    dump_entries = dump_entries.sort_values("trace_id", kind="stable")
+    # Parquet не хранит смешанные типы: нестроковые значения валют приводим к строкам
+    for column in dump_entries.select_dtypes(include="object").columns:
+        values = dump_entries[column]
+        dump_entries[column] = values.where(values.isna(), values.astype(str))
+    table = pa.Table.from_pandas(dump_entries, preserve_index=False)
+    pq.write_table(table, parquet_path, row_group_size=ROW_GROUP_SIZE)
+
+    meta = {
+        "version": CACHE_FORMAT_VERSION,
+        "source": fingerprint or source_fingerprint(source_path),
+        "rows": len(dump_entries),
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    logging.info(f"Dump cache saved to {parquet_path}")
+    return parquet_path
@@ -0,0 +1,95 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from utils.csv_schema import read_typed_csv
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Валюта, в которую пересчитываются все комиссии
+COST_CURRENCY = "USDT"
+# Таблица цен: цена единицы asset в COST_CURRENCY, действующая с момента time
+PRICE_TABLE_SCHEMA = {
+    "time": "datetime",
+    "asset": "string",
+    "price": "float64",
+}
+PRICE_COLUMNS = list(PRICE_TABLE_SCHEMA)
+
+
+def load_price_table(path):
+    """Загружает таблицу цен из CSV со столбцами PRICE_TABLE_SCHEMA."""
+    prices = read_typed_csv(path, PRICE_TABLE_SCHEMA)
+    missing = [column for column in PRICE_COLUMNS if column not in prices.columns]
+    if missing:
+        raise ValueError(f"Price table is missing columns: {missing}")
+    logging.info(f"Loaded {len(prices)} prices for {prices['asset'].nunique()} assets from {path}")
+    return prices
+
+
+def trade_prices(own_trade_log, currency=COST_CURRENCY):
+    """
+    Цены базовых активов, известные из самих сделок: сделка по паре X_USDT
+    дает цену X в USDT на момент сделки.
+    """
+    if "platform_time" not in own_trade_log.columns:
+        return pd.DataFrame(columns=PRICE_COLUMNS)
+    price = pd.to_numeric(own_trade_log["price"], errors="coerce")
+    quoted = (own_trade_log["quote_asset_name"].astype(object) == currency).to_numpy() & (price > 0).to_numpy()
+    return pd.DataFrame(
+        {
+            "time": own_trade_log["platform_time"].to_numpy()[quoted],
+            "asset": own_trade_log["base_asset_name"].astype(object).to_numpy()[quoted],
+            "price": price.to_numpy()[quoted],
+        }
+    )
+
+
+def combine_prices(*tables):
+    """Объединяет таблицы цен в одну, отсортированную по времени (порядок при равенстве сохраняется)."""
+    tables = [table[PRICE_COLUMNS] for table in tables if table is not None and not table.empty]
+    if not tables:
+        return pd.DataFrame(columns=PRICE_COLUMNS)
+    prices = pd.concat(tables, ignore_index=True)
+    prices["time"] = pd.to_datetime(prices["time"])
+    prices["asset"] = prices["asset"].astype(object)
+    prices = prices.dropna()
+    return prices.sort_values("time", kind="stable").reset_index(drop=True)
+
+
+def convert_to_currency(amounts, assets, times, prices, currency=COST_CURRENCY, tolerance=None):
+    """
+    Пересчитывает суммы в валюте assets в currency по последней известной на момент
+    times цене (as-of join). Активы кодируются целыми номерами, и поиск для всех
+    строк — один merge_asof по отсортированным по времени массивам.
+    Суммы в самой currency не пересчитываются; без цены результат — NaN.
+    """
+    amounts = pd.to_numeric(pd.Series(amounts, dtype=object), errors="coerce").to_numpy(dtype=float)
+    assets = pd.Series(assets, dtype=object).to_numpy()
+    times = pd.to_datetime(pd.Series(times)).to_numpy()
+    rates = np.where(assets == currency, 1.0, np.nan)
+
+    levels = pd.Index(prices["asset"].unique())
+    codes = levels.get_indexer(assets)
+    lookup = np.flatnonzero((codes >= 0) & ~np.isnat(times) & np.isnan(rates))
+    if lookup.size:
+        left = pd.DataFrame({"time": times[lookup], "code": codes[lookup], "row": lookup})
+        right = pd.DataFrame({"time": prices["time"].to_numpy(), "code": levels.get_indexer(prices["asset"])})
+        right["price"] = prices["price"].to_numpy(dtype=float)
+        matched = pd.merge_asof(
+            left.sort_values("time", kind="stable"),
+            right,
+            on="time",
+            by="code",
+            direction="backward",
+            tolerance=pd.Timedelta(tolerance) if tolerance is not None else None,
+        )
+        rates[matched["row"].to_numpy()] = matched["price"].to_numpy()
+
+    missing = np.isnan(rates) & ~np.isnan(amounts)
+    if missing.any():
+        unpriced = pd.unique(assets[missing])
+        logging.warning(f"No {currency} price for {missing.sum()} fees in assets {list(unpriced[:10])}")
+    return amounts * rates
@@ -0,0 +1,112 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from utils.csv_schema import read_typed_csv
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+FEE_SCHEDULE_KEYS = ["instrument_name", "role", "account_name", "gt_discount"]
+FEE_SCHEDULE_SCHEMA = {
+    "instrument_name": "string",
+    "role": "string",
+    "account_name": "string",
+    "gt_discount": "bool",
+    "fee_rate": "float64",
+}
+# Значение instrument_name или account_name, подходящее для любого инструмента/аккаунта
+WILDCARD = "*"
+# Порядок поиска: (точный инструмент?, точный аккаунт?) — более точные строки имеют приоритет
+LOOKUP_ORDER = [(True, True), (True, False), (False, True), (False, False)]
+
+
+def _key_codes(levels, values, size):
+    """
+    Переводит значения ключа в номера в levels (-1 — значения нет в таблице).
+    Для категориальных столбцов ищутся только категории, а не каждая строка.
+    """
+    if values is None:
+        return np.full(size, -1, dtype=np.int64)
+    if isinstance(values, pd.Series):
+        values = values.array
+    if isinstance(values, pd.Categorical):
+        category_codes = levels.get_indexer(values.categories.astype(object))
+        return np.where(values.codes >= 0, category_codes[values.codes], -1).astype(np.int64)
+    return levels.get_indexer(np.asarray(values, dtype=object)).astype(np.int64)
+
+
+class FeeSchedule:
+    """
+    Таблица ожидаемых ставок комиссии (в процентах от объема сделки, как platform_fee_rate),
+    заданных по инструменту, роли, аккаунту и признаку оплаты комиссии в GT.
+    Каждый ключ кодируется номерами значений в одно целое число, поэтому поиск для пачки
+    сделок — хешированный get_indexer по int64 за O(1) на строку, без обхода строк в Python.
+    """
+
+    def __init__(self, table):
+        missing = [column for column in FEE_SCHEDULE_SCHEMA if column not in table.columns]
+        if missing:
+            raise ValueError(f"Fee schedule is missing columns: {missing}")
+        self.levels = {
+            column: pd.Index(table[column].astype(object).unique()) for column in FEE_SCHEDULE_KEYS[:-1]
+        }
+        codes = [
+            _key_codes(self.levels[column], table[column].astype(object), len(table))
+            for column in FEE_SCHEDULE_KEYS[:-1]
+        ]
+        keys = self._combine(*codes, table["gt_discount"].astype(bool).to_numpy())
+        self.index = pd.Index(keys)
+        if self.index.has_duplicates:
+            duplicates = table[self.index.duplicated()][FEE_SCHEDULE_KEYS].drop_duplicates()
+            raise ValueError(f"Duplicate fee schedule keys: {duplicates.head().to_dict('records')}")
+        self.rates = table["fee_rate"].to_numpy(dtype=float)
+
+    def __len__(self):
+        return len(self.rates)
+
+    def _combine(self, instruments, roles, accounts, gt_discounts):
+        """Собирает номера значений ключа в одно число; -1, если какого-то значения нет в таблице."""
+        sizes = [len(self.levels[column]) for column in FEE_SCHEDULE_KEYS[:-1]]
+        keys = ((instruments * sizes[1] + roles) * sizes[2] + accounts) * 2 + gt_discounts.astype(np.int64)
+        return np.where((instruments < 0) | (roles < 0) | (accounts < 0), -1, keys)
+
+    def expected_rates(self, instruments, roles, accounts, gt_discounts):
+        """
+        Возвращает ожидаемую ставку для каждой сделки (NaN, если подходящей строки нет).
+        instruments и accounts могут быть None — тогда подходят только строки с WILDCARD.
+        """
+        size = len(roles)
+        gt_discounts = np.asarray(gt_discounts, dtype=bool)
+        roles = _key_codes(self.levels["role"], roles, size)
+        exact_codes = {
+            "instrument_name": _key_codes(self.levels["instrument_name"], instruments, size),
+            "account_name": _key_codes(self.levels["account_name"], accounts, size),
+        }
+        wildcard_codes = {
+            column: np.full(size, self.levels[column].get_indexer([WILDCARD])[0], dtype=np.int64)
+            for column in exact_codes
+        }
+
+        rates = np.full(size, np.nan)
+        unmatched = np.ones(size, dtype=bool)
+        for exact_instrument, exact_account in LOOKUP_ORDER:
+            rows = np.flatnonzero(unmatched)
+            if rows.size == 0:
+                break
+            instrument_codes = (exact_codes if exact_instrument else wildcard_codes)["instrument_name"]
+            account_codes = (exact_codes if exact_account else wildcard_codes)["account_name"]
+            keys = self._combine(instrument_codes[rows], roles[rows], account_codes[rows], gt_discounts[rows])
+            positions = self.index.get_indexer(keys)
+            found = (keys >= 0) & (positions >= 0)
+            rates[rows[found]] = self.rates[positions[found]]
+            unmatched[rows[found]] = False
+        return rates
+
+
+def load_fee_schedule(path):
+    """Загружает таблицу ставок из CSV со столбцами FEE_SCHEDULE_SCHEMA."""
+    schedule = FeeSchedule(read_typed_csv(path, FEE_SCHEDULE_SCHEMA))
+    logging.info(f"Loaded {len(schedule)} fee schedule rows from {path}")
+    return schedule
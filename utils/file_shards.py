@@ -0,0 +1,88 @@
+import io
+import os
+
+from utils.compressed_input import open_input
+
+
+def read_header(path):
+    """Возвращает строку заголовка CSV-файла в байтах (вместе с переводом строки), сжатого — после распаковки."""
+    with open_input(path, background=False) as f:
+        return f.readline()
+
+
+def split_into_shards(path, n_shards):
+    """
+    Делит CSV-файл на непересекающиеся байтовые диапазоны (start, end) по границам строк.
+    Заголовок в диапазоны не входит. Предполагается, что записи не содержат переводов
+    строк внутри полей (сообщения dump_log однострочные).
+    """
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        data_start = len(f.readline())
+        boundaries = [data_start]
+        step = max((size - data_start) // max(n_shards, 1), 1)
+        for i in range(1, n_shards):
+            target = data_start + i * step
+            if target >= size:
+                break
+            # Граница — начало первой строки, начинающейся не раньше target
+            f.seek(target - 1)
+            f.readline()
+            boundaries.append(f.tell())
+        boundaries.append(size)
+
+    boundaries = sorted(set(boundaries))
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+
+class ByteRangeReader(io.RawIOBase):
+    """Файловый объект, отдающий prefix, а затем байты файла из диапазона [start, end)."""
+
+    def __init__(self, path, start, end, prefix=b""):
+        self._file = open(path, "rb")
+        self._file.seek(start)
+        self._remaining = end - start
+        self._prefix = prefix
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self._prefix:
+            n = min(len(buffer), len(self._prefix))
+            buffer[:n] = self._prefix[:n]
+            self._prefix = self._prefix[n:]
+            return n
+        if self._remaining <= 0:
+            return 0
+        view = memoryview(buffer)[: min(len(buffer), self._remaining)]
+        n = self._file.readinto(view)
+        self._remaining -= n
+        return n
+
+    def close(self):
+        self._file.close()
+        super().close()
+
+
+def open_byte_range(path, start, end, with_header=True):
+    """Открывает диапазон байтов CSV-файла как буферизованный поток, при необходимости с заголовком."""
+    prefix = read_header(path) if with_header else b""
+    return io.BufferedReader(ByteRangeReader(path, start, end, prefix))
+
+
+def complete_lines_end(path, block_size=1 << 16):
+    """
+    Возвращает позицию сразу после последнего перевода строки в файле.
+    Незавершенная последняя строка (файл еще дописывается) в диапазон не попадает.
+    """
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        while pos > 0:
+            step = min(block_size, pos)
+            f.seek(pos - step)
+            newline = f.read(step).rfind(b"\n")
+            if newline >= 0:
+                return pos - step + newline + 1
+            pos -= step
+    return 0
@@ -0,0 +1,140 @@
+from decimal import Decimal, InvalidOperation
+
+import numpy as np
+import pandas as pd
+
+
+FIXED_POINT_DECIMALS = 18
+# Строки обрабатываются блоками, чтобы ограничить объем промежуточных массивов
+FIXED_POINT_BLOCK_SIZE = 100_000
+
+_POWERS = 10 ** np.arange(FIXED_POINT_DECIMALS + 1, dtype=np.int64)
+
+
+def _decimal_fallback(value, decimals):
+    """Медленный путь через Decimal для строк не в простом виде (например, 1e-05)."""
+    try:
+        scaled = Decimal(str(value)).scaleb(decimals)
+    except (InvalidOperation, ValueError):
+        return None
+    if not scaled.is_finite() or scaled != scaled.to_integral_value():
+        return None
+    units, fraction = divmod(abs(int(scaled)), 10**decimals)
+    if units >= 10**decimals:
+        return None
+    sign = -1 if scaled < 0 else 1
+    return sign * units, sign * fraction
+
+
+def _digits_to_int(digits, valid, decimals):
+    """
+    Переводит строки не длиннее decimals цифр в int64. Строки дополняются нулями слева
+    до фиксированной ширины, после чего коды символов сворачиваются со степенями десяти —
+    это в разы быстрее поэлементного astype(int). Невалидные строки дают 0.
+    """
+    digits = np.strings.rjust(np.where(valid, digits, ""), decimals, "0").astype(f"U{decimals}")
+    codes = digits.view(np.uint32).reshape(len(digits), decimals)
+    return (codes.astype(np.int64) - ord("0")) @ _POWERS[decimals - 1 :: -1][:decimals]
+
+
+def _parse_block(text, decimals):
+    """Векторно разбирает блок строк вида [-]123.456 в целую и дробную части."""
+    negative = np.strings.startswith(text, "-")
+    body = np.where(negative | np.strings.startswith(text, "+"), np.strings.slice(text, 1, None), text)
+    length = np.strings.str_len(body)
+    dot = np.strings.find(body, ".")
+    dot = np.where(dot < 0, length, dot)
+
+    int_digits = np.strings.slice(body, 0, dot)
+    frac_digits = np.strings.slice(body, dot + 1, length)
+    int_length = np.strings.str_len(int_digits)
+    frac_length = np.strings.str_len(frac_digits)
+
+    valid = (
+        ((int_length == 0) | np.strings.isdigit(int_digits))
+        & ((frac_length == 0) | np.strings.isdigit(frac_digits))
+        & (int_length + frac_length > 0)
+        & (int_length <= decimals)
+        & (frac_length <= decimals)
+    )
+    units = _digits_to_int(int_digits, valid, decimals)
+    fraction = _digits_to_int(np.strings.ljust(frac_digits, decimals, "0"), valid, decimals)
+    sign = np.where(negative, -1, 1)
+    return sign * units, sign * fraction, valid
+
+
+def to_fixed_point(values, decimals=FIXED_POINT_DECIMALS):
+    """
+    Переводит десятичные строки в целочисленный вид без потери точности.
+    Возвращает (units, fraction, valid): value = units + fraction / 10**decimals,
+    у отрицательных чисел обе части отрицательны. Пустые и некорректные значения
+    помечаются valid=False.
+    """
+    series = pd.Series(values, dtype=object)
+    present = series.notna().to_numpy()
+    text = np.strings.strip(series.where(present, "").to_numpy().astype(str))
+
+    units = np.zeros(len(text), dtype=np.int64)
+    fraction = np.zeros(len(text), dtype=np.int64)
+    valid = np.zeros(len(text), dtype=bool)
+    for start in range(0, len(text), FIXED_POINT_BLOCK_SIZE):  # range пуст для пустого входа
+        block = slice(start, start + FIXED_POINT_BLOCK_SIZE)
+        units[block], fraction[block], valid[block] = _parse_block(text[block], decimals)
+
+    # Строки в экспоненциальной записи и т.п. разбираем через Decimal
+    for i in np.flatnonzero(present & ~valid):
+        parsed = _decimal_fallback(text[i], decimals)
+        if parsed is not None:
+            units[i], fraction[i] = parsed
+            valid[i] = True
+
+    valid &= present
+    return units, fraction, valid
+
+
+def fixed_point_equal(left, right, decimals=FIXED_POINT_DECIMALS):
+    """Поэлементно сравнивает два столбца десятичных строк точно; пустые значения не равны ничему."""
+    left_units, left_fraction, left_valid = to_fixed_point(left, decimals)
+    right_units, right_fraction, right_valid = to_fixed_point(right, decimals)
+    return left_valid & right_valid & (left_units == right_units) & (left_fraction == right_fraction)
+
+
+def format_fixed_point(units, fraction, decimals=FIXED_POINT_DECIMALS):
+    """
+    Записывает числа units + fraction / 10**decimals (fraction в [0, 10**decimals),
+    units округлены вниз) десятичными строками с decimals знаками после точки.
+    """
+    units = np.asarray(units, dtype=np.int64)
+    fraction = np.asarray(fraction, dtype=np.int64)
+    negative = units < 0
+    # Для отрицательных чисел переходим к модулю: -(units + fraction) = (-units - 1) + (1 - fraction)
+    borrow = negative & (fraction > 0)
+    int_part = np.where(negative, -units - borrow, units)
+    frac_part = np.where(borrow, 10**decimals - fraction, fraction)
+    text = np.strings.add(np.where(negative, "-", ""), int_part.astype(str))
+    if decimals:
+        text = np.strings.add(np.strings.add(text, "."), np.strings.zfill(frac_part.astype(str), decimals))
+    return text.astype(object)
+
+
+def sum_fixed_point(values, groups, decimals=FIXED_POINT_DECIMALS):
+    """
+    Точно суммирует десятичные строки values по группам groups.
+    Дробная часть делится на две половины разрядов, которые суммируются в int64
+    отдельно, поэтому переполнения нет даже при миллиардах слагаемых в группе.
+    Возвращает Series сумм в текстовом виде, индексированную значениями groups;
+    группа без единого корректного значения дает None.
+    """
+    units, fraction, valid = to_fixed_point(values, decimals)
+    half = 10 ** (decimals // 2)
+    high, low = np.divmod(np.where(valid, fraction, 0), half)
+    sums = (
+        pd.DataFrame({"units": np.where(valid, units, 0), "high": high, "low": low, "valid": valid})
+        .groupby(np.asarray(groups), sort=False)
+        .sum()
+    )
+
+    carry, low = np.divmod(sums["low"].to_numpy(), half)
+    carry, high = np.divmod(sums["high"].to_numpy() + carry, 10**decimals // half)
+    total = format_fixed_point(sums["units"].to_numpy() + carry, high * half + low, decimals)
+    return pd.Series(np.where(sums["valid"].to_numpy() > 0, total, None), index=sums.index, dtype=object)
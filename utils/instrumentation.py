@@ -0,0 +1,414 @@
+import functools
+import json
+import logging
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # resource есть только в Unix: без него нет пикового RSS и CPU дочерних процессов
+    resource = None
+
+try:
+    import pyinstrument
+except ImportError:  # pyinstrument не обязателен: без него доступен только cProfile
+    pyinstrument = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+PROFILERS = ("cprofile", "pyinstrument")
+PROFILE_DIR = "output/.profile"
+METRIC_PREFIX = "fee_analysis_stage"
+# Метрики Prometheus: имя, поле записи этапа, тип и описание
+PROMETHEUS_METRICS = [
+    ("calls_total", "calls", "counter", "Number of times the stage ran"),
+    ("wall_seconds", "wall_seconds", "gauge", "Wall clock time spent in the stage"),
+    ("cpu_seconds", "cpu_seconds", "gauge", "CPU time of the process and its finished children in the stage"),
+    ("rows_in", "rows_in", "gauge", "Rows passed into the stage"),
+    ("rows_out", "rows_out", "gauge", "Rows produced by the stage"),
+    (
+        "process_peak_rss_bytes",
+        "process_peak_rss_bytes",
+        "gauge",
+        "Peak RSS of the process so far (ru_maxrss) when the stage finished, not a peak of the stage itself",
+    ),
+    (
+        "rss_growth_bytes",
+        "rss_growth_bytes",
+        "gauge",
+        "Largest rise of the process peak RSS during one run of the stage (0 if it stayed below an earlier peak)",
+    ),
+    ("heap_peak_bytes", "heap_peak_bytes", "gauge", "Peak traced Python/NumPy allocations above the stage start"),
+]
+
+
+def count_rows(value):
+    """Число строк DataFrame, Series или массива; для кортежа таблиц — сумма, для списка — длина."""
+    if hasattr(value, "shape"):
+        return int(value.shape[0]) if value.shape else None
+    if isinstance(value, (list, tuple)):
+        if value and all(hasattr(item, "shape") for item in value):
+            return sum(count_rows(item) for item in value)
+        return len(value)
+    return None
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss — в КБ в Linux и в байтах в macOS
+    return max(own, children) * (1 if sys.platform == "darwin" else 1024)
+
+
+def _cpu_seconds():
+    """CPU-время процесса (всех потоков) и его завершившихся дочерних процессов (пулы воркеров)."""
+    if resource is None:
+        return time.process_time()
+    own, children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+class StageRun:
+    """Открытый запуск этапа; rows_out задается кодом этапа."""
+
+    __slots__ = ("name", "rows_in", "rows_out")
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+
+
+class StageRecorder:
+    """
+    Накапливает метрики этапов за запуск процесса. Этапы могут быть вложенными:
+    ключ записи — путь этапа ("load/filter"). Повторные запуски этапа (например,
+    по частям файла) суммируются: время и строки складываются, память — максимум.
+    ru_maxrss — пик процесса с его запуска, поэтому process_peak_rss_bytes этапа — пик
+    процесса к концу этапа, а не пик самого этапа; вклад этапа оценивает rss_growth_bytes
+    (рост пика) или, с trace_memory, heap_peak_bytes. Этапы в процессах пула записываются
+    только через collect в воркере и merge в родителе.
+    """
+
+    def __init__(self):
+        self.profiler = None
+        self.profile_dir = PROFILE_DIR
+        self.profile_stages = None
+        self.trace_memory = False
+        self._started_tracing = False
+        self.reset()
+
+    def reset(self):
+        self.started = time.time()
+        self.records = {}
+        self._profiles = {}
+        self._stack = []
+
+    def configure(self, profiler=None, profile_dir=PROFILE_DIR, profile_stages=None, trace_memory=False):
+        """
+        Включает профилировщик этапов: cProfile (детерминированный) или pyinstrument
+        (сэмплирующий). По умолчанию профилируются только внешние этапы, иначе — этапы
+        с именами из profile_stages. trace_memory включает tracemalloc для точного пика
+        выделенной памяти каждого этапа (заметно замедляет работу).
+        """
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler!r}, expected one of {PROFILERS}")
+        if profiler == "pyinstrument" and pyinstrument is None:
+            raise ImportError("pyinstrument is not installed; use --profile cprofile")
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.profile_stages = set(profile_stages) if profile_stages else None
+        self.trace_memory = trace_memory
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        elif not trace_memory and self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _profiled(self, name):
+        if self.profiler is None or any(frame["profiled"] for frame in self._stack):
+            return False
+        return name in self.profile_stages if self.profile_stages is not None else not self._stack
+
+    def _start_profile(self, path):
+        profile = self._profiles.get(path)
+        if profile is None:
+            if self.profiler == "cprofile":
+                import cProfile
+
+                profile = cProfile.Profile()
+            else:
+                profile = pyinstrument.Profiler()
+            self._profiles[path] = profile
+        if self.profiler == "cprofile":
+            profile.enable()
+        else:
+            profile.start()
+
+    def _stop_profile(self, path):
+        """Останавливает профилировщик и перезаписывает файл накопленным профилем этапа."""
+        profile = self._profiles[path]
+        Path(self.profile_dir).mkdir(parents=True, exist_ok=True)
+        output = Path(self.profile_dir) / path.replace("/", ".")
+        if self.profiler == "cprofile":
+            profile.disable()
+            output = output.with_suffix(".prof")
+            profile.dump_stats(output)
+        else:
+            profile.stop()
+            output = output.with_suffix(".html")
+            output.write_text(profile.output_html())
+        return str(output)
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Замеряет блок кода как этап name; возвращает StageRun для задания rows_out."""
+        path = "/".join([frame["path"] for frame in self._stack[-1:]] + [name])
+        run = StageRun(name, rows_in)
+        frame = {"path": path, "profiled": self._profiled(name), "heap_peak": 0}
+        if self.trace_memory:
+            # Пик tracemalloc общий: сохраняем пик внешнего этапа до сброса и учитываем его при выходе
+            heap_start, heap_peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                self._stack[-1]["heap_peak"] = max(self._stack[-1]["heap_peak"], heap_peak)
+            tracemalloc.reset_peak()
+            frame["heap_start"] = heap_start
+        self._stack.append(frame)
+        if path not in self.records:
+            # Запись создается при входе, чтобы отчет шел в порядке запуска этапов
+            self.records[path] = self._new_record(path, name)
+        rss_before, cpu_start, wall_start = _peak_rss_bytes(), _cpu_seconds(), time.perf_counter()
+        if frame["profiled"]:
+            self._start_profile(path)
+        try:
+            yield run
+        finally:
+            profile_path = self._stop_profile(path) if frame["profiled"] else None
+            wall, cpu = time.perf_counter() - wall_start, _cpu_seconds() - cpu_start
+            self._stack.pop()
+            heap_peak = None
+            if self.trace_memory:
+                heap_peak = max(frame["heap_peak"], tracemalloc.get_traced_memory()[1])
+                if self._stack:
+                    self._stack[-1]["heap_peak"] = max(self._stack[-1]["heap_peak"], heap_peak)
+                heap_peak -= frame["heap_start"]
+            self._record(path, run, wall, cpu, rss_before, heap_peak, profile_path)
+
+    @staticmethod
+    def _new_record(path, name):
+        return {
+            "stage": path,
+            "name": name,
+            "parent": path.rpartition("/")[0] or None,
+            "calls": 0,
+            "wall_seconds": 0.0,
+            "cpu_seconds": 0.0,
+            "rows_in": None,
+            "rows_out": None,
+            "process_peak_rss_bytes": None,
+            "rss_growth_bytes": None,
+            "heap_peak_bytes": None,
+            "profile": None,
+        }
+
+    def _record(self, path, run, wall, cpu, rss_before, heap_peak, profile_path):
+        peak_rss = _peak_rss_bytes()
+        record = self.records[path]
+        record["calls"] += 1
+        record["wall_seconds"] += wall
+        record["cpu_seconds"] += cpu
+        for key, value in (("rows_in", run.rows_in), ("rows_out", run.rows_out)):
+            if value is not None:
+                record[key] = (record[key] or 0) + int(value)
+        if peak_rss is not None:
+            record["process_peak_rss_bytes"] = peak_rss
+            record["rss_growth_bytes"] = max(record["rss_growth_bytes"] or 0, peak_rss - rss_before)
+        if heap_peak is not None:
+            record["heap_peak_bytes"] = max(record["heap_peak_bytes"] or 0, heap_peak)
+        if profile_path is not None:
+            record["profile"] = profile_path
+
+    def collect(self, function, *args, **kwargs):
+        """
+        Выполняет function в процессе пула и возвращает (результат, записи ее этапов) для merge
+        в родителе. При fork воркер наследует записи и стек родителя, поэтому они сбрасываются;
+        профилировщик в воркерах не запускается.
+        """
+        self.reset()
+        self.profiler = None
+        result = function(*args, **kwargs)
+        return result, list(self.records.values())
+
+    def merge(self, records):
+        """
+        Добавляет записи этапов воркера (см. collect) под путь текущего этапа. Вызовы, время
+        и строки складываются, память — максимум по процессам: process_peak_rss_bytes такой
+        записи — пик самого воркера.
+        """
+        prefix = self._stack[-1]["path"] if self._stack else None
+        for worker_record in records:
+            path = f"{prefix}/{worker_record['stage']}" if prefix else worker_record["stage"]
+            if path not in self.records:
+                self.records[path] = self._new_record(path, worker_record["name"])
+            record = self.records[path]
+            for key in ("calls", "wall_seconds", "cpu_seconds"):
+                record[key] += worker_record[key]
+            for key in ("rows_in", "rows_out"):
+                if worker_record[key] is not None:
+                    record[key] = (record[key] or 0) + worker_record[key]
+            for key in ("process_peak_rss_bytes", "rss_growth_bytes", "heap_peak_bytes"):
+                if worker_record[key] is not None:
+                    record[key] = max(record[key] or 0, worker_record[key])
+
+    def report(self, job=None):
+        """Отчет о запуске: параметры процесса и записи этапов в порядке первого запуска."""
+        return {
+            "job": job,
+            "started_at": datetime.fromtimestamp(self.started, timezone.utc).isoformat(),
+            "wall_seconds": round(time.time() - self.started, 6),
+            "pid": os.getpid(),
+            "argv": sys.argv,
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "stages": [
+                {key: round(value, 6) if isinstance(value, float) else value for key, value in record.items()}
+                for record in self.records.values()
+            ],
+        }
+
+
+# Общий регистратор процесса: этапы в разных модулях пишут в один отчет
+RECORDER = StageRecorder()
+
+
+def stage(name, rows_in=None):
+    """Контекстный менеджер этапа общего регистратора (см. StageRecorder.stage)."""
+    return RECORDER.stage(name, rows_in)
+
+
+def staged(name):
+    """
+    Декоратор этапа: rows_in — строки первого аргумента, rows_out — строки результата
+    (см. count_rows); аргументы без строк (например, пути файлов) не учитываются.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with RECORDER.stage(name, count_rows(args[0]) if args else None) as run:
+                result = function(*args, **kwargs)
+                run.rows_out = count_rows(result)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def collect_stages(function, *args, **kwargs):
+    """Выполняет function в воркере пула и возвращает (результат, записи этапов) (см. StageRecorder.collect)."""
+    return RECORDER.collect(function, *args, **kwargs)
+
+
+def merge_stages(records):
+    """Добавляет записи этапов воркера под текущий этап общего регистратора (см. StageRecorder.merge)."""
+    RECORDER.merge(records)
+
+
+def configure(**options):
+    RECORDER.configure(**options)
+
+
+def reset():
+    RECORDER.reset()
+
+
+def _atomic_write(path, text):
+    """Пишет файл через временный и переименование, чтобы читатель не увидел его частично."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_name(f".{path.name}.tmp")
+    temp_path.write_text(text)
+    os.replace(temp_path, path)
+
+
+def write_run_report(output_file, job=None):
+    """Сохраняет отчет о запуске в JSON."""
+    report = RECORDER.report(job)
+    _atomic_write(output_file, json.dumps(report, indent=2))
+    logging.info(f"Run report ({len(report['stages'])} stages) saved to {output_file}")
+    return report
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_prometheus(report, labels=None):
+    """Переводит отчет в текстовый формат Prometheus (счетчик или gauge на этап и метрику)."""
+    labels = {"job": report["job"] or "fee_analysis", **(labels or {})}
+    lines = []
+    for suffix, field, metric_type, description in PROMETHEUS_METRICS:
+        samples = [record for record in report["stages"] if record[field] is not None]
+        if not samples:
+            continue
+        name = f"{METRIC_PREFIX}_{suffix}"
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} {metric_type}"]
+        for record in samples:
+            sample_labels = ",".join(f'{key}="{_label(value)}"' for key, value in {**labels, "stage": record["stage"]}.items())
+            lines.append(f"{name}{{{sample_labels}}} {record[field]}")
+    name = f"{METRIC_PREFIX}_run_timestamp_seconds"
+    run_labels = ",".join(f'{key}="{_label(value)}"' for key, value in labels.items())
+    lines += [f"# HELP {name} Time the run finished", f"# TYPE {name} gauge", f"{name}{{{run_labels}}} {time.time():.3f}"]
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(output_file, job=None, labels=None):
+    """
+    Сохраняет метрики этапов в текстовом формате Prometheus для textfile collector
+    node exporter. Файл заменяется атомарно, чтобы collector не прочитал его частично.
+    """
+    _atomic_write(output_file, format_prometheus(RECORDER.report(job), labels))
+    logging.info(f"Prometheus metrics saved to {output_file}")
+
+
+def add_instrumentation_arguments(parser):
+    """Добавляет в CLI параметры отчета о запуске, метрик и профилирования этапов."""
+    parser.add_argument("--run-report", default=None, help="Write per-stage metrics of this run to a JSON file")
+    parser.add_argument(
+        "--prometheus", default=None, help="Write per-stage metrics in Prometheus text format (node exporter textfile)"
+    )
+    parser.add_argument("--profile", choices=PROFILERS, default=None, help="Profile pipeline stages")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR, help="Directory for stage profiles")
+    parser.add_argument(
+        "--profile-stage", action="append", default=None, help="Stage name to profile (repeatable; default: top-level)"
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true", help="Measure per-stage allocation peaks with tracemalloc (slower)"
+    )
+
+
+def configure_from_args(args):
+    configure(
+        # Выбор этапа без --profile означает профилирование cProfile
+        profiler=args.profile or ("cprofile" if args.profile_stage else None),
+        profile_dir=args.profile_dir,
+        profile_stages=args.profile_stage,
+        trace_memory=args.trace_memory,
+    )
+
+
+def write_reports_from_args(args, job):
+    """Пишет отчеты, запрошенные параметрами add_instrumentation_arguments."""
+    if args.run_report:
+        write_run_report(args.run_report, job)
+    if args.prometheus:
+        write_prometheus(args.prometheus, job)
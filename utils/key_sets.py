@@ -0,0 +1,185 @@
+import logging
+import math
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Старший бит помечает ключи-хеши; ключи без него — сами числовые id, их можно вывести обратно
+HASHED_KEY_BIT = np.uint64(1 << 63)
+# Константы перемешивания splitmix64
+_MIX_GAMMA = np.uint64(0x9E3779B97F4A7C15)
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+SPILL_PARTITIONS = 64
+# Ключей в буфере перед сбросом по файлам разделов
+SPILL_BUFFER_KEYS = 2_000_000
+
+
+def mix64(keys):
+    """Перемешивает биты uint64 (splitmix64), чтобы последовательные id равномерно ложились по разрядам."""
+    keys = np.asarray(keys, dtype=np.uint64) + _MIX_GAMMA
+    keys = (keys ^ (keys >> np.uint64(30))) * _MIX_1
+    keys = (keys ^ (keys >> np.uint64(27))) * _MIX_2
+    return keys ^ (keys >> np.uint64(31))
+
+
+def id_keys(ids):
+    """
+    Переводит строковые id в ключи uint64. Десятичные id меньше 2**63 (как id сделок
+    Gate.io) становятся своим значением, остальные — хешем со старшим битом.
+    Возвращает ключи и маску непустых id.
+    """
+    ids = pd.Series(ids, dtype=object)
+    valid = ids.notna().to_numpy()
+    keys = np.zeros(len(ids), dtype=np.uint64)
+    text = ids[valid].astype(str)
+    numeric = (text.str.fullmatch(r"\d{1,18}")).to_numpy()
+    positions = np.flatnonzero(valid)
+    keys[positions[numeric]] = text[numeric].to_numpy().astype(np.uint64)
+    hashed = positions[~numeric]
+    keys[hashed] = pd.util.hash_array(text[~numeric].to_numpy()) | HASHED_KEY_BIT
+    return keys, valid
+
+
+def key_label(key):
+    """Текст ключа для отчета: исходный числовой id или хеш."""
+    key = int(key)
+    return str(key) if key < int(HASHED_KEY_BIT) else f"#{key:016x}"
+
+
+class KeyCounter:
+    """
+    Считает повторы ключей uint64 за один проход. Ключи копятся в памяти, а при
+    превышении max_memory_keys сбрасываются в файлы разделов по старшим битам хеша
+    (spill). Повторы ищутся в конце сортировкой каждого раздела отдельно, поэтому
+    память ограничена размером раздела, а результат остается точным.
+    """
+
+    def __init__(self, max_memory_keys, spill_dir=None, partitions=SPILL_PARTITIONS):
+        self.max_memory_keys = max_memory_keys
+        self.spill_dir = spill_dir
+        self.partitions = partitions
+        self.count = 0
+        self._buffer = []
+        self._buffered = 0
+        self._spill_path = None
+
+    @property
+    def spilled(self):
+        return self._spill_path is not None
+
+    def add(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        self._buffer.append(keys)
+        self._buffered += len(keys)
+        self.count += len(keys)
+        if not self.spilled and self.count > self.max_memory_keys:
+            self._spill_path = Path(tempfile.mkdtemp(prefix="keys_", dir=self.spill_dir))
+            logging.info(f"More than {self.max_memory_keys} keys, spilling to {self._spill_path}")
+        if self.spilled and self._buffered >= min(SPILL_BUFFER_KEYS, self.max_memory_keys):
+            self._flush()
+
+    def _partition_path(self, partition):
+        return self._spill_path / f"{partition:03d}.u64"
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        keys = np.concatenate(self._buffer)
+        self._buffer, self._buffered = [], 0
+        shift = np.uint64(64 - max(self.partitions - 1, 1).bit_length())
+        partitions = (mix64(keys) >> shift).astype(np.int64) % self.partitions
+        order = np.argsort(partitions, kind="stable")
+        bounds = np.searchsorted(partitions[order], np.arange(self.partitions + 1))
+        for partition in range(self.partitions):
+            part = keys[order[bounds[partition] : bounds[partition + 1]]]
+            if len(part):
+                with open(self._partition_path(partition), "ab") as file:
+                    part.tofile(file)
+
+    def _parts(self):
+        if not self.spilled:
+            yield np.concatenate(self._buffer) if self._buffer else np.empty(0, dtype=np.uint64)
+            return
+        self._flush()
+        for partition in range(self.partitions):
+            path = self._partition_path(partition)
+            if path.exists():
+                yield np.fromfile(path, dtype=np.uint64)
+
+    def duplicates(self):
+        """Повторяющиеся ключи и число их вхождений (в порядке возрастания ключа внутри раздела)."""
+        keys, counts = [], []
+        for part in self._parts():
+            unique, part_counts = np.unique(part, return_counts=True)
+            repeated = part_counts > 1
+            keys.append(unique[repeated])
+            counts.append(part_counts[repeated])
+        if not keys:
+            return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+        return np.concatenate(keys), np.concatenate(counts)
+
+    def close(self):
+        """Удаляет файлы разделов."""
+        if self.spilled:
+            shutil.rmtree(self._spill_path, ignore_errors=True)
+            self._spill_path = None
+        self._buffer, self._buffered = [], 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class BloomFilter:
+    """
+    Фильтр Блума на массиве битов NumPy: память фиксирована и не зависит от числа
+    ключей, но повтор определяется с вероятностью ложного срабатывания около
+    error_rate при заполнении до capacity ключей. Пропусков повторов не бывает.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.bits = max(64, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2 / 64) * 64)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.words = np.zeros(self.bits // 64, dtype=np.uint64)
+        self.count = 0
+
+    @property
+    def memory_bytes(self):
+        return self.words.nbytes
+
+    def false_positive_rate(self):
+        """Оценка вероятности ложного срабатывания при текущем заполнении."""
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** self.hashes
+
+    def _positions(self, keys):
+        first = mix64(keys)
+        second = mix64(keys ^ _MIX_1) | np.uint64(1)
+        bits = np.uint64(self.bits)
+        return [(first + np.uint64(i) * second) % bits for i in range(self.hashes)]
+
+    def add(self, keys):
+        """
+        Добавляет ключи и возвращает маску ключей, которые (вероятно) уже встречались:
+        в предыдущих вызовах или раньше в этом же массиве.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        positions = self._positions(keys)
+        seen = np.ones(len(keys), dtype=bool)
+        for position in positions:
+            seen &= (self.words[position >> np.uint64(6)] >> (position & np.uint64(63))) & np.uint64(1) == 1
+        _, first = np.unique(keys, return_index=True)
+        repeated_in_batch = np.ones(len(keys), dtype=bool)
+        repeated_in_batch[first] = False
+        for position in positions:
+            np.bitwise_or.at(self.words, (position >> np.uint64(6)).astype(np.intp), np.uint64(1) << (position & np.uint64(63)))
+        self.count += len(keys)
+        return seen | repeated_in_batch
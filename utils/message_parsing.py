@@ -0,0 +1,469 @@
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+except ImportError:  # orjson не обязателен: без него сообщения разбираются json или сканером полей
+    orjson = None
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Биржа сделок без суффикса биржи в instrument_name
+DEFAULT_VENUE = "GateioSpot"
+# Поля исполнения, которые извлекает разборщик каждой биржи
+FILL_FIELDS = ("id", "fee", "fee_currency", "gt_fee")
+# Поля комиссии: сканер требует их строкового значения, иначе сообщение разбирается через JSON
+_FEE_FIELDS = FILL_FIELDS[1:]
+
+_EXTRACTION_ERRORS = (KeyError, IndexError, TypeError, AttributeError, ValueError)
+# Значение id, которое сканер не извлекает (строка, дробь, null): сообщение разбирается через JSON
+_UNSCANNED = object()
+
+# Способ извлечения полей: "scanner" — поиск ключей без разбора JSON (с откатом на JSON для прочих форм),
+# "json" — полный разбор (orjson, если установлен). "auto" выбирает по замеру на сообщениях Gate.io
+# (200 тыс. сделок synthetic_logs): orjson быстрее сканера в 1.3-1.5 раза, а без orjson сканер
+# быстрее json на 20% при разборе всех исполнений и наравне с ним при разборе первого
+MESSAGE_PARSERS = ("auto", "scanner", "json")
+DEFAULT_MESSAGE_PARSER = "auto"
+
+
+class FeeExtractor:
+    """
+    Разборщик сообщений одной биржи. fills_path — путь от корня сообщения к массиву
+    (или одиночному объекту) исполнений, fields — путь к каждому полю FILL_FIELDS внутри
+    исполнения (None, если у биржи такого поля нет). По объявленным путям заранее
+    собираются ключи сканера: если поля лежат прямо в плоском объекте исполнения,
+    они извлекаются поиском ключей без разбора JSON, иначе — из разобранного JSON.
+    """
+
+    def __init__(self, venue, fills_path, fields):
+        self.venue = venue
+        self.fills_path = tuple(fills_path)
+        self.fields = {
+            name: (fields[name],) if isinstance(fields.get(name), str) else fields.get(name) for name in FILL_FIELDS
+        }
+        unknown = set(fields) - set(FILL_FIELDS)
+        if unknown:
+            raise ValueError(f"Unknown fill fields for venue {venue}: {sorted(unknown)}")
+        # Сканер применим, если все поля комиссии (и id, если он есть) лежат прямо в объекте исполнения
+        scannable = (
+            bool(self.fills_path)
+            and all(isinstance(key, str) for key in self.fills_path)
+            and all(self.fields[name] is not None and len(self.fields[name]) == 1 for name in _FEE_FIELDS)
+            and (self.fields["id"] is None or len(self.fields["id"]) == 1)
+        )
+        # Ключи сканера: контейнеры перед массивом исполнений, сам массив и поля комиссии
+        self.scan_keys = None
+        if scannable:
+            self.scan_keys = (
+                [f'"{key}":' for key in self.fills_path[:-1]],
+                f'"{self.fills_path[-1]}":',
+                None if self.fields["id"] is None else f'"{self.fields["id"][0]}":',
+                tuple(f'"{self.fields[name][0]}":' for name in _FEE_FIELDS),
+            )
+
+    def fills(self, data):
+        """Исполнения разобранного сообщения: массив или одиночный объект по пути fills_path."""
+        for key in self.fills_path:
+            data = data[key]
+        return data if isinstance(data, list) else [data]
+
+    def fill_fields(self, fill):
+        """Значения FILL_FIELDS одного исполнения (None для отсутствующих полей)."""
+        values = []
+        for path in self.fields.values():
+            value = None if path is None else fill.get(path[0])
+            for key in (path or ())[1:]:
+                value = value.get(key) if isinstance(value, dict) else None
+            values.append(value)
+        return tuple(values)
+
+
+# Разборщики по бирже — суффиксу instrument_name после "|"
+EXTRACTORS = {}
+
+
+def register_extractor(extractor):
+    """Регистрирует разборщик сообщений биржи extractor.venue (заменяя прежний)."""
+    EXTRACTORS[extractor.venue] = extractor
+    return extractor
+
+
+# Gate.io spot.usertrades:
+# {..., "data": {..., "result": [{..., "id": ..., "fee": "...", "fee_currency": "...", "gt_fee": "...", ...}]}}
+register_extractor(
+    FeeExtractor(
+        DEFAULT_VENUE,
+        ("data", "result"),
+        {"id": "id", "fee": "fee", "fee_currency": "fee_currency", "gt_fee": "gt_fee"},
+    )
+)
+
+
+def instrument_venues(instrument_names):
+    """
+    Биржа каждого инструмента — суффикс после "|" (ADA_USDT|GateioSpot -> GateioSpot),
+    DEFAULT_VENUE для инструментов без суффикса. Суффикс ищется один раз на инструмент.
+    """
+    codes, instruments = pd.factorize(pd.Series(instrument_names, dtype=object))
+    if not len(instruments):
+        return np.full(len(codes), DEFAULT_VENUE, dtype=object)
+    suffixes = pd.Series(instruments, dtype=object).str.rpartition("|")
+    venues = suffixes[2].where(suffixes[1] == "|", DEFAULT_VENUE).to_numpy(dtype=object)
+    return np.where(codes >= 0, venues[codes], DEFAULT_VENUE).astype(object)
+
+
+def trace_venues(trace_ids, instrument_names):
+    """
+    Биржа сделки по trace_id для выбора разборщика сообщений dump_log.
+    None, если все сделки с DEFAULT_VENUE: тогда сообщения разбираются одной группой.
+    """
+    if instrument_names is None:
+        return None
+    venues = instrument_venues(instrument_names)
+    if (venues == DEFAULT_VENUE).all():
+        return None
+    venues = pd.Series(venues, index=pd.Index(trace_ids))
+    return venues[~venues.index.duplicated()]
+
+
+def message_venues(venues, trace_ids):
+    """
+    Биржа каждого сообщения по его trace_id (DEFAULT_VENUE для неизвестных trace_id); None без venues.
+    venues-строка задает одну биржу для всех сообщений.
+    """
+    if venues is None:
+        return None
+    if isinstance(venues, str):
+        return np.full(len(trace_ids), venues, dtype=object)
+    positions = venues.index.get_indexer(trace_ids)
+    return np.where(positions >= 0, venues.to_numpy()[positions], DEFAULT_VENUE).astype(object)
+
+
+def _venue_groups(venues):
+    """
+    Группы сообщений по бирже: (биржа, номера сообщений). Одна биржа (или venues=None)
+    дает одну группу с номерами None — все сообщения без выборки.
+    """
+    if venues is None:
+        return [(DEFAULT_VENUE, None)]
+    codes, uniques = pd.factorize(pd.Series(venues, dtype=object).fillna(DEFAULT_VENUE))
+    if len(uniques) <= 1:
+        return [(uniques[0] if len(uniques) else DEFAULT_VENUE, None)]
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(uniques) + 1))
+    return [(venue, order[bounds[k] : bounds[k + 1]]) for k, venue in enumerate(uniques)]
+
+
+def _venue_extractor(venue, count):
+    extractor = EXTRACTORS.get(venue)
+    if extractor is None:
+        logging.error(f"No fee extractor registered for venue {venue!r}, {count} messages skipped.")
+    return extractor
+
+
+def _scan_keys(extractor, parser):
+    """Ключи сканера для extractor или None, если поля извлекаются из разобранного JSON."""
+    parser = parser or DEFAULT_MESSAGE_PARSER
+    if parser not in MESSAGE_PARSERS:
+        logging.error(f"Unknown message parser {parser!r}, expected one of {MESSAGE_PARSERS}.")
+        raise ValueError(f"Unknown message parser: {parser}")
+    if extractor is None or parser == "json" or (parser == "auto" and orjson is not None):
+        return None
+    return extractor.scan_keys
+
+
+def _json_loads(message):
+    """Разбирает JSON самым быстрым из доступных парсеров."""
+    if orjson is not None:
+        return orjson.loads(message)
+    return json.loads(message)
+
+
+def _parse_fill_fields(message, extractor):
+    """Полностью разбирает сообщение и возвращает (fee, fee_currency, gt_fee) первой сделки."""
+    fills = extractor.fills(_json_loads(message))
+    return extractor.fill_fields(fills[0])[1:]
+
+
+def _find_string_value(message, key, start, end):
+    """Возвращает строковое значение ключа key в message[start:end] или None."""
+    i = message.find(key, start, end)
+    if i < 0:
+        return None
+    i += len(key)
+    while i < end and message[i] == " ":
+        i += 1
+    if i >= end or message[i] != '"':
+        return None
+    j = message.find('"', i + 1, end)
+    if j < 0:
+        return None
+    value = message[i + 1 : j]
+    # Экранированные последовательности оставляем полному разбору JSON
+    return None if "\\" in value else value
+
+
+def _find_fills_start(message, scan_keys):
+    """Позиция значения массива исполнений или -1, если сообщение не похоже на известную форму."""
+    fills_pos = message.find(scan_keys[1])
+    if fills_pos < 0:
+        return -1
+    for key in scan_keys[0]:
+        if message.find(key, 0, fills_pos) < 0:
+            return -1
+    if not message.lstrip().startswith("{"):
+        return -1
+    return fills_pos + len(scan_keys[1])
+
+
+def _closes_fills(message, pos, scan_keys):
+    """
+    Проверяет, что после исполнений (с позиции pos) сообщение только закрывает объекты
+    на пути к ним. Иначе (другие ключи после исполнений, лишний текст, который отвергнет
+    JSON) сообщение разбирается через JSON.
+    """
+    return "".join(message[pos:].split()) == "}" * (len(scan_keys[0]) + 1)
+
+
+def _scan_fill_fields(message, scan_keys):
+    """
+    Извлекает поля комиссии первого исполнения без полного разбора JSON.
+    Возвращает None, если сообщение не похоже на известную форму.
+    """
+    pos = _find_fills_start(message, scan_keys)
+    if pos < 0:
+        return None
+    start = message.find("{", pos)
+    if start < 0 or message[pos:start].strip() not in ("", "["):
+        return None
+    end = message.find("}", start)
+    if end < 0 or message.find("{", start + 1, end) >= 0:
+        return None
+    # Остальные исполнения массива не читаются, проверяется только окончание сообщения
+    close = message.rfind("]") + 1 if message[pos:start].strip() == "[" else end + 1
+    if close <= end or not _closes_fills(message, close, scan_keys):
+        return None
+    fields = tuple(_find_string_value(message, key, start, end) for key in scan_keys[3])
+    return None if None in fields else fields
+
+
+def _parse_all_fills(message, extractor):
+    """Полностью разбирает сообщение и возвращает (id, fee, fee_currency, gt_fee) всех исполнений."""
+    return [extractor.fill_fields(fill) for fill in extractor.fills(_json_loads(message))]
+
+
+def _find_number_value(message, key, start, end):
+    """
+    Возвращает целое значение ключа key в message[start:end] текстом, None без ключа
+    или _UNSCANNED, если значение не целое число (его приводит к тексту разбор JSON).
+    """
+    if key is None:
+        return None
+    i = message.find(key, start, end)
+    if i < 0:
+        return None
+    i += len(key)
+    while i < end and message[i] == " ":
+        i += 1
+    j = i
+    while j < end and message[j].isdigit():
+        j += 1
+    if j == i or (j < end and message[j] not in ", "):
+        return _UNSCANNED
+    return message[i:j]
+
+
+def _scan_all_fills(message, scan_keys):
+    """
+    Извлекает поля всех исполнений массива без полного разбора JSON.
+    Возвращает None, если сообщение не похоже на известную форму.
+    """
+    pos = _find_fills_start(message, scan_keys)
+    if pos < 0:
+        return None
+    while pos < len(message) and message[pos] == " ":
+        pos += 1
+    if message.startswith("{", pos):
+        # Одиночный объект вместо массива
+        end = message.find("}", pos)
+        if end < 0 or message.find("{", pos + 1, end) >= 0 or not _closes_fills(message, end + 1, scan_keys):
+            return None
+        fields = tuple(_find_string_value(message, key, pos, end) for key in scan_keys[3])
+        fill_id = _find_number_value(message, scan_keys[2], pos, end)
+        return None if None in fields or fill_id is _UNSCANNED else [(fill_id, *fields)]
+    if not message.startswith("[", pos):
+        return None
+
+    fills = []
+    pos += 1
+    while True:
+        while pos < len(message) and message[pos] in " ,":
+            pos += 1
+        if message.startswith("]", pos):
+            return fills if _closes_fills(message, pos + 1, scan_keys) else None
+        if not message.startswith("{", pos):
+            return None
+        end = message.find("}", pos)
+        if end < 0 or message.find("{", pos + 1, end) >= 0:
+            return None
+        fields = tuple(_find_string_value(message, key, pos, end) for key in scan_keys[3])
+        fill_id = _find_number_value(message, scan_keys[2], pos, end)
+        if None in fields or fill_id is _UNSCANNED:
+            return None
+        fills.append((fill_id, *fields))
+        pos = end + 1
+
+
+def _fill_records_batch(messages, extractor, errors, parser=None):
+    """Записи исполнений сообщений одной биржи: номера сообщений и кортежи FILL_FIELDS."""
+    positions, records = [], []
+    scan_keys = _scan_keys(extractor, parser)
+    for i, message in enumerate(messages):
+        fills = None
+        if extractor is not None:
+            try:
+                if scan_keys is not None and isinstance(message, str):
+                    fills = _scan_all_fills(message, scan_keys)
+                if fills is None:
+                    fills = _parse_all_fills(message, extractor)
+            except _EXTRACTION_ERRORS as e:
+                errors.append(e)
+                if len(errors) == 1:
+                    logging.error(f"Error extracting fee from message: {e}")
+                fills = None
+        if not fills:
+            fills = [(None, None, None, None)]
+        positions.extend([i] * len(fills))
+        records.extend(fills)
+    return positions, records
+
+
+def parse_fill_records(messages, venues=None, parser=None):
+    """
+    Извлекает id, fee, fee_currency и gt_fee каждого исполнения из массивов result.
+    Возвращает номера сообщений и четыре массива полей, по записи на сделку.
+    Сообщение без сделок или некорректное дает одну запись с пустыми полями,
+    чтобы сделка платформы не терялась, как и в parse_fee_fields.
+    venues — биржа каждого сообщения (см. message_venues), по умолчанию DEFAULT_VENUE.
+    parser — способ извлечения полей из MESSAGE_PARSERS, по умолчанию DEFAULT_MESSAGE_PARSER.
+    """
+    messages = messages if venues is None else np.asarray(list(messages), dtype=object)
+    errors = []
+    groups = _venue_groups(venues)
+    if len(groups) == 1:
+        extractor = _venue_extractor(groups[0][0], len(messages))
+        positions, records = _fill_records_batch(messages, extractor, errors, parser)
+    else:
+        positions, records = [], []
+        for venue, rows in groups:
+            group_positions, group_records = _fill_records_batch(
+                messages[rows], _venue_extractor(venue, len(rows)), errors, parser
+            )
+            positions.append(rows[np.asarray(group_positions, dtype=np.int64)])
+            records.extend(group_records)
+        # Записи возвращаются в порядке сообщений, как при разборе одной группой
+        positions = np.concatenate(positions)
+        order = np.argsort(positions, kind="stable")
+        positions = positions[order]
+        records = [records[k] for k in order]
+
+    if len(errors) > 1:
+        logging.error(f"Fee could not be extracted from {len(errors)} messages.")
+    fields = np.empty((len(records), 4), dtype=object)
+    fields[:] = records if records else np.empty((0, 4), dtype=object)
+    fill_ids = np.array([None if fill_id is None else str(fill_id) for fill_id in fields[:, 0]], dtype=object)
+    return np.asarray(positions, dtype=np.int64), fill_ids, fields[:, 1], fields[:, 2], fields[:, 3]
+
+
+def _fee_fields_batch(messages, extractor, errors, fees, fee_currencies, gt_fees, rows=None, parser=None):
+    """Заполняет поля комиссии сообщений одной биржи в строках rows (по умолчанию — подряд)."""
+    scan_keys = _scan_keys(extractor, parser)
+    if extractor is None:
+        return
+    for k, message in enumerate(messages):
+        try:
+            fields = None
+            if scan_keys is not None and isinstance(message, str):
+                fields = _scan_fill_fields(message, scan_keys)
+            if fields is None:
+                fields = _parse_fill_fields(message, extractor)
+        except _EXTRACTION_ERRORS as e:
+            errors.append(e)
+            if len(errors) == 1:
+                logging.error(f"Error extracting fee from message: {e}")
+            continue
+        i = k if rows is None else rows[k]
+        fees[i], fee_currencies[i], gt_fees[i] = fields
+
+
+def parse_fee_fields(messages, venues=None, parser=None):
+    """
+    Пакетно извлекает fee, fee_currency и gt_fee из столбца сообщений биржи.
+    Возвращает три массива; для некорректных сообщений все три значения равны None.
+    venues — биржа каждого сообщения: сообщения разбираются группами по бирже
+    разборщиком из EXTRACTORS, без ветвления по строкам. parser — как в parse_fill_records.
+    """
+    messages = list(messages)
+    fees = np.full(len(messages), None, dtype=object)
+    fee_currencies = np.full(len(messages), None, dtype=object)
+    gt_fees = np.full(len(messages), None, dtype=object)
+
+    errors = []
+    groups = _venue_groups(venues)
+    if len(groups) == 1:
+        extractor = _venue_extractor(groups[0][0], len(messages))
+        _fee_fields_batch(messages, extractor, errors, fees, fee_currencies, gt_fees, parser=parser)
+    else:
+        messages = np.asarray(messages, dtype=object)
+        for venue, rows in groups:
+            extractor = _venue_extractor(venue, len(rows))
+            _fee_fields_batch(messages[rows], extractor, errors, fees, fee_currencies, gt_fees, rows, parser)
+
+    if len(errors) > 1:
+        logging.error(f"Fee could not be extracted from {len(errors)} messages.")
+    return fees, fee_currencies, gt_fees
+
+
+def as_decimal_text(values):
+    """
+    Приводит значения комиссии к текстовому виду без потери точности:
+    строки из сообщения сохраняются как есть, числа JSON записываются через repr.
+    """
+    return np.array(
+        [value if value is None or isinstance(value, str) else repr(value) for value in values], dtype=object
+    )
+
+
+def gt_fee_currencies(gt_fees):
+    """Для GT-актива валютой комиссии считается 'GT', если gt_fee непустая."""
+    return np.array([("GT" if gt_fee else None) for gt_fee in gt_fees], dtype=object)
+
+
+def is_gt_asset(fee_asset_names):
+    """Проверяет, оплачена ли комиссия в GT (без учета регистра)."""
+    return (pd.Series(fee_asset_names, dtype=object).str.upper() == "GT").to_numpy()
+
+
+def select_fees(fees, fee_currencies, gt_fees, gt_currencies, fee_asset_names):
+    """
+    Выбирает комиссию биржи и ее валюту для каждой сделки:
+    для GT-актива берется gt_fee, для остальных — fee.
+    """
+    is_gt = is_gt_asset(fee_asset_names)
+    return (
+        np.where(is_gt, gt_fees, fees),
+        np.where(is_gt, gt_currencies, fee_currencies),
+    )
+
+
+def extract_fees(messages, fee_asset_names, venues=None, parser=None):
+    """
+    Пакетная версия extract_fee_from_message: возвращает массивы комиссий и их валют.
+    """
+    fees, fee_currencies, gt_fees = parse_fee_fields(messages, venues, parser)
+    return select_fees(fees, fee_currencies, gt_fees, gt_fee_currencies(gt_fees), fee_asset_names)
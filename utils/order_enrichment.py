@@ -0,0 +1,146 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+# Ключи связи сделок с ордерами в порядке приоритета
+ORDER_JOIN_KEYS = ["order_id", "exchange_order_id"]
+ORDER_TIME_COLUMN = "platform_time"
+# Сводка по ордеру: время первой и последней записи, статус последней записи, число записей
+ORDER_SUMMARY_COLUMNS = ["placement_time", "last_update_time", "order_status", "order_update_count"]
+# Столбцы, которые обогащение добавляет к сделкам
+ORDER_COLUMNS = ["order_status", "order_placement_time", "time_to_fill", "fill_count", "fill_number"]
+
+
+def order_key(columns):
+    """Возвращает основной ключ ордера, присутствующий в столбцах, или None."""
+    return next((key for key in ORDER_JOIN_KEYS if key in columns), None)
+
+
+def is_order_summary(order_log):
+    """Проверяет, что order_log уже свернут до одной строки на ордер."""
+    return all(column in order_log.columns for column in ORDER_SUMMARY_COLUMNS)
+
+
+def summarize_orders(order_log):
+    """
+    Сворачивает записи order_log в частичную сводку по ордерам.
+    Сводки, посчитанные по разным частям файла, складываются merge_order_summaries.
+    """
+    key = order_key(order_log.columns)
+    if key is None:
+        return pd.DataFrame(columns=ORDER_JOIN_KEYS[:1] + ORDER_SUMMARY_COLUMNS)
+
+    times = order_log[ORDER_TIME_COLUMN] if ORDER_TIME_COLUMN in order_log.columns else pd.NaT
+    rows = pd.DataFrame(
+        {
+            **{column: order_log[column] for column in ORDER_JOIN_KEYS if column in order_log.columns},
+            "placement_time": times,
+            "last_update_time": times,
+            "order_status": order_log["status"].astype(object) if "status" in order_log.columns else None,
+            "order_update_count": 1,
+        },
+        index=order_log.index,
+    )
+    return merge_order_summaries([rows])
+
+
+def merge_order_summaries(summaries):
+    """
+    Складывает частичные сводки по ордерам: первое и последнее время, число записей,
+    статус и вторичный ключ берутся из самой поздней записи (при равенстве — из последней по порядку).
+    """
+    summaries = [summary for summary in summaries if not summary.empty]
+    if not summaries:
+        return pd.DataFrame(columns=ORDER_JOIN_KEYS[:1] + ORDER_SUMMARY_COLUMNS)
+    combined = pd.concat(summaries, ignore_index=True)
+    key = order_key(combined.columns)
+    combined = combined[combined[key].notna()]
+
+    grouped = combined.groupby(key, sort=False)
+    totals = grouped.agg(
+        placement_time=("placement_time", "min"),
+        last_update_time=("last_update_time", "max"),
+        order_update_count=("order_update_count", "sum"),
+    )
+    other_keys = [column for column in ORDER_JOIN_KEYS if column in combined.columns and column != key]
+    latest = (
+        combined.sort_values("last_update_time", kind="stable", na_position="first")
+        .drop_duplicates(key, keep="last")
+        .set_index(key)[[*other_keys, "order_status"]]
+    )
+    return totals.join(latest).reset_index()[[key, *other_keys, *ORDER_SUMMARY_COLUMNS]]
+
+
+def load_order_summary(chunks, order_ids=None, exchange_order_ids=None):
+    """
+    Строит сводку по ордерам из потока частей order_log (например, read_typed_csv_chunks).
+    Каждая часть сокращается semi-join по ордерам сделок и сразу сворачивается,
+    поэтому в памяти держатся только сводки ордеров, по которым были сделки.
+    """
+    wanted = {
+        "order_id": pd.Index(order_ids).dropna().unique() if order_ids is not None else None,
+        "exchange_order_id": pd.Index(exchange_order_ids).dropna().unique() if exchange_order_ids is not None else None,
+    }
+
+    summaries = []
+    for chunk in chunks:
+        mask = np.zeros(len(chunk), dtype=bool)
+        restricted = False
+        for key, index in wanted.items():
+            if index is not None and key in chunk.columns:
+                restricted = True
+                mask |= index.get_indexer(chunk[key]) != -1
+        summaries.append(summarize_orders(chunk[mask] if restricted else chunk))
+    return merge_order_summaries(summaries)
+
+
+def attach_order_info(trades, order_log):
+    """
+    Добавляет к сделкам статус ордера, время его размещения, время до исполнения (в секундах),
+    число исполнений ордера и номер исполнения в порядке platform_time.
+    Сделки связываются с ордерами hash join по order_id, а оставшиеся — по exchange_order_id.
+    """
+    summary = order_log if is_order_summary(order_log) else summarize_orders(order_log)
+    summary = summary.reset_index(drop=True)
+    size = len(trades)
+    # Номер строки сводки для каждой сделки (-1 — ордер не найден)
+    positions = np.full(size, -1, dtype=np.int64)
+    for key in ORDER_JOIN_KEYS:
+        if key not in trades.columns or key not in summary.columns:
+            continue
+        orders = summary[key].dropna()
+        orders = orders[~orders.duplicated(keep="last")]
+        found = pd.Index(orders).get_indexer(trades[key])
+        fill = (positions == -1) & (found != -1)
+        positions[fill] = orders.index.to_numpy()[found[fill]]
+    if size and (positions == -1).all():
+        logging.warning("No trades could be matched to order_log.")
+
+    matched = positions != -1
+    status = np.full(size, None, dtype=object)
+    status[matched] = summary["order_status"].to_numpy(dtype=object)[positions[matched]]
+    placement_time = np.full(size, np.datetime64("NaT"), dtype="datetime64[ns]")
+    placement_time[matched] = pd.to_datetime(summary["placement_time"]).to_numpy()[positions[matched]]
+    placement_time = pd.Series(placement_time, index=trades.index)
+
+    enriched = trades.assign(order_status=status, order_placement_time=placement_time)
+    if ORDER_TIME_COLUMN in trades.columns:
+        enriched["time_to_fill"] = (pd.to_datetime(trades[ORDER_TIME_COLUMN]) - placement_time).dt.total_seconds()
+    else:
+        enriched["time_to_fill"] = np.nan
+
+    key = order_key(trades.columns)
+    if key is None:
+        enriched["fill_count"] = np.nan
+        enriched["fill_number"] = np.nan
+        return enriched
+    fills = trades[[key]].assign(_time=trades[ORDER_TIME_COLUMN] if ORDER_TIME_COLUMN in trades.columns else 0)
+    fills = fills.sort_values("_time", kind="stable")
+    grouped = fills.groupby(key, sort=False, dropna=True)[key]
+    enriched["fill_count"] = grouped.transform("size").reindex(trades.index)
+    enriched["fill_number"] = (grouped.cumcount() + 1).where(fills[key].notna()).reindex(trades.index)
+    return enriched
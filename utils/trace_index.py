@@ -0,0 +1,230 @@
+import csv
+import io
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.compressed_input import is_compressed
+from utils.dump_cache import source_fingerprint
+from utils.file_shards import ByteRangeReader, read_header
+
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+TRACE_INDEX_DIR = "output/.index"
+INDEX_FORMAT_VERSION = 1
+# Строк dump_log, читаемых за раз при отдельном построении индекса
+INDEX_CHUNKSIZE = 1_000_000
+# Столбцы-указатели на исходные строки dump_log в таблице расхождений
+POINTER_COLUMNS = ["dump_log_offset", "dump_log_rows"]
+
+
+def index_paths(source_path, index_dir=TRACE_INDEX_DIR):
+    """Пути к отсортированным trace_id, смещениям строк и метаданным индекса файла source_path."""
+    stem = Path(source_path).name
+    index_dir = Path(index_dir)
+    return {
+        "trace_ids": index_dir / f"{stem}.trace_ids.npy",
+        "offsets": index_dir / f"{stem}.offsets.npy",
+        "meta": index_dir / f"{stem}.index.json",
+    }
+
+
+class LineOffsetRecorder(io.RawIOBase):
+    """
+    Поток-обертка, запоминающая смещения начал строк в исходном файле по мере чтения.
+    base — смещение в файле, соответствующее началу потока (для шарда с подставленным
+    заголовком — начало шарда минус длина заголовка).
+    """
+
+    def __init__(self, raw, base=0):
+        self._raw = raw
+        self._pos = base
+        self._starts = []
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self._raw.readinto(buffer)
+        if n:
+            newlines = np.flatnonzero(np.frombuffer(buffer, dtype=np.uint8, count=n) == ord("\n"))
+            self._starts.append(newlines.astype(np.uint64) + np.uint64(self._pos + 1))
+            self._pos += n
+        return n
+
+    def line_starts(self):
+        """Смещения начал строк, следующих за каждым прочитанным переводом строки."""
+        return np.concatenate(self._starts) if self._starts else np.empty(0, dtype=np.uint64)
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
+class TraceIndexBuilder:
+    """
+    Собирает индекс trace_id -> смещение строки за тот же проход, которым читается dump_log:
+    pandas читает файл через LineOffsetRecorder, а вызывающий код передает trace_id каждой
+    части (до фильтрации) в add. Строка k данных начинается после k-го перевода строки,
+    поэтому записи должны быть однострочными, как и при делении файла на шарды.
+    """
+
+    def __init__(self):
+        self._trace_ids = []
+        self._recorder = None
+
+    def open(self, path, byte_range=None):
+        """Открывает файл (или шард byte_range с заголовком) для pd.read_csv с записью смещений."""
+        if byte_range:
+            header = read_header(path)
+            raw = ByteRangeReader(path, *byte_range, prefix=header)
+            self._recorder = LineOffsetRecorder(raw, byte_range[0] - len(header))
+        else:
+            self._recorder = LineOffsetRecorder(io.FileIO(path, "rb"))
+        return io.BufferedReader(self._recorder)
+
+    def add(self, trace_ids):
+        self._trace_ids.append(np.asarray(trace_ids, dtype=np.uint64))
+
+    def entries(self):
+        """
+        trace_id и смещения прочитанных строк в порядке файла. None, если число строк
+        не совпало с числом переводов строки (пустые строки или переводы строк в полях).
+        """
+        trace_ids = np.concatenate(self._trace_ids) if self._trace_ids else np.empty(0, dtype=np.uint64)
+        starts = self._recorder.line_starts() if self._recorder is not None else np.empty(0, dtype=np.uint64)
+        # После последней строки, завершенной переводом строки, есть еще одно «начало» — конец файла
+        if len(starts) not in (len(trace_ids), len(trace_ids) + 1):
+            logging.warning(
+                f"dump_log has {len(trace_ids)} rows but {len(starts)} line breaks, trace_id index is not built."
+            )
+            return None
+        return trace_ids, starts[: len(trace_ids)]
+
+
+def index_is_current(source_path, index_dir=TRACE_INDEX_DIR):
+    """Индекс есть и построен по файлу того же размера и mtime."""
+    paths = index_paths(source_path, index_dir)
+    if not all(path.exists() for path in paths.values()):
+        return False
+    meta = json.loads(paths["meta"].read_text())
+    return meta.get("version") == INDEX_FORMAT_VERSION and meta["source"] == source_fingerprint(
+        source_path, with_hash=False
+    )
+
+
+def write_trace_index(entries, source_path, index_dir=TRACE_INDEX_DIR, fingerprint=None):
+    """
+    Сортирует пары (trace_id, смещение) по trace_id (строки одного trace_id — в порядке файла)
+    и сохраняет их двумя массивами .npy, которые читаются через mmap без загрузки в память.
+    fingerprint — отпечаток файла, снятый до чтения (иначе снимается сейчас).
+    """
+    trace_ids, offsets = entries
+    fingerprint = fingerprint or source_fingerprint(source_path, with_hash=False)
+    paths = index_paths(source_path, index_dir)
+    paths["meta"].parent.mkdir(parents=True, exist_ok=True)
+
+    order = np.argsort(trace_ids, kind="stable")
+    for key, values in (("trace_ids", trace_ids[order]), ("offsets", offsets[order])):
+        temp_path = paths[key].with_name(f".{paths[key].name}.tmp")
+        with open(temp_path, "wb") as file:
+            np.save(file, values)
+        os.replace(temp_path, paths[key])
+    meta = {"version": INDEX_FORMAT_VERSION, "source": fingerprint, "rows": len(order)}
+    temp_path = paths["meta"].with_name(f".{paths['meta'].name}.tmp")
+    temp_path.write_text(json.dumps(meta, indent=2))
+    os.replace(temp_path, paths["meta"])
+    logging.info(f"trace_id index of {len(order)} rows saved to {paths['trace_ids'].parent}")
+
+
+def build_trace_index(source_path, index_dir=TRACE_INDEX_DIR, chunksize=INDEX_CHUNKSIZE):
+    """Строит индекс отдельным проходом: читается только столбец trace_id."""
+    if is_compressed(source_path):
+        raise ValueError(f"Cannot index {source_path}: offsets of a compressed file cannot be seeked to.")
+    fingerprint = source_fingerprint(source_path, with_hash=False)
+    builder = TraceIndexBuilder()
+    with builder.open(source_path) as source:
+        for chunk in pd.read_csv(source, usecols=["trace_id"], dtype={"trace_id": "uint64"}, chunksize=chunksize):
+            builder.add(chunk["trace_id"])
+    entries = builder.entries()
+    if entries is None:
+        raise ValueError(f"Cannot index {source_path}: rows must not contain line breaks.")
+    write_trace_index(entries, source_path, index_dir, fingerprint)
+
+
+class TraceIndex:
+    """
+    Индекс trace_id -> смещения строк dump_log. Массивы открываются через mmap, поиск —
+    двоичный (searchsorted) за O(log n), поэтому открытие и поиск не зависят от размера
+    файла, а чтение строк — несколько seek по найденным смещениям.
+    """
+
+    def __init__(self, source_path, index_dir=TRACE_INDEX_DIR):
+        if not index_is_current(source_path, index_dir):
+            raise ValueError(f"trace_id index of {source_path} in {index_dir} is missing or stale.")
+        paths = index_paths(source_path, index_dir)
+        self.source_path = source_path
+        self.trace_ids = np.load(paths["trace_ids"], mmap_mode="r")
+        self.offsets = np.load(paths["offsets"], mmap_mode="r")
+        self._header = next(csv.reader([read_header(source_path).decode()]))
+
+    def __len__(self):
+        return len(self.trace_ids)
+
+    @classmethod
+    def open(cls, source_path, index_dir=TRACE_INDEX_DIR, build=True):
+        """Открывает индекс, при build=True предварительно (пере)строив отсутствующий или устаревший."""
+        if build and not index_is_current(source_path, index_dir):
+            logging.info(f"trace_id index of {source_path} is missing or stale, building it")
+            build_trace_index(source_path, index_dir)
+        return cls(source_path, index_dir)
+
+    def lookup(self, trace_id):
+        """Смещения строк trace_id в порядке файла (пустой массив, если их нет)."""
+        key = np.uint64(trace_id)
+        start = np.searchsorted(self.trace_ids, key, side="left")
+        end = np.searchsorted(self.trace_ids, key, side="right")
+        return np.asarray(self.offsets[start:end])
+
+    def locate(self, trace_ids):
+        """Смещение первой строки и число строк каждого trace_id (-1 и 0 для отсутствующих)."""
+        keys = np.asarray(trace_ids, dtype=np.uint64)
+        start = np.searchsorted(self.trace_ids, keys, side="left")
+        end = np.searchsorted(self.trace_ids, keys, side="right")
+        found = end > start
+        first = np.full(len(keys), -1, dtype=np.int64)
+        first[found] = np.asarray(self.offsets)[start[found]].astype(np.int64)
+        return first, (end - start).astype(np.int64)
+
+    def raw_lines(self, trace_id):
+        """Исходные строки dump_log по trace_id, как они записаны в файле."""
+        lines = []
+        with open(self.source_path, "rb") as file:
+            for offset in self.lookup(trace_id):
+                file.seek(int(offset))
+                lines.append(file.readline().decode().rstrip("\r\n"))
+        return lines
+
+    def messages(self, trace_id):
+        """Строки dump_log по trace_id, разобранные в словари столбец -> значение."""
+        rows = [dict(zip(self._header, row)) for row in csv.reader(self.raw_lines(trace_id))]
+        for row in rows:
+            if int(row["trace_id"]) != int(trace_id):
+                raise ValueError(f"trace_id index of {self.source_path} is stale: offset points at another row.")
+        return rows
+
+
+def attach_dump_log_offsets(data, dump_log_path, index_dir=TRACE_INDEX_DIR):
+    """
+    Добавляет к таблице со столбцом trace_id указатели на исходные строки dump_log:
+    смещение первой строки trace_id (dump_log_offset, -1 — строк нет) и их число.
+    """
+    index = TraceIndex.open(dump_log_path, index_dir)
+    data = data.copy()
+    data[POINTER_COLUMNS[0]], data[POINTER_COLUMNS[1]] = index.locate(data["trace_id"].to_numpy())
+    return data
@@ -1,47 +1,174 @@
-import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
+import hashlib
+import json
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from utils.instrumentation import staged
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+CHART_KINDS = ("histogram", "heatmap")
+CHART_MANIFEST = ".charts.json"
+# Меняется при изменении оформления графиков, чтобы сохраненные хеши перестали совпадать
+CHART_STYLE_VERSION = 1
 
-def plot_histograms(data, mismatch_column, features):
-    """Строит гистограммы только для значимых переменных, связанных с расхождением."""
-    for feature in features:
-        plt.figure(figsize=(10, 6))
-        sns.countplot(data=data, x=feature, hue=mismatch_column, palette="viridis")
-        plt.title(f"Histogram of {mismatch_column} by {feature}")
-        plt.xlabel(feature)
-        plt.ylabel("Count")
-        plt.legend(title=mismatch_column, loc="upper right")
-        plt.xticks(rotation=45)
-        plt.tight_layout()
-        plt.savefig(f"output/{mismatch_column}_by_{feature}_histogram.png")
-        logging.info(f"Histogram saved: output/{mismatch_column}_by_{feature}_histogram.png")
-        plt.close()
 
+def chart_path(output_dir, mismatch_column, feature, kind):
+    """Возвращает путь к PNG-файлу графика."""
+    return Path(output_dir) / f"{mismatch_column}_by_{feature}_{kind}.png"
 
-def plot_heatmap(data, mismatch_column, features):
-    """Строит тепловые карты только для значимых взаимосвязей переменных."""
-    for feature in features:
-        contingency_table = pd.crosstab(data[mismatch_column], data[feature])
-        plt.figure(figsize=(10, 6))
-        sns.heatmap(contingency_table, annot=True, fmt="d", cmap="YlGnBu")
-        plt.title(f"Heatmap of {mismatch_column} by {feature}")
-        plt.xlabel(feature)
-        plt.ylabel(mismatch_column)
+
+def prepare_chart_tables(data, mismatch_columns, features):
+    """
+    Один раз считает таблицы сопряженности (mismatch_column x feature) для всех графиков.
+    По одной таблице строятся и гистограмма, и тепловая карта.
+    """
+    return {
+        (mismatch_column, feature): pd.crosstab(data[mismatch_column], data[feature])
+        for mismatch_column in mismatch_columns
+        for feature in features
+    }
+
+
+def table_hash(table, kind):
+    """Хеш содержимого агрегата, по которому строится график."""
+    payload = f"{CHART_STYLE_VERSION}\n{kind}\n{table.to_csv()}".encode()
+    return hashlib.sha256(payload).hexdigest()
+
+
+def load_chart_manifest(output_dir):
+    """Загружает хеши агрегатов, по которым были построены существующие графики."""
+    manifest_path = Path(output_dir) / CHART_MANIFEST
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def save_chart_manifest(output_dir, manifest):
+    """Сохраняет хеши агрегатов построенных графиков."""
+    with open(Path(output_dir) / CHART_MANIFEST, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def _plotting_modules():
+    """
+    Загружает pyplot и seaborn только при построении графиков: их импорт занимает
+    секунды и не нужен, если визуализация не запрашивалась.
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    return plt, sns
+
+
+def _draw_histogram(plt, sns, table, mismatch_column, feature):
+    # Как и countplot, рисуем только встречающиеся сочетания значений
+    counts = table.stack().rename("count").reset_index().query("count > 0")
+    sns.barplot(data=counts, x=feature, y="count", hue=mismatch_column, palette="viridis", errorbar=None)
+    plt.title(f"Histogram of {mismatch_column} by {feature}")
+    plt.xlabel(feature)
+    plt.ylabel("Count")
+    plt.legend(title=mismatch_column, loc="upper right")
+    plt.xticks(rotation=45)
+
+
+def _draw_heatmap(plt, sns, table, mismatch_column, feature):
+    sns.heatmap(table, annot=True, fmt="d", cmap="YlGnBu")
+    plt.title(f"Heatmap of {mismatch_column} by {feature}")
+    plt.xlabel(feature)
+    plt.ylabel(mismatch_column)
+
+
+def render_chart(kind, table, mismatch_column, feature, path):
+    """Строит один график по готовой таблице сопряженности на неинтерактивном бэкенде Agg."""
+    plt, sns = _plotting_modules()
+    plt.figure(figsize=(10, 6))
+    try:
+        (_draw_histogram if kind == "histogram" else _draw_heatmap)(plt, sns, table, mismatch_column, feature)
         plt.tight_layout()
-        plt.savefig(f"output/{mismatch_column}_by_{feature}_heatmap.png")
-        logging.info(f"Heatmap saved: output/{mismatch_column}_by_{feature}_heatmap.png")
+        plt.savefig(path)
+    finally:
         plt.close()
+    return str(path)
+
+
+def _render_task(task):
+    return render_chart(*task)
+
+
+@staged("render")
+def render_charts(tasks, workers=None):
+    """Строит графики в пуле процессов; при workers <= 1 — в текущем процессе."""
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        return [render_chart(*task) for task in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(_render_task, tasks))
 
 
-def visualize_mismatches(mismatched_data, mismatch_types, features):
-    """Визуализирует расхождения с помощью гистограмм и тепловых карт."""
-    for mismatch_type in mismatch_types:
-        # Построение гистограмм
-        plot_histograms(mismatched_data, mismatch_type, features)
-        # Построение тепловых карт
-        plot_heatmap(mismatched_data, mismatch_type, features)
+def visualize_mismatches(mismatched_data, mismatch_types, features, output_dir="output", workers=None):
+    """
+    Визуализирует расхождения с помощью гистограмм и тепловых карт.
+    Таблицы сопряженности считаются один раз, графики строятся параллельно.
+    График пропускается, если его файл существует, а хеш агрегата не изменился
+    с прошлого запуска. График без данных не строится, а его файл прошлого запуска
+    удаляется. Возвращает пути перестроенных графиков.
+    """
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    manifest = load_chart_manifest(output_dir)
+    tables = prepare_chart_tables(mismatched_data, mismatch_types, features)
+
+    tasks, hashes = [], {}
+    for (mismatch_column, feature), table in tables.items():
+        for kind in CHART_KINDS:
+            path = chart_path(output_dir, mismatch_column, feature, kind)
+            if table.empty:
+                # График прошлого запуска больше не соответствует данным
+                if path.exists():
+                    path.unlink()
+                    logging.warning(f"No data for {path.name}, chart skipped and its old file removed.")
+                else:
+                    logging.warning(f"No data for {path.name}, chart skipped.")
+                manifest.pop(path.name, None)
+                continue
+            digest = table_hash(table, kind)
+            if manifest.get(path.name) == digest and path.exists():
+                continue
+            tasks.append((kind, table, mismatch_column, feature, path))
+            hashes[path.name] = digest
+
+    rendered = render_charts(tasks, workers) if tasks else []
+    for path in rendered:
+        logging.info(f"Chart saved: {path}")
+    skipped = len(tables) * len(CHART_KINDS) - len(rendered)
+    logging.info(f"{len(rendered)} charts rendered, {skipped} unchanged or empty.")
+
+    save_chart_manifest(output_dir, {**manifest, **hashes})
+    return rendered
+
+
+def plot_histograms(data, mismatch_column, features, output_dir="output"):
+    """Строит гистограммы только для значимых переменных, связанных с расхождением."""
+    tables = prepare_chart_tables(data, [mismatch_column], features)
+    for (_, feature), table in tables.items():
+        path = chart_path(output_dir, mismatch_column, feature, "histogram")
+        render_chart("histogram", table, mismatch_column, feature, path)
+        logging.info(f"Histogram saved: {path}")
+
+
+def plot_heatmap(data, mismatch_column, features, output_dir="output"):
+    """Строит тепловые карты только для значимых взаимосвязей переменных."""
+    tables = prepare_chart_tables(data, [mismatch_column], features)
+    for (_, feature), table in tables.items():
+        path = chart_path(output_dir, mismatch_column, feature, "heatmap")
+        render_chart("heatmap", table, mismatch_column, feature, path)
+        logging.info(f"Heatmap saved: {path}")